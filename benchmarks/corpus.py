@@ -0,0 +1,114 @@
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from classifier.naive_bayes import ClassificationData
+
+_LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+# How much more likely a word of a class's polarity is in comments of that class
+_CLASS_BIAS = 0.5
+# Share of pushshift comments that mention one of the tickers
+_MENTION_RATE = 0.5
+# Daily volatility of the synthetic log prices, and how much of it follows the mentions of the day before
+_DAILY_VOLATILITY = 0.02
+_MENTION_EFFECT = 0.005
+
+
+def generate_vocabulary(size: int, seed: int = 0) -> np.ndarray:
+    """size distinct lowercase words of 2 to 10 letters. The generators below always use seed 0, so corpora
+    generated with different seeds still share their vocabulary."""
+    rng = np.random.default_rng(seed)
+    words: Dict[str, None] = {}
+    while len(words) < size:
+        lengths = rng.integers(2, 11, size=size)
+        letters = rng.choice(_LETTERS, size=int(lengths.sum()))
+        ends = np.cumsum(lengths)
+        for start, end in zip((ends - lengths).tolist(), ends.tolist()):
+            words.setdefault("".join(letters[start:end]), None)
+            if len(words) == size:
+                break
+    return np.array(list(words), dtype=object)
+
+
+def zipf_probabilities(size: int, exponent: float) -> np.ndarray:
+    """Probability of the word with rank k is proportional to 1 / k ** exponent"""
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_comments(count: int, vocabulary_size: int = 20000, zipf_exponent: float = 1.1,
+                      words_per_comment: Tuple[int, int] = (5, 40), seed: int = 0) -> List[str]:
+    """count comments of uniformly distributed length whose words follow a Zipfian distribution.
+    The same arguments always generate the same comments."""
+    rng = np.random.default_rng(seed)
+    vocabulary = generate_vocabulary(vocabulary_size)
+    return _sample_comments(rng, vocabulary, zipf_probabilities(vocabulary_size, zipf_exponent), count,
+                            words_per_comment)
+
+
+def generate_training_data(count: int, vocabulary_size: int = 20000, zipf_exponent: float = 1.1,
+                           words_per_comment: Tuple[int, int] = (5, 40),
+                           seed: int = 0) -> List[ClassificationData]:
+    """Labelled comments, half of them positive. Every word leans towards one class, so the classes can be told
+    apart without being trivially separable."""
+    rng = np.random.default_rng(seed)
+    vocabulary = generate_vocabulary(vocabulary_size)
+    polarity = rng.choice([-1.0, 1.0], size=vocabulary_size)
+    base = zipf_probabilities(vocabulary_size, zipf_exponent)
+    data: List[ClassificationData] = []
+    for classification, sign in ((1, 1.0), (0, -1.0)):
+        probabilities = base * (1 + _CLASS_BIAS * sign * polarity)
+        class_count = count // 2 if classification else count - count // 2
+        comments = _sample_comments(rng, vocabulary, probabilities / probabilities.sum(), class_count,
+                                    words_per_comment)
+        data.extend(ClassificationData.construct(comment=comment, classification=classification)
+                    for comment in comments)
+    order = rng.permutation(len(data))
+    return [data[i] for i in order]
+
+
+def generate_pushshift_comments(count: int, tickers: Sequence[str], after: int, before: int,
+                                vocabulary_size: int = 20000, zipf_exponent: float = 1.1,
+                                subreddit: str = "wallstreetbets", seed: int = 0) -> List[Dict]:
+    """pushshift-like comment records spread uniformly over the exclusive (after, before) window and sorted by
+    created_utc. About half of them mention a ticker (tickers themselves are Zipf distributed), some as $cashtags."""
+    rng = np.random.default_rng(seed)
+    bodies = generate_comments(count, vocabulary_size, zipf_exponent, seed=seed)
+    created = np.sort(rng.integers(after + 1, before, size=count))
+    # Most comments have few upvotes, like on reddit
+    scores = rng.geometric(0.3, size=count) - 1
+    mentions = rng.random(count) < _MENTION_RATE
+    mentioned = rng.choice(len(tickers), size=count, p=zipf_probabilities(len(tickers), zipf_exponent))
+    cashtags = rng.random(count) < 0.2
+    records = []
+    for i, body in enumerate(bodies):
+        if mentions[i]:
+            ticker = tickers[mentioned[i]]
+            body = f"{'$' if cashtags[i] else ''}{ticker} {body}"
+        records.append({"id": np.base_repr(i, 36).lower(), "created_utc": int(created[i]), "body": body,
+                        "score": int(scores[i]), "subreddit": subreddit})
+    return records
+
+
+def generate_daily_series(tickers: int, days: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """(tickers, days) arrays of daily mention counts (Poisson, ticker popularity Zipf distributed) and closing
+    prices. Every ticker's log returns partly follow its standardized mentions of the day before, so a backtest
+    has something to find."""
+    rng = np.random.default_rng(seed)
+    popularity = 1000 * zipf_probabilities(tickers, 1.1) * tickers / 10
+    mentions = rng.poisson(popularity[:, None] * rng.lognormal(0, 0.5, size=(tickers, days)))
+    attention = np.log1p(mentions)
+    attention = (attention - attention.mean(axis=1, keepdims=True)) / (attention.std(axis=1, keepdims=True) + 1e-9)
+    returns = rng.normal(0, _DAILY_VOLATILITY, size=(tickers, days))
+    returns[:, 1:] += _MENTION_EFFECT * attention[:, :-1]
+    closes = 10 * np.exp(np.cumsum(returns, axis=1))
+    return mentions, closes
+
+
+def _sample_comments(rng: np.random.Generator, vocabulary: np.ndarray, probabilities: np.ndarray, count: int,
+                     words_per_comment: Tuple[int, int]) -> List[str]:
+    lengths = rng.integers(words_per_comment[0], words_per_comment[1] + 1, size=count)
+    # Sample every word of the corpus at once, then cut it into comments
+    words = vocabulary[rng.choice(len(vocabulary), size=int(lengths.sum()), p=probabilities)]
+    ends = np.cumsum(lengths)
+    return [" ".join(words[start:end]) for start, end in zip((ends - lengths).tolist(), ends.tolist())]
@@ -0,0 +1,106 @@
+import asyncio
+import bisect
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class FakePushshift:
+    """Local stand-in for the pushshift comment search API, served from a background thread so both the requests
+    based and the aiohttp based clients can use it.
+
+    Supports the parameters the clients send (after, before, size, q, subreddit, ascending created_utc order).
+    Every response is delayed by latency_seconds. With rate_limit set, requests beyond rate_limit per second
+    (bursts of up to burst requests) get a 429 with a Retry-After of the time until the next request is allowed."""
+
+    def __init__(self, comments: List[Dict], latency_seconds: float = 0.0, rate_limit: Optional[float] = None,
+                 burst: int = 10):
+        self.comments = sorted(comments, key=lambda comment: comment["created_utc"])
+        self.latency_seconds = latency_seconds
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.requests_served = 0
+        self.requests_rate_limited = 0
+        self.url: Optional[str] = None
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        # query -> (created_utc of every match, matching comments), built on first use
+        self._indexes: Dict[Tuple[Optional[str], Optional[str]], Tuple[List[int], List[Dict]]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), name="fake-pushshift", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def __exit__(self, *args):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    @property
+    def comment_api(self) -> str:
+        """Value for ticker_service._PUSHSHIFT_COMMENT_API"""
+        return f"{self.url}/reddit/search/comment/"
+
+    def _serve(self, started: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.router.add_get("/reddit/search/comment/", self._search)
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        logger.debug(f"Fake pushshift serving {len(self.comments)} comments at {self.url}.")
+        started.set()
+        self._loop.run_forever()
+        self._loop.close()
+
+    def _take_token(self) -> float:
+        """0 if the request may be served, otherwise the seconds until it would be"""
+        if self.rate_limit is None:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate_limit)
+        self._last_refill = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate_limit
+
+    async def _search(self, request: web.Request) -> web.Response:
+        wait = self._take_token()
+        if wait:
+            self.requests_rate_limited += 1
+            return web.Response(status=429, headers={"Retry-After": f"{wait:.3f}"})
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        query = request.query
+        created, comments = self._index(query.get("q"), query.get("subreddit"))
+        start = bisect.bisect_right(created, int(query["after"]))
+        end = bisect.bisect_left(created, int(query["before"]))
+        page = comments[start:min(end, start + int(query.get("size", 25)))]
+        self.requests_served += 1
+        return web.Response(text=json.dumps({"data": page}), content_type="application/json")
+
+    def _index(self, query: Optional[str], subreddit: Optional[str]) -> Tuple[List[int], List[Dict]]:
+        key = (query.lower() if query else None, subreddit.lower() if subreddit else None)
+        if key not in self._indexes:
+            comments = [comment for comment in self.comments
+                        if (not key[0] or key[0] in comment["body"].lower())
+                        and (not key[1] or key[1] == comment.get("subreddit", "").lower())]
+            self._indexes[key] = ([comment["created_utc"] for comment in comments], comments)
+        return self._indexes[key]
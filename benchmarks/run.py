@@ -0,0 +1,283 @@
+"""Benchmarks of the classifier, the ticker aggregation and the backtest on synthetic data, fully offline.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --baseline results.json
+
+Every benchmark reports its throughput, the median time of one run, p50/p99 latency and peak memory (as traced by
+tracemalloc, in a separate run so tracing does not slow down the timed runs). With --baseline, results are
+compared to a previous --output file and the exit code is 1 if any benchmark got slower or bigger than allowed."""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from benchmarks.corpus import (generate_comments, generate_daily_series, generate_pushshift_comments,
+                               generate_training_data)
+from benchmarks.fake_pushshift import FakePushshift
+from classifier.naive_bayes import NaiveBayes
+from service import backtest_service, ticker_service
+from service.http_client import AsyncFetcher, TokenBucket
+from util.dates import utc_timestamp
+
+# Fixed so that the aggregation window, and with it every request, is the same on every run
+_AGGREGATION_END = datetime(2021, 3, 1)
+_TICKERS = ["GME", "AMC", "TSLA", "AAPL", "PLTR", "BB", "NOK", "SPCE", "NIO", "AMD", "MSFT", "NVDA", "SNDL", "TLRY",
+            "RKT", "CLOV", "WISH", "SOFI", "UWMC", "CRSR"]
+
+logger = logging.getLogger(__name__)
+
+
+class BenchmarkConfig(BaseModel):
+    comments: int = 50000
+    training_comments: int = 50000
+    vocabulary_size: int = 20000
+    zipf_exponent: float = 1.1
+    chunk_size: int = 5000
+    max_workers: int = 1
+    tickers: int = 10
+    aggregation_comments: int = 20000
+    latency_ms: float = 20
+    rate_limit: Optional[float] = 200
+    client_rate: float = 100
+    backtest_tickers: int = 5000
+    backtest_days: int = 500
+    repeat: int = 3
+    seed: int = 0
+
+
+class BenchmarkResult(BaseModel):
+    name: str
+    items: int
+    unit: str
+    # Median wall time of one run
+    seconds: float
+    throughput: float
+    p50_ms: float
+    p99_ms: float
+    peak_memory_mb: float
+    extra: Dict[str, float] = {}
+
+
+class _TimedFetcher(AsyncFetcher):
+    """Records the latency of every page, including retries and waiting for the rate limiter"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies: List[float] = []
+
+    async def get_comments(self, api_call: str) -> List[Dict]:
+        start = time.perf_counter()
+        try:
+            return await super().get_comments(api_call)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+def run_benchmarks(config: BenchmarkConfig, only: List[str] = None) -> Dict[str, BenchmarkResult]:
+    benchmarks = {"preprocess": bench_preprocess, "train": bench_train, "classify": bench_classify,
+                  "aggregate": bench_aggregate, "backtest": bench_backtest}
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if only and name not in only:
+            continue
+        logger.info(f"Running benchmark {name}.")
+        results[name] = benchmark(config)
+        logger.info(f"{name}: {results[name].throughput:.1f} {results[name].unit}/s")
+    return results
+
+
+def bench_preprocess(config: BenchmarkConfig) -> BenchmarkResult:
+    comments = generate_comments(config.comments, config.vocabulary_size, config.zipf_exponent, seed=config.seed)
+    naive_bayes = NaiveBayes(words_to_ignore=_TICKERS)
+    return _measure("preprocess", len(comments), "docs", config.repeat,
+                    lambda: _timed(lambda: list(naive_bayes.preprocess_data(comments))))
+
+
+def bench_train(config: BenchmarkConfig) -> BenchmarkResult:
+    training_data = generate_training_data(config.training_comments, config.vocabulary_size, config.zipf_exponent,
+                                           seed=config.seed)
+    return _measure("train", len(training_data), "docs", config.repeat,
+                    lambda: _timed(lambda: NaiveBayes().train(training_data)))
+
+
+def bench_classify(config: BenchmarkConfig) -> BenchmarkResult:
+    """Latency is per chunk of chunk_size documents, as seen by a consumer of iter_classify_batches"""
+    naive_bayes = NaiveBayes()
+    naive_bayes.train(generate_training_data(config.training_comments, config.vocabulary_size,
+                                             config.zipf_exponent, seed=config.seed))
+    comments = generate_comments(config.comments, config.vocabulary_size, config.zipf_exponent,
+                                 seed=config.seed + 1)
+
+    def run() -> List[float]:
+        latencies = []
+        start = time.perf_counter()
+        for _ in naive_bayes.iter_classify_batches(comments, config.max_workers, config.chunk_size):
+            latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+        return latencies
+
+    return _measure("classify", len(comments), "docs", config.repeat, run)
+
+
+def bench_aggregate(config: BenchmarkConfig) -> BenchmarkResult:
+    """count_all_ticker_comments_async against a local fake pushshift. Latency is per page."""
+    tickers = _TICKERS[:config.tickers]
+    from_date, to_date = ticker_service.get_start_and_end_date(_AGGREGATION_END, 1)
+    after, before = utc_timestamp(from_date), utc_timestamp(to_date)
+    comments = generate_pushshift_comments(config.aggregation_comments, tickers, after, before,
+                                           config.vocabulary_size, config.zipf_exponent, seed=config.seed)
+    api = ticker_service._PUSHSHIFT_COMMENT_API
+    with FakePushshift(comments, config.latency_ms / 1000, config.rate_limit) as server:
+        ticker_service._PUSHSHIFT_COMMENT_API = server.comment_api
+
+        def run() -> List[float]:
+            async def count():
+                limiter = TokenBucket(rate=config.client_rate, min_rate=config.client_rate / 10,
+                                      max_rate=config.client_rate)
+                async with _TimedFetcher(limiter=limiter) as fetcher:
+                    await ticker_service.count_all_ticker_comments_async(tickers, from_date, to_date, None,
+                                                                         fetcher=fetcher)
+                return fetcher.latencies
+
+            return asyncio.run(count())
+
+        try:
+            requests_before = server.requests_served
+            result = _measure("aggregate", 0, "requests", config.repeat, run)
+        finally:
+            ticker_service._PUSHSHIFT_COMMENT_API = api
+        # Every run sends the same requests, the peak memory run included
+        result.items = (server.requests_served - requests_before) // (config.repeat + 1)
+        result.throughput = result.items / result.seconds
+        result.extra["rate_limited"] = server.requests_rate_limited / (config.repeat + 1)
+    return result
+
+
+def bench_backtest(config: BenchmarkConfig) -> BenchmarkResult:
+    """Mention signal against forward returns over every horizon, throughput in (ticker, horizon) pairs"""
+    mentions, closes = generate_daily_series(config.backtest_tickers, config.backtest_days, seed=config.seed)
+    tickers = [f"T{i}" for i in range(config.backtest_tickers)]
+    days = np.datetime64("2019-01-01") + np.arange(config.backtest_days)
+    prices = backtest_service.Panel(tickers, days, closes)
+    signal = backtest_service.Panel(tickers, days, np.log1p(mentions))
+    result = _measure("backtest", config.backtest_tickers * len(backtest_service.HORIZONS), "ticker-horizons",
+                      config.repeat, lambda: _timed(lambda: backtest_service.backtest(signal, prices)))
+    # The synthetic returns follow the mentions of the day before, which the one day horizon should pick up
+    summary = backtest_service.backtest(signal, prices).summary()
+    result.extra["mean_correlation_1d"] = summary[0].mean_correlation
+    return result
+
+
+def _timed(function: Callable) -> List[float]:
+    start = time.perf_counter()
+    function()
+    return [time.perf_counter() - start]
+
+
+def _measure(name: str, items: int, unit: str, repeat: int, run: Callable[[], List[float]]) -> BenchmarkResult:
+    """Calls run (which returns its latency samples in seconds) repeat times, then once more with tracemalloc"""
+    run_seconds, latencies = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        latencies.extend(run())
+        run_seconds.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    seconds = float(np.median(run_seconds))
+    return BenchmarkResult(name=name, items=items, unit=unit, seconds=seconds,
+                           throughput=items / seconds if seconds else 0.0,
+                           p50_ms=float(np.percentile(latencies, 50)) * 1000 if latencies else 0.0,
+                           p99_ms=float(np.percentile(latencies, 99)) * 1000 if latencies else 0.0,
+                           peak_memory_mb=peak_memory / 2 ** 20)
+
+
+def compare(results: Dict[str, BenchmarkResult], baseline: Dict, tolerance: float) -> List[str]:
+    """Describes every benchmark whose run time or peak memory grew by more than tolerance over the baseline"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("seconds", "peak_memory_mb"):
+            current, reference = getattr(result, metric), previous[metric]
+            if reference and current > reference * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {current:.3f} vs {reference:.3f} in baseline "
+                                   f"(+{(current / reference - 1) * 100:.0f}%)")
+    return regressions
+
+
+def environment() -> Dict[str, str]:
+    return {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "processor": platform.processor(), "cpu_count": str(os.cpu_count())}
+
+
+def format_results(results: Dict[str, BenchmarkResult]) -> str:
+    lines = [f"{'benchmark':<12}{'items':>10}{'throughput':>24}{'run (s)':>10}{'p50 (ms)':>11}{'p99 (ms)':>11}"
+             f"{'peak (MB)':>11}"]
+    for result in results.values():
+        lines.append(f"{result.name:<12}{result.items:>10}{result.throughput:>12.1f} {result.unit + '/s':<11}"
+                     f"{result.seconds:>10.3f}{result.p50_ms:>11.2f}{result.p99_ms:>11.2f}"
+                     f"{result.peak_memory_mb:>11.1f}")
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=["preprocess", "train", "classify", "aggregate", "backtest"])
+    parser.add_argument("--quick", action="store_true", help="a tenth of the default corpus sizes")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare results to this JSON file written by --output")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative growth of run time and peak memory over the baseline")
+    parser.add_argument("--verbose", "-v", action="store_true")
+    for field in BenchmarkConfig.__fields__.values():
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=field.type_, default=None)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(asctime)s : %(threadName)s : %(name)s - %(message)s", datefmt="%X")
+    logging.getLogger(__name__).setLevel(logging.INFO)
+
+    config = BenchmarkConfig()
+    if args.quick:
+        config = config.copy(update={"comments": config.comments // 10,
+                                     "training_comments": config.training_comments // 10,
+                                     "aggregation_comments": config.aggregation_comments // 10,
+                                     "backtest_tickers": config.backtest_tickers // 10})
+    config = config.copy(update={name: getattr(args, name) for name in BenchmarkConfig.__fields__
+                                 if getattr(args, name) is not None})
+    results = run_benchmarks(config, args.only)
+    print(format_results(results))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"environment": environment(), "config": config.dict(),
+                       "results": {name: result.dict() for name, result in results.items()}}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config.dict():
+            logger.warning("Baseline was recorded with a different configuration, results are not comparable.")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
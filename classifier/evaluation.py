@@ -0,0 +1,184 @@
+import itertools
+import logging
+import os
+import time
+from concurrent import futures
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from classifier.naive_bayes import ClassificationData, NaiveBayes
+from classifier.vectorizer import CsrMatrix
+
+logger = logging.getLogger(__name__)
+
+# Feature matrix, fold of every document and configurations of a worker process, set once by _init_worker
+_worker_state: Optional[Tuple["FeatureMatrix", np.ndarray, List["Configuration"]]] = None
+
+# (tf_mode, tfidf, add_alpha_smoothing)
+Configuration = Tuple[NaiveBayes.Mode, bool, float]
+
+
+class EvaluationResult(BaseModel):
+    tf_mode: NaiveBayes.Mode
+    tfidf: bool
+    add_alpha_smoothing: float
+    accuracy: float
+    precision: float
+    recall: float
+    f1: float
+    # Seconds spent fitting and scoring this configuration, summed over all folds
+    seconds: float
+
+
+class CrossValidationReport(BaseModel):
+    # Sorted by F1, best first
+    results: List[EvaluationResult]
+    folds: int
+    num_documents: int
+    num_words: int
+    # Seconds spent tokenizing and vectorizing the documents, once for every fold and configuration
+    feature_seconds: float
+    seconds: float
+
+    @property
+    def best(self) -> EvaluationResult:
+        return self.results[0]
+
+
+class FeatureMatrix:
+    """Labelled documents tokenized and vectorized once, with the tokenizer of a NaiveBayes model. Every fold and
+    configuration of a cross-validation fits on row subsets of the same count matrix instead of re-tokenizing."""
+
+    def __init__(self, counts: CsrMatrix, labels: np.ndarray):
+        self.counts = counts
+        self.labels = labels
+
+    @classmethod
+    def build(cls, data_list: List[ClassificationData], model: NaiveBayes = None) -> "FeatureMatrix":
+        # A fresh model with the same tokenizer, so a trained model passed in is left untouched
+        vectorizer = NaiveBayes()
+        if model:
+            vectorizer.tokenizer = model.tokenizer
+        counts = vectorizer.vectorize(vectorizer.preprocess_data([data.comment for data in data_list]),
+                                      grow_vocabulary=True)
+        labels = np.fromiter((data.classification for data in data_list), dtype=np.int8, count=len(data_list))
+        return cls(counts, labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def margins(self, train_rows: np.ndarray, test_rows: np.ndarray, tf_mode: NaiveBayes.Mode, tfidf: bool,
+                add_alpha_smoothing: float) -> np.ndarray:
+        """Margins of the test rows under a model trained on the train rows, identical to training a NaiveBayes on
+        the train documents and scoring the test documents. Words that only occur in test rows are unknown to that
+        model, so they are left out of its vocabulary and score 0."""
+        counts = self.counts
+        if tf_mode is NaiveBayes.Mode.FREQ:
+            words_per_document = counts.row_sums()
+            data = counts.data / np.where(words_per_document > 0, words_per_document, 1)[counts.row_ids()]
+            weights = CsrMatrix(counts.indptr, counts.indices, data, counts.num_columns)
+        else:
+            weights = counts
+        labels = self.labels
+        num_docs = np.count_nonzero(train_rows)
+        num_pos_docs = np.count_nonzero(train_rows & (labels == 1))
+        num_neg_docs = np.count_nonzero(train_rows & (labels == 0))
+        document_frequency = counts.select_rows(train_rows).column_counts()
+        in_vocabulary = document_frequency > 0
+        term_sums = np.stack([weights.column_sums(train_rows & (labels == 1)),
+                              weights.column_sums(train_rows & (labels == 0))], axis=1)[in_vocabulary]
+        if tfidf:
+            term_sums = term_sums * np.log(num_docs / document_frequency[in_vocabulary])[:, None]
+        log_numerators = np.log(term_sums + add_alpha_smoothing)
+        log_denominators = np.log(term_sums.sum(axis=0) + np.count_nonzero(in_vocabulary))
+        log_odds = np.zeros(counts.num_columns)
+        log_odds[in_vocabulary] = (log_numerators[:, 0] - log_numerators[:, 1]) - \
+                                  (log_denominators[0] - log_denominators[1])
+        return counts.select_rows(test_rows).dot(log_odds) + (num_pos_docs - num_neg_docs) / num_docs
+
+
+def assign_folds(labels: np.ndarray, folds: int, seed: int = 0) -> np.ndarray:
+    """Fold number of every document. Documents are shuffled and dealt to the folds class by class, so every fold
+    has about the same share of positive documents."""
+    if not 2 <= folds <= len(labels):
+        raise ValueError(f"Cannot split {len(labels)} documents into {folds} folds.")
+    order = np.random.default_rng(seed).permutation(len(labels))
+    # Stable sort by class keeps the shuffled order within each class
+    order = order[np.argsort(labels[order], kind="stable")]
+    assignment = np.empty(len(labels), dtype=np.int64)
+    assignment[order] = np.arange(len(labels)) % folds
+    return assignment
+
+
+def cross_validate(data_list: List[ClassificationData], folds: int = 5,
+                   tf_modes: Sequence[NaiveBayes.Mode] = tuple(NaiveBayes.Mode), tfidf: Sequence[bool] = (True, False),
+                   add_alpha_smoothing: Sequence[float] = (1,), model: NaiveBayes = None,
+                   max_workers: Optional[int] = None, seed: int = 0) -> CrossValidationReport:
+    """k-fold cross-validation of every combination of tf_modes, tfidf and add_alpha_smoothing (a grid search).
+    The documents are tokenized once with the tokenizer of model (words to ignore, stopwords, n-grams), then
+    every fold is evaluated in its own process, fitting all configurations on the cached feature matrix.
+    max_workers=1 evaluates the folds in the current process.
+    Precision, recall and F1 are those of the positive class, pooled over all folds."""
+    timer_start = time.perf_counter()
+    features = FeatureMatrix.build(data_list, model)
+    feature_seconds = time.perf_counter() - timer_start
+    fold_of_document = assign_folds(features.labels, folds, seed)
+    configurations = list(itertools.product(tf_modes, tfidf, add_alpha_smoothing))
+    logger.info(f"Cross-validating {len(configurations)} configurations on {len(features)} documents "
+                f"with {folds} folds.")
+    if max_workers == 1:
+        _init_worker(features, fold_of_document, configurations)
+        fold_results = [_evaluate_fold(fold) for fold in range(folds)]
+    else:
+        with futures.ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count() or 1, folds),
+                                         initializer=_init_worker,
+                                         initargs=(features, fold_of_document, configurations)) as executor:
+            fold_results = list(executor.map(_evaluate_fold, range(folds)))
+    results = [_summarize(configuration, [fold_result[i] for fold_result in fold_results])
+               for i, configuration in enumerate(configurations)]
+    results.sort(key=lambda result: (result.f1, result.accuracy), reverse=True)
+    report = CrossValidationReport(results=results, folds=folds, num_documents=len(features),
+                                   num_words=features.counts.num_columns, feature_seconds=feature_seconds,
+                                   seconds=time.perf_counter() - timer_start)
+    for result in results:
+        logger.info(f"{result.tf_mode.value}, tfidf={result.tfidf}, alpha={result.add_alpha_smoothing}: "
+                    f"accuracy {result.accuracy:.3f}, precision {result.precision:.3f}, recall {result.recall:.3f}, "
+                    f"F1 {result.f1:.3f} in {result.seconds:.3f} seconds.")
+    return report
+
+
+def _init_worker(features: FeatureMatrix, fold_of_document: np.ndarray, configurations: List[Configuration]):
+    global _worker_state
+    _worker_state = (features, fold_of_document, configurations)
+
+
+def _evaluate_fold(fold: int) -> List[Tuple[Dict[str, int], float]]:
+    """Runs in a worker process, returns the confusion counts and seconds of every configuration on one fold"""
+    features, fold_of_document, configurations = _worker_state
+    test_rows = fold_of_document == fold
+    labels = features.labels[test_rows] == 1
+    results = []
+    for tf_mode, tfidf, add_alpha_smoothing in configurations:
+        start = time.perf_counter()
+        # if likelihoods are equal, consider it positive sentiment, as NaiveBayes does
+        predicted = features.margins(~test_rows, test_rows, tf_mode, tfidf, add_alpha_smoothing) >= 0
+        seconds = time.perf_counter() - start
+        results.append(({"tp": int(np.count_nonzero(predicted & labels)),
+                         "fp": int(np.count_nonzero(predicted & ~labels)),
+                         "fn": int(np.count_nonzero(~predicted & labels)),
+                         "tn": int(np.count_nonzero(~predicted & ~labels))}, seconds))
+    return results
+
+
+def _summarize(configuration: Configuration, fold_results: List[Tuple[Dict[str, int], float]]) -> EvaluationResult:
+    tf_mode, tfidf, add_alpha_smoothing = configuration
+    confusion = {key: sum(counts[key] for counts, _ in fold_results) for key in ("tp", "fp", "fn", "tn")}
+    precision = confusion["tp"] / max(confusion["tp"] + confusion["fp"], 1)
+    recall = confusion["tp"] / max(confusion["tp"] + confusion["fn"], 1)
+    return EvaluationResult(tf_mode=tf_mode, tfidf=tfidf, add_alpha_smoothing=add_alpha_smoothing,
+                            accuracy=(confusion["tp"] + confusion["tn"]) / max(sum(confusion.values()), 1),
+                            precision=precision, recall=recall,
+                            f1=2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+                            seconds=sum(seconds for _, seconds in fold_results))
@@ -1,39 +1,99 @@
+import json
 import logging
-import re
-from collections import defaultdict
+import os
+import struct
+from collections import deque
 from concurrent import futures
 from enum import Enum
-from typing import List
+from itertools import chain, islice
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
 
 import numpy as np
 from pydantic import BaseModel
 
+from classifier.tokenizer import Tokenizer
+from classifier.vectorizer import (CsrMatrix, MappedVocabulary, Vocabulary, count_matrix,
+                                   count_matrix_from_entries)
+from util.metrics import REGISTRY
+
+# Number of comments classified per task. Batches no larger than this are classified in-process
+_CHUNK_SIZE = 5000
+
 logger = logging.getLogger(__name__)
 
+_MODEL_MAGIC = b"NBMODEL\0"
+_MODEL_VERSION = 4
+# Arrays in a model file start at multiples of this many bytes
+_MODEL_ALIGNMENT = 4096
+
+_STAGE_METRIC = "classifier_stage_seconds"
+_STAGE_DESCRIPTION = "Seconds spent per classification stage and batch"
+
+# Trained model of a worker process, set once by _init_worker
+_worker_model: Optional["NaiveBayes"] = None
+
 
 class ClassificationData(BaseModel):
     comment: str
     classification: int
 
 
+class ClassificationScore(BaseModel):
+    comment: str
+    classification: int
+    # Probability of positive sentiment, calibrated if calibrate() was called
+    probability: float
+    # Log-odds of positive versus negative sentiment, the label is positive at margin >= 0
+    margin: float
+    # Words that moved the margin the most, with their contribution to it
+    top_words: List[Tuple[str, float]] = []
+
+
 class DocumentClass(BaseModel):
     prior: float
-    word_frequency = defaultdict(float)
-    log_likelihood = {}
 
 
 class NaiveBayes:
-    regex = re.compile(r'\W+')
     _ADD_ALPHA_SMOOTHING: int
-    vocabulary_frequency = defaultdict(int)
-    document_frequency = defaultdict(int)
+    vocabulary: Vocabulary
+    model_file: Optional[str] = None
     negative_class: DocumentClass
     positive_class: DocumentClass
     test_results: List[ClassificationData]
 
-    def __init__(self, add_alpha_smoothing: int = 1, words_to_ignore: List[str] = None):
+    def __init__(self, add_alpha_smoothing: int = 1, words_to_ignore: List[str] = None, stopwords: List[str] = None,
+                 ngram_range: Tuple[int, int] = (1, 1)):
         self.filters = words_to_ignore
+        self.tokenizer = Tokenizer(words_to_ignore, stopwords, ngram_range)
         self._ADD_ALPHA_SMOOTHING = add_alpha_smoothing
+        self.reset()
+
+    def reset(self):
+        """Forgets everything learned so far. Sufficient statistics are kept per instance, indexed by word id,
+        with column 0 for the positive and column 1 for the negative class."""
+        self.vocabulary = Vocabulary()
+        self.model_file = None
+        self.tf_mode: Optional[NaiveBayes.Mode] = None
+        self.tfidf: Optional[bool] = None
+        # Sum of the (count or frequency) term weights of every word per class. Per word arrays can have spare
+        # rows beyond the vocabulary size, see _resize
+        self.term_sums = np.zeros((0, 2))
+        # Number of documents each word appears in
+        self.document_frequency = np.zeros(0, dtype=np.int64)
+        self.class_document_counts = np.zeros(2, dtype=np.int64)
+        # Without tf-idf, the word weights equal term_sums, so their totals can be kept up to date incrementally
+        self.class_weight_totals = np.zeros(2)
+        # log(weight + alpha) per word and class, and log(total weight + vocabulary size) per class
+        self.log_numerators = np.zeros((0, 2))
+        self.log_denominators = np.zeros(2)
+        # Ids of the words whose log-likelihoods are outdated, None when everything is up to date
+        self._touched_words: Optional[List[np.ndarray]] = None
+        # Positive minus negative log numerator per word, and the same difference of the log denominators, which
+        # every token pays once. Scoring a token is a lookup and add, and refreshing only touches the updated words
+        self.log_odds = np.zeros(0)
+        self.log_denominator_odds = 0.0
+        # (scale, offset) applied to the margin before the sigmoid, see calibrate()
+        self.calibration: Tuple[float, float] = (1.0, 0.0)
 
     class Mode(Enum):
         COUNT = "count"
@@ -47,96 +107,389 @@ class NaiveBayes:
 
     def preprocess_data(self, documents: List[str]):
         for comment in documents:
-            if self.filters:
-                for string in self.filters:
-                    comment = comment.replace(string, "")
-            yield self.regex.sub(' ', comment).lower().strip()
+            yield self.tokenizer.normalize(comment)
+
+    def vectorize(self, comments: Iterable[str], grow_vocabulary: bool = False) -> CsrMatrix:
+        """Turns preprocessed comments into a document-term count matrix.
+        When grow_vocabulary is False, words missing from the vocabulary are dropped."""
+        if grow_vocabulary:
+            token_ids = [self.vocabulary.add(self.tokenizer.tokenize(comment)) for comment in comments]
+            return count_matrix(token_ids, len(self.vocabulary))
+        token_lists = [self.tokenizer.tokenize(comment) for comment in comments]
+        lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+        # Look up every token of the batch at once and drop unknown words
+        ids = self.vocabulary.lookup_array([token for tokens in token_lists for token in tokens])
+        rows = np.repeat(np.arange(len(token_lists), dtype=np.int64), lengths)
+        known = ids >= 0
+        return count_matrix_from_entries(rows[known], ids[known], len(token_lists), len(self.vocabulary))
 
-    def calculate_word_weights(self, documents: List[str], df, tf_mode: Mode):
+    def calculate_word_weights(self, counts: CsrMatrix, tf_mode: Mode) -> CsrMatrix:
         """Used to calculate word weights. tf_mode is the weighting scheme used on the frequency term.
         To use the raw word count, pass in 'count'.
         To use term frequency (raw count divided by words in document), pass in 'frequency'
         See: https://en.wikipedia.org/wiki/Tf%E2%80%93idf (tf weighting schemes: raw count, term frequency)"""
-        tf = defaultdict(int)
-        for comment in self.preprocess_data(documents):
-            local_tf = defaultdict(int)
-            words = comment.split()
-            for word in words:
-                if word:
-                    self.vocabulary_frequency[word] += 1
-                    local_tf[word] += 1
-            if tf_mode is self.Mode.FREQ:
-                num_words = len(words)
-                local_tf = {k: v / num_words for k, v in local_tf.items()}
-            for k, v in local_tf.items():
-                tf[k] += v
-                df[k] += 1
-        return tf
-
-    def apply_tf_idf(self, tf, num_docs):
-        """See: https://en.wikipedia.org/wiki/Tf%E2%80%93idf (weighting scheme 1)"""
-        for k, v in tf.items():
-            idf = np.log(num_docs / self.document_frequency[k])
-            tf[k] = v * idf
+        if tf_mode is self.Mode.FREQ:
+            words_per_document = counts.row_sums()
+            data = counts.data / words_per_document[counts.row_ids()]
+            return CsrMatrix(counts.indptr, counts.indices, data, counts.num_columns)
+        return counts
+
+    def apply_tf_idf(self, term_sums: np.ndarray) -> np.ndarray:
+        """See: https://en.wikipedia.org/wiki/Tf%E2%80%93idf (weighting scheme 1)
+        idf only depends on the word, so weighting the per class sums equals weighting every document."""
+        num_docs = self.class_document_counts.sum()
+        idf = np.log(num_docs / self.document_frequency[:len(term_sums)])
+        return term_sums * idf[:, None]
 
     def calculate_log_likelihood(self):
-        num_words_in_vocabulary = len(self.vocabulary_frequency)
-        for word in self.vocabulary_frequency:
-            # todo: ensure denominator is correct
-            # bayes_denominator = self.vocabulary_frequency[word] + self._ADD_ALPHA_SMOOTHING
-            for cl in self.positive_class, self.negative_class:
-                cl.log_likelihood[word] = np.log((cl.word_frequency[word] + self._ADD_ALPHA_SMOOTHING) /
-                                                 (sum(cl.word_frequency.values()) + num_words_in_vocabulary))
+        """Brings the log-likelihood terms up to date with the statistics. Called lazily before scoring, so several
+        partial_fit calls in a row only pay for this once. Without tf-idf only the words touched since the last call
+        are recomputed; with tf-idf the idf of every word changes with the number of documents, so all are."""
+        if self._touched_words is None:
+            return
+        num_words_in_vocabulary = len(self.vocabulary)
+        if self.tfidf:
+            word_weights = self.apply_tf_idf(self.term_sums[:num_words_in_vocabulary])
+            self.log_numerators = np.log(word_weights + self._ADD_ALPHA_SMOOTHING)
+            self.log_odds = self.log_numerators[:, 0] - self.log_numerators[:, 1]
+            class_weight_totals = word_weights.sum(axis=0)
+        else:
+            self.log_numerators = _resize(self.log_numerators, num_words_in_vocabulary)
+            self.log_odds = _resize(self.log_odds, num_words_in_vocabulary)
+            touched = np.unique(np.concatenate(self._touched_words))
+            self.log_numerators[touched] = np.log(self.term_sums[touched] + self._ADD_ALPHA_SMOOTHING)
+            self.log_odds[touched] = self.log_numerators[touched, 0] - self.log_numerators[touched, 1]
+            class_weight_totals = self.class_weight_totals
+        # todo: ensure denominator is correct
+        self.log_denominators = np.log(class_weight_totals + num_words_in_vocabulary)
+        self.log_denominator_odds = float(self.log_denominators[0] - self.log_denominators[1])
+        self._touched_words = None
+
+    @property
+    def log_likelihoods(self) -> np.ndarray:
+        """(words, 2) array of log-likelihoods, column 0 for the positive and column 1 for the negative class"""
+        self.calculate_log_likelihood()
+        return self.log_numerators[:len(self.vocabulary)] - self.log_denominators
 
     def train(self, data_list: List[ClassificationData], tf_mode: Mode = Mode.FREQ, tfidf=True):
         """tfidf specifies whether to weigh the words using term frequency - inverse document frequency algorithm"""
-        positive_docs = [data.comment for data in data_list if data.classification == 1]
-        negative_docs = [data.comment for data in data_list if data.classification == 0]
+        self.reset()
+        self.partial_fit(data_list, tf_mode, tfidf)
+        self.calculate_log_likelihood()
+        logger.debug("Successfully trained classifier.")
+
+    def partial_fit(self, data_list: List[ClassificationData], tf_mode: Mode = Mode.FREQ, tfidf=True):
+        """Updates the model with a new labeled batch in time proportional to the batch. The weighting scheme
+        is fixed by the first batch the model is trained on."""
+        if self.model_file:
+            raise ValueError(f"Model loaded from {self.model_file} has no training statistics to update.")
+        if self.tf_mode is None:
+            self.tf_mode, self.tfidf = tf_mode, tfidf
+        elif (self.tf_mode, self.tfidf) != (tf_mode, tfidf):
+            raise ValueError(f"Model was trained with tf_mode={self.tf_mode}, tfidf={self.tfidf}, "
+                             f"got tf_mode={tf_mode}, tfidf={tfidf}.")
+        labels = np.fromiter((data.classification for data in data_list), dtype=np.int8, count=len(data_list))
         num_docs = len(data_list)
-        num_pos_docs = len(positive_docs)
-        num_neg_docs = len(negative_docs)
+        num_pos_docs = int(np.count_nonzero(labels == 1))
+        num_neg_docs = int(np.count_nonzero(labels == 0))
         logger.info(
             f"Training data using {num_docs} total docs. {num_pos_docs} are positive, {num_neg_docs} are negative."
             f"Term frequency mode: {tf_mode}, tf-idf weighting is set to {tfidf}.")
-        pos_freq = self.calculate_word_weights(positive_docs, self.document_frequency, tf_mode)
-        neg_freq = self.calculate_word_weights(negative_docs, self.document_frequency, tf_mode)
-        if tfidf:
-            self.apply_tf_idf(pos_freq, num_docs)
-            self.apply_tf_idf(neg_freq, num_docs)
-        self.positive_class = DocumentClass(prior=num_pos_docs / num_docs, word_frequency=pos_freq)
-        self.negative_class = DocumentClass(prior=num_neg_docs / num_docs, word_frequency=neg_freq)
-        self.calculate_log_likelihood()
-        logger.debug("Successfully trained classifier.")
+        counts = self.vectorize(self.preprocess_data([data.comment for data in data_list]), grow_vocabulary=True)
+        num_words_in_vocabulary = len(self.vocabulary)
+        self.term_sums = _resize(self.term_sums, num_words_in_vocabulary)
+        self.document_frequency = _resize(self.document_frequency, num_words_in_vocabulary)
+        np.add.at(self.document_frequency, counts.indices, 1)
+        weights = self.calculate_word_weights(counts, tf_mode)
+        row_labels = labels[weights.row_ids()]
+        for column, label in enumerate((1, 0)):
+            in_class = row_labels == label
+            np.add.at(self.term_sums[:, column], weights.indices[in_class], weights.data[in_class])
+            self.class_weight_totals[column] += weights.data[in_class].sum()
+        self.class_document_counts += (num_pos_docs, num_neg_docs)
+        total_docs = self.class_document_counts.sum()
+        self.positive_class = DocumentClass(prior=self.class_document_counts[0] / total_docs)
+        self.negative_class = DocumentClass(prior=self.class_document_counts[1] / total_docs)
+        self._touched_words = (self._touched_words or []) + [counts.indices]
 
-    def test(self, documents):
-        results = []
+    def test(self, documents, max_workers: Optional[int] = None, chunk_size: int = _CHUNK_SIZE):
         logger.info(f"Testing {len(documents)} documents.")
-        with futures.ThreadPoolExecutor() as executor:
-            future_list = []
-            for comment in self.preprocess_data(documents):
-                future_list.append(executor.submit(self.classify_document, comment))
-            for future in futures.as_completed(future_list):
-                classification = future.result()
-                results.append(classification)
+        # Results are already validated, so skip pydantic validation for every comment
+        results = [ClassificationData.construct(comment=comment, classification=classification)
+                   for comment, classification in self.classify_batch(documents, max_workers, chunk_size)]
         self.test_results = results
         logger.debug(f"Successfully classified Data.")
         return results
 
-    def classify_document(self, comment):
-        pos_log_likelihood = self.positive_class.prior
-        neg_log_likelihood = self.negative_class.prior
-        for word in comment.split():
-            if word and word in self.vocabulary_frequency.keys():
-                pos_log_likelihood += self.positive_class.log_likelihood[word]
-                neg_log_likelihood += self.negative_class.log_likelihood[word]
+    def classify_batch(self, documents: Sequence[str], max_workers: Optional[int] = None,
+                       chunk_size: int = _CHUNK_SIZE) -> List[List]:
+        """Classifies raw documents in chunks across a process pool and returns [comment, classification] pairs
+        in input order. The trained model is sent to each worker once when the pool starts.
+        Batches of at most chunk_size documents, or max_workers=1, are classified in the current process."""
+        if len(documents) <= chunk_size or max_workers == 1:
+            return _classify_chunk_with(self, documents)
+        chunks = [documents[i:i + chunk_size] for i in range(0, len(documents), chunk_size)]
+        logger.debug(f"Classifying {len(documents)} documents in {len(chunks)} chunks.")
+        results = []
+        with futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                         initargs=(self,)) as executor:
+            for chunk_results in executor.map(_classify_chunk, chunks):
+                results.extend(_merge_worker_metrics(chunk_results))
+        return results
+
+    def classify_documents(self, comments: List[str]) -> np.ndarray:
+        """Classifies a batch of preprocessed comments with one sparse matrix product. Returns an array of 0/1 labels."""
         # if likelihoods are equal, consider it positive sentiment
-        if pos_log_likelihood >= neg_log_likelihood:
-            return ClassificationData(comment=comment, classification=1)
+        return (self.score_documents(comments) >= 0).astype(int)
+
+    def score_documents(self, comments: List[str]) -> np.ndarray:
+        """Log-odds margin (positive minus negative log-likelihood) of every preprocessed comment"""
+        self.calculate_log_likelihood()
+        with REGISTRY.time(_STAGE_METRIC, _STAGE_DESCRIPTION, stage="tokenize"):
+            counts = self.vectorize(comments)
+        with REGISTRY.time(_STAGE_METRIC, _STAGE_DESCRIPTION, stage="score"):
+            return self._margins(counts)
+
+    def _margins(self, counts: CsrMatrix) -> np.ndarray:
+        return counts.dot(self.log_odds) - self.log_denominator_odds * counts.row_sums() + \
+               (self.positive_class.prior - self.negative_class.prior)
+
+    def probabilities(self, margins: np.ndarray) -> np.ndarray:
+        """Probability of positive sentiment for each margin"""
+        scale, offset = self.calibration
+        return _sigmoid(scale * margins + offset)
+
+    def score_batch(self, documents: Sequence[str], top_k: int = 0, threshold: float = 0.5) -> List[ClassificationScore]:
+        """Classifies raw documents like classify_batch, also returning the margin, the probability and (with
+        top_k > 0) the top_k words with the largest contribution to the margin. A document is labelled positive
+        when its probability is at least threshold."""
+        comments = list(self.preprocess_data(documents))
+        self.calculate_log_likelihood()
+        counts = self.vectorize(comments)
+        margins = self._margins(counts)
+        probabilities = self.probabilities(margins)
+        top_words = self._top_words(counts, top_k) if top_k > 0 else [[] for _ in comments]
+        return [ClassificationScore.construct(comment=comment, classification=int(probability >= threshold),
+                                              probability=probability, margin=margin, top_words=words)
+                for comment, margin, probability, words in
+                zip(comments, margins.tolist(), probabilities.tolist(), top_words)]
+
+    def _top_words(self, counts: CsrMatrix, top_k: int) -> List[List[Tuple[str, float]]]:
+        contributions = counts.data * (self.log_odds[counts.indices] - self.log_denominator_odds)
+        rows = []
+        for start, end in zip(counts.indptr[:-1].tolist(), counts.indptr[1:].tolist()):
+            magnitudes = -np.abs(contributions[start:end])
+            top = np.argpartition(magnitudes, top_k)[:top_k] if end - start > top_k else np.arange(end - start)
+            rows.append(start + top[np.argsort(magnitudes[top], kind="stable")])
+        words = self.vocabulary.words_for(counts.indices[np.concatenate(rows)]) if rows else []
+        values = contributions[np.concatenate(rows)].tolist() if rows else []
+        results, position = [], 0
+        for row in rows:
+            results.append(list(zip(words[position:position + len(row)], values[position:position + len(row)])))
+            position += len(row)
+        return results
+
+    def calibrate(self, data_list: List[ClassificationData], iterations: int = 50) -> Tuple[float, float]:
+        """Fits the sigmoid that turns margins into probabilities (Platt scaling) on labelled comments, ideally
+        ones the model was not trained on. Naive Bayes margins are usually overconfident, so the fitted scale
+        tends to be below 1."""
+        margins = self.score_documents(list(self.preprocess_data([data.comment for data in data_list])))
+        labels = np.fromiter((data.classification for data in data_list), dtype=np.float64, count=len(data_list))
+        num_pos = labels.sum()
+        num_neg = len(labels) - num_pos
+        # Platt's smoothed targets keep the fit from diverging on separable data
+        targets = np.where(labels == 1, (num_pos + 1) / (num_pos + 2), 1 / (num_neg + 2))
+        features = np.stack([margins, np.ones_like(margins)], axis=1)
+        params = np.array([1.0, 0.0])
+        for _ in range(iterations):
+            probabilities = _sigmoid(features @ params)
+            gradient = features.T @ (probabilities - targets)
+            weights = probabilities * (1 - probabilities) + 1e-12
+            hessian = (features * weights[:, None]).T @ features + 1e-9 * np.eye(2)
+            step = np.linalg.solve(hessian, gradient)
+            params -= step
+            if np.abs(step).max() < 1e-9:
+                break
+        self.calibration = (float(params[0]), float(params[1]))
+        logger.info(f"Calibrated probabilities with scale {params[0]:.4f} and offset {params[1]:.4f}.")
+        return self.calibration
+
+    def classify_document(self, comment):
+        classification = int(self.classify_documents([comment])[0])
+        return ClassificationData(comment=comment, classification=classification)
+
+    def iter_classify_batches(self, documents: Iterable[str], max_workers: Optional[int] = None,
+                              chunk_size: int = _CHUNK_SIZE) -> Iterator[List[List]]:
+        """Streaming version of classify_batch. Consumes documents chunk by chunk and yields the
+        [comment, classification] pairs of every chunk in input order. At most two chunks per worker are
+        held in memory at any time, regardless of how many documents the iterable produces."""
+        documents = iter(documents)
+        chunks = iter(lambda: list(islice(documents, chunk_size)), [])
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            return
+        second_chunk = next(chunks, None)
+        if second_chunk is None or max_workers == 1:
+            # Small input (or no parallelism wanted): skip starting a process pool
+            yield _classify_chunk_with(self, first_chunk)
+            for chunk in chain([second_chunk] if second_chunk else [], chunks):
+                yield _classify_chunk_with(self, chunk)
+            return
+        max_workers = max_workers or os.cpu_count() or 1
+        with futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                         initargs=(self,)) as executor:
+            pending = deque()
+            for chunk in chain([first_chunk, second_chunk], chunks):
+                pending.append(executor.submit(_classify_chunk, chunk))
+                if len(pending) >= 2 * max_workers:
+                    yield _merge_worker_metrics(pending.popleft().result())
+            while pending:
+                yield _merge_worker_metrics(pending.popleft().result())
+
+    def save(self, file_name: str):
+        """Saves the trained model in a compact binary layout that load() can memory-map:
+        a JSON header followed by the sorted vocabulary (word offsets into one utf-8 blob of all words), the
+        (words, 2) float64 log-likelihood array and the per word log-odds in the same order. Offsets in the header
+        are relative to the first aligned byte after the header."""
+        words = [word.encode("utf-8") for word in self.vocabulary.words()]
+        order = sorted(range(len(words)), key=words.__getitem__)
+        sorted_vocabulary = MappedVocabulary.from_words([words[i] for i in order])
+        blob = sorted_vocabulary.blob
+        # 4 byte offsets unless the words take up more than 4 GiB
+        offsets = sorted_vocabulary.offsets.astype(np.uint32 if len(blob) <= np.iinfo(np.uint32).max else np.uint64)
+        log_likelihoods = np.ascontiguousarray(self.log_likelihoods[order])
+        log_odds = np.ascontiguousarray(log_likelihoods[:, 0] - log_likelihoods[:, 1])
+        blob_offset = _align(offsets.nbytes)
+        log_likelihoods_offset = _align(blob_offset + blob.nbytes)
+        log_odds_offset = _align(log_likelihoods_offset + log_likelihoods.nbytes)
+        header = json.dumps({
+            "version": _MODEL_VERSION,
+            "add_alpha_smoothing": self._ADD_ALPHA_SMOOTHING,
+            "words_to_ignore": self.filters,
+            "stopwords": sorted(self.tokenizer.stopwords),
+            "ngram_range": self.tokenizer.ngram_range,
+            "positive_prior": self.positive_class.prior,
+            "negative_prior": self.negative_class.prior,
+            "num_words": len(words),
+            "offsets_dtype": offsets.dtype.str,
+            "blob_offset": blob_offset,
+            "blob_size": blob.nbytes,
+            "log_likelihoods_offset": log_likelihoods_offset,
+            "log_odds_offset": log_odds_offset,
+            "calibration": self.calibration,
+        }).encode("utf-8")
+        data_offset = _align(len(_MODEL_MAGIC) + 4 + len(header))
+        with open(file_name, "wb") as f:
+            f.write(_MODEL_MAGIC + struct.pack("<I", len(header)) + header)
+            f.seek(data_offset)
+            f.write(offsets.tobytes())
+            f.seek(data_offset + blob_offset)
+            f.write(blob.tobytes())
+            f.seek(data_offset + log_likelihoods_offset)
+            f.write(log_likelihoods.tobytes())
+            f.seek(data_offset + log_odds_offset)
+            f.write(log_odds.tobytes())
+        logger.info(f"Saved model with {len(words)} words to {file_name}.")
+
+    @classmethod
+    def load(cls, file_name: str, words_to_ignore: List[str] = None) -> "NaiveBayes":
+        """Loads a model written by save(). The vocabulary and log-likelihoods are memory-mapped rather than read,
+        so loading is near-instant and processes loading the same file share one copy.
+        words_to_ignore replaces the filters stored with the model when given."""
+        with open(file_name, "rb") as f:
+            if f.read(len(_MODEL_MAGIC)) != _MODEL_MAGIC:
+                raise ValueError(f"{file_name} is not a NaiveBayes model file.")
+            header_length, = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_length))
+        if header["version"] != _MODEL_VERSION:
+            raise ValueError(f"Unsupported model version {header['version']} in {file_name}.")
+        num_words = header["num_words"]
+        data_offset = _align(len(_MODEL_MAGIC) + 4 + header_length)
+        model = cls(header["add_alpha_smoothing"], words_to_ignore or header["words_to_ignore"], header["stopwords"],
+                    header["ngram_range"])
+        offsets = np.memmap(file_name, dtype=header["offsets_dtype"], mode="r", offset=data_offset,
+                            shape=(num_words + 1,))
+        blob = np.memmap(file_name, dtype=np.uint8, mode="r", offset=data_offset + header["blob_offset"],
+                         shape=(header["blob_size"],))
+        if num_words:
+            model.log_numerators = np.memmap(file_name, dtype=np.float64, mode="r",
+                                             offset=data_offset + header["log_likelihoods_offset"],
+                                             shape=(num_words, 2))
+            # Mapped as well rather than derived from the log-likelihoods, which would give every process that
+            # loads the model its own copy
+            model.log_odds = np.memmap(file_name, dtype=np.float64, mode="r",
+                                       offset=data_offset + header["log_odds_offset"], shape=(num_words,))
         else:
-            return ClassificationData(comment=comment, classification=0)
+            model.log_numerators = np.empty((0, 2))
+            model.log_odds = np.zeros(0)
+        # The stored log-likelihoods already include the denominators
+        model.log_denominators = np.zeros(2)
+        model.calibration = tuple(header["calibration"])
+        model.vocabulary = MappedVocabulary(offsets, blob)
+        model.positive_class = DocumentClass(prior=header["positive_prior"])
+        model.negative_class = DocumentClass(prior=header["negative_prior"])
+        model.model_file = file_name
+        return model
+
+    def __reduce_ex__(self, protocol):
+        # A memory-mapped model is sent to workers by file name, so every process maps the same file
+        if self.model_file:
+            return NaiveBayes.load, (self.model_file, self.filters)
+        return super().__reduce_ex__(protocol)
+
+    def __getstate__(self):
+        # Previous test results are not needed to classify, so keep them out of what is sent to workers
+        state = self.__dict__.copy()
+        state.pop("test_results", None)
+        return state
 
     def convert_to_list(self) -> List[List]:
         results = []
         for result in self.test_results:
             results.append([result.comment, result.classification])
         return results
+
+
+def _sigmoid(values: np.ndarray) -> np.ndarray:
+    # exp(-log(1 + exp(-x))) does not overflow for large negative margins
+    return np.exp(-np.logaddexp(0, -values))
+
+
+def _resize(array: np.ndarray, num_words: int) -> np.ndarray:
+    """Zero-pads a per word statistics array to at least num_words rows. Capacity doubles so that growing the
+    vocabulary one batch at a time costs amortized time proportional to the new words only."""
+    if len(array) >= num_words:
+        return array
+    resized = np.zeros((max(num_words, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    resized[:len(array)] = array
+    return resized
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _MODEL_ALIGNMENT) * _MODEL_ALIGNMENT
+
+
+def _init_worker(model: NaiveBayes):
+    global _worker_model
+    _worker_model = model
+    # Forked workers inherit the parent's metrics, which must not be sent back and counted twice
+    REGISTRY.reset()
+
+
+def _classify_chunk(documents: Sequence[str]) -> Tuple[List[List], Tuple]:
+    """Runs in a worker process, returns the chunk's results and the metrics recorded while classifying it"""
+    return _classify_chunk_with(_worker_model, documents), REGISTRY.drain()
+
+
+def _merge_worker_metrics(chunk_results: Tuple[List[List], Tuple]) -> List[List]:
+    results, metrics = chunk_results
+    REGISTRY.merge(metrics)
+    return results
+
+
+def _classify_chunk_with(model: NaiveBayes, documents: Sequence[str]) -> List[List]:
+    with REGISTRY.time(_STAGE_METRIC, _STAGE_DESCRIPTION, stage="preprocess"):
+        comments = list(model.preprocess_data(documents))
+    classifications = model.classify_documents(comments).tolist()
+    REGISTRY.counter("classifier_documents_total", "Documents classified").inc(len(comments))
+    return [[comment, classification] for comment, classification in zip(comments, classifications)]
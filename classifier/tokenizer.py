@@ -0,0 +1,64 @@
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+_NON_WORD_REGEX = re.compile(r'\W+')
+
+
+class Tokenizer:
+    """Preprocessing shared by training and scoring.
+
+    All words_to_ignore are compiled into one case-insensitive pattern that only matches whole words, built as a
+    trie so the work per character is bounded by the longest ignore word rather than the number of ignore words.
+    normalize() returns the cleaned comment text, tokenize() turns a normalized comment into its tokens,
+    dropping stopwords and adding n-grams (joined by a space) for every n in ngram_range."""
+
+    def __init__(self, words_to_ignore: Iterable[str] = None, stopwords: Iterable[str] = None,
+                 ngram_range: Tuple[int, int] = (1, 1)):
+        self.words_to_ignore = sorted({word for word in words_to_ignore or [] if word})
+        self.stopwords = frozenset(word.lower() for word in stopwords or [])
+        self.ngram_range = tuple(ngram_range)
+        if not 1 <= self.ngram_range[0] <= self.ngram_range[1]:
+            raise ValueError(f"Invalid ngram_range {ngram_range}.")
+        self.ignore_regex = compile_word_pattern(self.words_to_ignore)
+
+    def normalize(self, comment: str) -> str:
+        if self.ignore_regex:
+            comment = self.ignore_regex.sub(' ', comment)
+        return _NON_WORD_REGEX.sub(' ', comment).lower().strip()
+
+    def tokenize(self, normalized_comment: str) -> List[str]:
+        words = normalized_comment.split()
+        if self.stopwords:
+            words = [word for word in words if word not in self.stopwords]
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return words
+        tokens = words if min_n == 1 else []
+        for n in range(max(min_n, 2), max_n + 1):
+            tokens.extend(' '.join(words[i:i + n]) for i in range(len(words) - n + 1))
+        return tokens
+
+
+def compile_word_pattern(words: Iterable[str]) -> Optional[Pattern]:
+    """Compiles words into one case-insensitive regex that matches any of them as a whole word"""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word.lower():
+            node = node.setdefault(char, {})
+        node[''] = {}
+    if not trie:
+        return None
+    # Words may start or end with non-word characters (e.g. "$GME"), where \b would not match
+    return re.compile(r'(?<!\w)' + _trie_to_pattern(trie) + r'(?!\w)', re.IGNORECASE)
+
+
+def _trie_to_pattern(node: Dict) -> str:
+    ends_here = '' in node
+    branches = [re.escape(char) + _trie_to_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if ends_here:
+        pattern = '(?:' + pattern + ')?'
+    return pattern
@@ -0,0 +1,221 @@
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+# Bytes of two words compared at once when searching a MappedVocabulary
+_CHUNK_BYTES = 8
+# Masks keeping the first n of _CHUNK_BYTES big-endian bytes, indexed by n
+_PREFIX_MASKS = np.array([(1 << 64) - (1 << (64 - 8 * n)) for n in range(_CHUNK_BYTES + 1)], dtype=np.uint64)
+
+logger = logging.getLogger(__name__)
+
+
+class Vocabulary:
+    """Interns words into contiguous integer ids so documents can be stored as sparse matrices."""
+
+    def __init__(self):
+        self.word_index: Dict[str, int] = {}
+        self._words: List[str] = []
+
+    def __len__(self):
+        return len(self.word_index)
+
+    def __contains__(self, word: str):
+        return word in self.word_index
+
+    def add(self, words: Iterable[str]) -> List[int]:
+        word_index = self.word_index
+        return [word_index.setdefault(word, len(word_index)) for word in words]
+
+    def lookup(self, words: Iterable[str]) -> List[int]:
+        """Returns the ids of known words. Words outside the vocabulary are skipped."""
+        word_index = self.word_index
+        return [word_index[word] for word in words if word in word_index]
+
+    def lookup_array(self, words: List[str]) -> np.ndarray:
+        """Returns the id of every word, or -1 for words outside the vocabulary."""
+        get = self.word_index.get
+        return np.fromiter((get(word, -1) for word in words), dtype=np.int64, count=len(words))
+
+    def words(self) -> List[str]:
+        return list(self.word_index)
+
+    def words_for(self, ids: np.ndarray) -> List[str]:
+        """Returns the word of every id"""
+        # Word ids are insertion positions, so the list only has to be rebuilt after the vocabulary grew
+        if len(self._words) != len(self.word_index):
+            self._words = list(self.word_index)
+        return [self._words[i] for i in ids.tolist()]
+
+
+class MappedVocabulary:
+    """Read-only vocabulary backed by the sorted words stored as one utf-8 blob, with word i at
+    blob[offsets[i]:offsets[i + 1]] (usually memory-mapped from a model file, so processes share one copy). Word ids
+    are positions in the sorted order and words are found with a vectorized binary search instead of a dict.
+    The blob ends with _CHUNK_BYTES zero bytes, see from_words."""
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+
+    @classmethod
+    def from_words(cls, sorted_words: List[bytes]) -> "MappedVocabulary":
+        offsets, blob = _concatenate(sorted_words)
+        return cls(offsets, blob)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, word: str):
+        return self.lookup_array([word])[0] >= 0
+
+    def lookup(self, words: Iterable[str]) -> List[int]:
+        ids = self.lookup_array(list(words))
+        return ids[ids >= 0].tolist()
+
+    def lookup_array(self, words: List[str]) -> np.ndarray:
+        if not words or not len(self):
+            return np.full(len(words), -1, dtype=np.int64)
+        # Token lists repeat words a lot, so every distinct word is searched once
+        distinct: Dict[str, int] = {}
+        inverse = np.fromiter((distinct.setdefault(word, len(distinct)) for word in words), dtype=np.int64,
+                              count=len(words))
+        query_offsets, query_blob = _concatenate([word.encode("utf-8") for word in distinct])
+        query_starts, query_lengths = query_offsets[:-1], np.diff(query_offsets)
+        # All words are searched in lockstep. The first chunk of the words decides most steps
+        query_keys = _chunk_keys(query_blob, query_starts, query_lengths)
+        low = np.zeros(len(distinct), dtype=np.int64)
+        high = np.full(len(distinct), len(self), dtype=np.int64)
+        for _ in range(len(self).bit_length()):
+            middle = (low + high) // 2
+            starts, lengths = self._spans(middle.clip(max=len(self) - 1))
+            keys = _chunk_keys(self.blob, starts, lengths)
+            below = keys < query_keys
+            tied = np.flatnonzero(keys == query_keys)
+            below[tied] = _compare(self.blob, starts[tied], lengths[tied], query_blob, query_starts[tied],
+                                   query_lengths[tied]) < 0
+            searching = low < high
+            low = np.where(searching & below, middle + 1, low)
+            high = np.where(searching & ~below, middle, high)
+        positions = low.clip(max=len(self) - 1)
+        starts, lengths = self._spans(positions)
+        found = (low < len(self)) & (_compare(self.blob, starts, lengths, query_blob, query_starts, query_lengths) == 0)
+        return np.where(found, positions, -1)[inverse]
+
+    def words(self) -> List[str]:
+        return self.words_for(np.arange(len(self)))
+
+    def words_for(self, ids: np.ndarray) -> List[str]:
+        starts, lengths = self._spans(ids)
+        return [self.blob[start:start + length].tobytes().decode("utf-8")
+                for start, length in zip(starts.tolist(), lengths.tolist())]
+
+    def _spans(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(start, length) in the blob of every id. Offsets may be unsigned, which numpy would mix with signed
+        integers into floats"""
+        starts = self.offsets[ids].astype(np.int64)
+        return starts, self.offsets[ids + 1].astype(np.int64) - starts
+
+
+def _concatenate(words: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    """(offsets, blob) of words, word i is blob[offsets[i]:offsets[i + 1]]. The blob ends with _CHUNK_BYTES zero
+    bytes of padding, so a chunk can be read from any offset"""
+    offsets = np.zeros(len(words) + 1, dtype=np.int64)
+    np.cumsum([len(word) for word in words], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(words) + bytes(_CHUNK_BYTES), dtype=np.uint8)
+
+
+def _compare(blob_a: np.ndarray, starts_a: np.ndarray, lengths_a: np.ndarray,
+             blob_b: np.ndarray, starts_b: np.ndarray, lengths_b: np.ndarray) -> np.ndarray:
+    """Compares the byte strings of a and b pairwise like bytes comparison does, returns -1, 0 or 1 per pair.
+    Strings are compared 8 bytes at a time as big-endian integers, only the pairs that are equal so far go on."""
+    result = np.zeros(len(starts_a), dtype=np.int64)
+    pending = np.arange(len(starts_a))
+    position = 0
+    while len(pending):
+        key_a = _chunk_keys(blob_a, starts_a[pending] + position, lengths_a[pending] - position)
+        key_b = _chunk_keys(blob_b, starts_b[pending] + position, lengths_b[pending] - position)
+        equal = key_a == key_b
+        result[pending] = np.where(key_a > key_b, 1, -1)
+        # Strings equal up to the end of the shorter one are ordered by length
+        position += _CHUNK_BYTES
+        ended = (lengths_a[pending] <= position) | (lengths_b[pending] <= position)
+        result[pending[equal & ended]] = np.sign(lengths_a[pending] - lengths_b[pending])[equal & ended]
+        pending = pending[equal & ~ended]
+    return result
+
+
+def _chunk_keys(blob: np.ndarray, starts: np.ndarray, remaining: np.ndarray) -> np.ndarray:
+    """The _CHUNK_BYTES bytes from every start as big-endian integers, zero-padded past the end of the string"""
+    # Overlapping view with a chunk starting at every byte, so reading a chunk is a single lookup
+    chunks = np.ndarray((len(blob) - _CHUNK_BYTES + 1,), dtype=">u8", buffer=blob, strides=(1,))
+    return chunks[starts] & _PREFIX_MASKS[remaining.clip(0, _CHUNK_BYTES)]
+
+
+class CsrMatrix:
+    """Minimal compressed sparse row matrix. Row i holds the columns indices[indptr[i]:indptr[i + 1]]
+    with the matching values in data."""
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, num_columns: int):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.num_columns = num_columns
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.indptr) - 1
+
+    def row_ids(self) -> np.ndarray:
+        """Row number of every stored value, aligned with indices and data."""
+        return np.repeat(np.arange(self.num_rows), np.diff(self.indptr))
+
+    def row_sums(self) -> np.ndarray:
+        return np.bincount(self.row_ids(), weights=self.data, minlength=self.num_rows)
+
+    def column_sums(self, row_mask: np.ndarray = None) -> np.ndarray:
+        """Sums every column, optionally only over the rows selected by the boolean row_mask."""
+        indices, data = self.indices, self.data
+        if row_mask is not None:
+            value_mask = row_mask[self.row_ids()]
+            indices, data = indices[value_mask], data[value_mask]
+        return np.bincount(indices, weights=data, minlength=self.num_columns)
+
+    def column_counts(self) -> np.ndarray:
+        """Number of rows with a stored value in each column (document frequency for a term matrix)."""
+        return np.bincount(self.indices, minlength=self.num_columns)
+
+    def dot(self, dense: np.ndarray) -> np.ndarray:
+        """Multiplies the matrix by a dense vector (num_columns,) or matrix (num_columns, k)."""
+        rows = self.row_ids()
+        if dense.ndim == 1:
+            return np.bincount(rows, weights=self.data * dense[self.indices], minlength=self.num_rows)
+        products = self.data[:, None] * dense[self.indices]
+        return np.stack([np.bincount(rows, weights=products[:, k], minlength=self.num_rows)
+                         for k in range(dense.shape[1])], axis=1)
+
+    def select_rows(self, row_mask: np.ndarray) -> "CsrMatrix":
+        lengths = np.diff(self.indptr)[row_mask]
+        indptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        value_mask = row_mask[self.row_ids()]
+        return CsrMatrix(indptr, self.indices[value_mask], self.data[value_mask], self.num_columns)
+
+
+def count_matrix(token_ids: List[List[int]], num_columns: int) -> CsrMatrix:
+    """Builds a document-term count matrix from a list of token id lists, one per document."""
+    lengths = np.fromiter((len(ids) for ids in token_ids), dtype=np.int64, count=len(token_ids))
+    columns = np.fromiter((i for ids in token_ids for i in ids), dtype=np.int64, count=int(lengths.sum()))
+    rows = np.repeat(np.arange(len(token_ids), dtype=np.int64), lengths)
+    return count_matrix_from_entries(rows, columns, len(token_ids), num_columns)
+
+
+def count_matrix_from_entries(rows: np.ndarray, columns: np.ndarray, num_rows: int, num_columns: int) -> CsrMatrix:
+    """Builds a count matrix from one (row, column) entry per token occurrence."""
+    width = max(num_columns, 1)
+    # A single sort over (row, column) keys merges repeated words of a document into one counted entry
+    keys, counts = np.unique(rows * width + columns, return_counts=True)
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // width, minlength=num_rows), out=indptr[1:])
+    return CsrMatrix(indptr, keys % width, counts.astype(np.float64), num_columns)
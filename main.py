@@ -1,37 +1,112 @@
 import logging
 import os
 
+from classifier import evaluation
 from classifier.naive_bayes import NaiveBayes
-from service import file_service, ticker_service
+from service import backtest_service, file_service, sentiment_service, ticker_service
+from service.comment_cache import CommentCache
+from service.mention_store import MentionStore
+from service.run_journal import RunJournal
+from service.ticker_monitor import TickerMonitor
+from util.metrics import MetricsReporter
+
+_MODEL_FILE = "naive_bayes.model"
+# Prometheus text file with request, pagination and classifier metrics, rewritten every _METRICS_INTERVAL_SECONDS
+_METRICS_FILE = "metrics.prom"
+_METRICS_INTERVAL_SECONDS = 30
 
 logger = logging.getLogger(__name__)
 
 
 def count_stock_tickers():
-    # tickers = get_list_of_tickers()  # This is not required if you provide your own list of tickers
+    # This is not required if you provide your own list of tickers
+    # tickers = ticker_registry.TickerRegistry.load().filter(etf=False, min_length=2, exclude_common_words=True)
     tickers = ["GME", "AAPL", "SPCE", "TSLA"]
     subreddit = "wallstreetbets"  # pick a subreddit, or leave blank to analyze all subreddits
     prev_day_count = 4
-    data = ticker_service.aggregate_ticker_comment_count(tickers, prev_day_count, subreddit)
+    # Re-running after a crash or Ctrl-C only counts the tickers that were not finished (or failed) yet. A window
+    # that is still open is counted afresh once a run of it has finished
+    with CommentCache() as cache, MentionStore() as store, RunJournal() as journal:
+        data = ticker_service.aggregate_ticker_comment_count(tickers, prev_day_count, subreddit, cache=cache,
+                                                             on_comments=store.add_comments, journal=journal)
     file_service.write_ticker_count_to_csv(data)
 
 
+def load_or_train_model(words_to_ignore):
+    """Trains the model from training_data.csv once and loads the saved model on later runs"""
+    if os.path.isfile(_MODEL_FILE):
+        return NaiveBayes.load(_MODEL_FILE, words_to_ignore=words_to_ignore)
+    training_data_list = file_service.read_csv(os.path.join(os.path.dirname(__file__), "training_data.csv"))
+    naive_bayes = NaiveBayes(words_to_ignore=words_to_ignore)
+    training_data = naive_bayes.convert_from_list(training_data_list)
+    naive_bayes.train(training_data)
+    naive_bayes.save(_MODEL_FILE)
+    return naive_bayes
+
+
 def naive_bayes_sentiment_analysis():
     ticker = "AAPL"
     subreddit = "wallstreetbets"
     prev_day_count = 4
-    comments = ticker_service.get_ticker_comments(ticker, prev_day_count, subreddit)
+    naive_bayes = load_or_train_model([ticker])
+    with CommentCache() as cache:
+        comments = (comment.get("body") or "" for comment in
+                    ticker_service.iter_ticker_comments(ticker, prev_day_count, subreddit, cache=cache))
+        file_service.write_comment_sentiment_batches_to_csv(naive_bayes.iter_classify_batches(comments), ticker)
+
+
+def tune_sentiment_model():
+    # 5-fold cross-validation of every weighting scheme and a few smoothing values, on features built once
     training_data_list = file_service.read_csv(os.path.join(os.path.dirname(__file__), "training_data.csv"))
-    naive_bayes = NaiveBayes(words_to_ignore=[ticker])
-    training_data = naive_bayes.convert_from_list(training_data_list)
-    naive_bayes.train(training_data)
-    data = naive_bayes.test(comments)
-    file_service.write_comment_sentiment_to_csv(data, ticker)
+    naive_bayes = NaiveBayes(words_to_ignore=["AAPL"])
+    report = evaluation.cross_validate(naive_bayes.convert_from_list(training_data_list),
+                                       add_alpha_smoothing=(0.1, 0.5, 1), model=naive_bayes)
+    best = report.best
+    logger.info(f"Best configuration: {best.tf_mode.value}, tfidf={best.tfidf}, alpha={best.add_alpha_smoothing} "
+                f"with F1 {best.f1:.3f}, {len(report.results)} configurations took {report.seconds:.2f} seconds.")
+
+
+def watchlist_sentiment_analysis():
+    # One crawl of the subreddit and one model for the whole watchlist
+    tickers = ["GME", "AAPL", "SPCE", "TSLA", "AMC", "PLTR", "NIO", "AMD"]
+    subreddit = "wallstreetbets"
+    prev_day_count = 4
+    naive_bayes = load_or_train_model(tickers)
+    with CommentCache() as cache, MentionStore() as store:
+        data = sentiment_service.aggregate_ticker_sentiment(tickers, naive_bayes, prev_day_count, subreddit,
+                                                            cache=cache, on_comments=store.add_comments,
+                                                            on_classified=store.set_classifications)
+    file_service.write_ticker_sentiment_to_csv(data)
+
+
+def monitor_tickers():
+    # Runs until interrupted: every 5 minutes fetches the new comments only and rewrites monitor_snapshot.json with
+    # the mentions and sentiment of the last hour, day and week
+    tickers = ["GME", "AAPL", "SPCE", "TSLA", "AMC", "PLTR", "NIO", "AMD"]
+    subreddits = ["wallstreetbets", "stocks"]
+    TickerMonitor(tickers, subreddits, load_or_train_model(tickers)).run()
+
+
+def backtest_mentions():
+    # Correlates the mentions and sentiment recorded in mentions.sqlite (see count_stock_tickers and
+    # watchlist_sentiment_analysis) with the prices in prices.csv (date,ticker,close rows) over 1/3/5/14/30 days
+    prices = backtest_service.load_price_csv("prices.csv")
+    with MentionStore() as store:
+        results = backtest_service.backtest_mention_store(store, prices)
+    for name, result in results.items():
+        for summary in result.summary():
+            logger.info(f"{name}, {summary}")
+        file_service.write_backtest_to_csv(result)
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG, format="%(asctime)s : %(threadName)s : %(lineno)d - %(message)s",
                         datefmt="%X")
     logger.info(f"#### Running script from {__file__} ####")
-    naive_bayes_sentiment_analysis()
-    # count_stock_tickers()
+    with MetricsReporter(_METRICS_FILE, _METRICS_INTERVAL_SECONDS):
+        naive_bayes_sentiment_analysis()
+        # tune_sentiment_model()
+        # watchlist_sentiment_analysis()
+        # count_stock_tickers()
+        # monitor_tickers()
+        # backtest_mentions()
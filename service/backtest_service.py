@@ -0,0 +1,286 @@
+import csv
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from service.mention_store import MentionBucket, MentionStore
+from util.dates import utc_timestamp
+
+# Forward return horizons in trading days
+HORIZONS = (1, 3, 5, 14, 30)
+# The signal of day t is traded at the close of day t + _ENTRY_LAG. A day's mentions include comments posted after
+# that day's close, so entering at the same close would trade on information that was not available yet
+_ENTRY_LAG = 1
+# Statistics of tickers with fewer (signal, return) pairs than this are left NaN
+_MIN_OBSERVATIONS = 20
+# |t-statistic| of a regression slope counted as significant, about 5% two-sided
+_SIGNIFICANT_T_STAT = 1.96
+_DAY_SECONDS = 24 * 60 * 60
+# Close cells read as missing prices, compared lower case
+_MISSING_VALUES = {"", "null", "nan", "na", "n/a", "none"}
+
+logger = logging.getLogger(__name__)
+
+
+class TickerBacktestData(BaseModel):
+    ticker: str
+    horizon: int
+    observations: int
+    # Pearson correlation of the signal with the forward log return
+    correlation: float
+    # Least squares fit of forward log return = intercept + slope * signal
+    slope: float
+    intercept: float
+    t_stat: float
+    # Mean forward log return of going long when the signal is above its trailing mean and short when below
+    signal_return: float
+    # Share of those positions with a positive return
+    hit_rate: float
+
+
+class HorizonSummary(BaseModel):
+    horizon: int
+    # Tickers with at least the minimum number of observations
+    tickers: int
+    mean_correlation: float
+    median_correlation: float
+    # Share of tickers whose slope is significant
+    significant_share: float
+    mean_signal_return: float
+    mean_hit_rate: float
+
+
+class Panel:
+    """Daily values of many tickers on shared axes: values[i, j] is the value of tickers[i] on days[j]
+    (datetime64[D]), NaN where there is none. Every computation over tickers and days is a whole array operation."""
+
+    def __init__(self, tickers: Sequence[str], days: np.ndarray, values: np.ndarray):
+        self.tickers = list(tickers)
+        self.days = days
+        self.values = values
+
+    def reindex(self, tickers: Sequence[str], days: np.ndarray) -> "Panel":
+        """The values on other axes, NaN for tickers and days this panel does not have"""
+        values = np.full((len(tickers), len(days)), np.nan)
+        ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        rows = np.array([ticker_index.get(ticker, -1) for ticker in tickers], dtype=np.int64)
+        columns = np.searchsorted(self.days, days).clip(max=max(len(self.days) - 1, 0))
+        known_columns = (self.days[columns] == days) if len(self.days) else np.zeros(len(days), dtype=bool)
+        known_rows = rows >= 0
+        values[np.ix_(known_rows, known_columns)] = self.values[np.ix_(rows[known_rows], columns[known_columns])]
+        return Panel(tickers, days, values)
+
+
+class BacktestResult:
+    """Statistics of one signal against the forward returns of every ticker and horizon. Every statistic is an
+    array of shape (len(horizons), len(tickers))."""
+
+    def __init__(self, signal_name: str, tickers: List[str], horizons: Sequence[int], lag: int,
+                 statistics: Dict[str, np.ndarray]):
+        self.signal_name = signal_name
+        self.tickers = tickers
+        self.horizons = list(horizons)
+        self.lag = lag
+        self.statistics = statistics
+
+    def rows(self) -> List[TickerBacktestData]:
+        """One row per ticker and horizon with enough observations"""
+        names = list(TickerBacktestData.__fields__)[2:]
+        return [TickerBacktestData.construct(ticker=self.tickers[i], horizon=horizon,
+                                             **{name: self.statistics[name][h, i].item() for name in names})
+                for h, horizon in enumerate(self.horizons)
+                for i in np.flatnonzero(np.isfinite(self.statistics["correlation"][h]))]
+
+    def summary(self) -> List[HorizonSummary]:
+        summaries = []
+        for h, horizon in enumerate(self.horizons):
+            evaluated = np.isfinite(self.statistics["correlation"][h])
+            values = {name: statistic[h, evaluated] for name, statistic in self.statistics.items()}
+            if not evaluated.any():
+                summaries.append(HorizonSummary(horizon=horizon, tickers=0, mean_correlation=np.nan,
+                                                median_correlation=np.nan, significant_share=np.nan,
+                                                mean_signal_return=np.nan, mean_hit_rate=np.nan))
+                continue
+            summaries.append(HorizonSummary(
+                horizon=horizon, tickers=int(evaluated.sum()), mean_correlation=values["correlation"].mean(),
+                median_correlation=np.median(values["correlation"]),
+                significant_share=np.mean(np.abs(values["t_stat"]) > _SIGNIFICANT_T_STAT),
+                mean_signal_return=np.nanmean(values["signal_return"]), mean_hit_rate=np.nanmean(values["hit_rate"])))
+        return summaries
+
+    def top(self, horizon: int, n: int = 10) -> List[TickerBacktestData]:
+        """The n tickers whose forward returns over horizon follow the signal most significantly"""
+        rows = [row for row in self.rows() if row.horizon == horizon]
+        rows.sort(key=lambda row: abs(row.t_stat), reverse=True)
+        return rows[:n]
+
+
+def load_price_csv(file_name: str) -> Panel:
+    """Reads daily closing prices from a CSV with a date,ticker,close header, one row per ticker and trading day,
+    dates as YYYY-MM-DD. The trading days are the dates in the file. Missing closes (blank, null, NA, e.g. trading
+    halts) are read as NaN; closes that are not positive are kept but never used, see _log_prices."""
+    with open(file_name, newline="") as f:
+        reader = csv.reader(f)
+        index = {name.strip().lower(): i for i, name in enumerate(next(reader))}
+        columns = list(zip(*reader)) or [()] * len(index)
+    days = np.array(columns[index["date"]], dtype="datetime64[D]")
+    closes = np.array([np.nan if close.strip().lower() in _MISSING_VALUES else float(close)
+                       for close in columns[index["close"]]], dtype=np.float64)
+    missing, not_positive = np.isnan(closes).sum(), (closes <= 0).sum()
+    if missing or not_positive:
+        logger.warning(f"Ignoring {missing} missing and {not_positive} non-positive closes in {file_name}.")
+    prices = _pivot(np.array(columns[index["ticker"]], dtype=str), days, closes)
+    logger.info(f"Read prices of {len(prices.tickers)} tickers on {len(prices.days)} trading days from {file_name}.")
+    return prices
+
+
+def _pivot(tickers: np.ndarray, days: np.ndarray, values: np.ndarray) -> Panel:
+    ticker_axis, ticker_ids = np.unique(tickers, return_inverse=True)
+    day_axis, day_ids = np.unique(days, return_inverse=True)
+    matrix = np.full((len(ticker_axis), len(day_axis)), np.nan)
+    matrix[ticker_ids, day_ids] = values
+    return Panel(ticker_axis.tolist(), day_axis, matrix)
+
+
+def buckets_to_columns(buckets: Iterable[MentionBucket]) -> Dict[str, np.ndarray]:
+    """Daily MentionBucket rows (e.g. from MentionStore.mention_series) as the columns of rollup_columns"""
+    buckets = list(buckets)
+    return {"ticker": np.array([bucket.ticker for bucket in buckets], dtype=str),
+            "bucket_start": np.array([utc_timestamp(bucket.bucket_start) for bucket in buckets], dtype=np.int64),
+            **{name: np.array([getattr(bucket, name) for bucket in buckets], dtype=np.int64)
+               for name in ("mentions", "positive", "negative", "score_sum")}}
+
+
+def signal_panels(columns: Dict[str, np.ndarray], trading_days: np.ndarray) -> Dict[str, Panel]:
+    """Daily signals on the trading days from daily rollup columns (MentionStore.rollup_columns):
+    "mentions" is log(1 + mentions), 0 on days without mentions, and "sentiment" is
+    (positive - negative) / (positive + negative), NaN on days without classified mentions.
+    Mentions on days without trading (weekends, holidays) count towards the next trading day, so the signal of a
+    trading day covers everything since the previous one."""
+    days = (columns["bucket_start"] // _DAY_SECONDS).astype("datetime64[D]")
+    # First trading day on or after the day of the mention
+    day_ids = np.searchsorted(trading_days, days)
+    valid = day_ids < len(trading_days)
+    tickers, ticker_ids = np.unique(columns["ticker"][valid], return_inverse=True)
+    sums = {}
+    for name in "mentions", "positive", "negative":
+        sums[name] = np.zeros((len(tickers), len(trading_days)))
+        np.add.at(sums[name], (ticker_ids, day_ids[valid]), columns[name][valid])
+    classified = sums["positive"] + sums["negative"]
+    sentiment = np.full(classified.shape, np.nan)
+    np.divide(sums["positive"] - sums["negative"], classified, out=sentiment, where=classified > 0)
+    return {"mentions": Panel(tickers.tolist(), trading_days, np.log1p(sums["mentions"])),
+            "sentiment": Panel(tickers.tolist(), trading_days, sentiment)}
+
+
+def forward_returns(prices: np.ndarray, horizon: int, lag: int = _ENTRY_LAG) -> np.ndarray:
+    """Log return of every (ticker, day) from the close lag trading days later to the close horizon trading days
+    after that. NaN where a close is missing or past the last day."""
+    log_prices = _log_prices(prices)
+    returns = np.full(prices.shape, np.nan)
+    num_days = prices.shape[1]
+    if lag + horizon < num_days:
+        returns[:, :num_days - lag - horizon] = log_prices[:, lag + horizon:] - log_prices[:, lag:num_days - horizon]
+    return returns
+
+
+def backtest(signal: Panel, prices: Panel, horizons: Sequence[int] = HORIZONS, lag: int = _ENTRY_LAG,
+             min_observations: int = _MIN_OBSERVATIONS, signal_name: str = "signal") -> BacktestResult:
+    """Regresses the forward returns of every ticker over every horizon on the signal, all tickers at once.
+    The signal is aligned to the price panel's tickers and trading days."""
+    signal_values = signal.reindex(prices.tickers, prices.days).values
+    positions = _positions(signal_values)
+    statistics: Dict[str, List[np.ndarray]] = {}
+    for horizon in horizons:
+        returns = forward_returns(prices.values, horizon, lag)
+        for name, values in _regress(signal_values, returns, min_observations).items():
+            statistics.setdefault(name, []).append(values)
+        traded = np.isfinite(positions) & np.isfinite(returns) & (positions != 0)
+        trades = traded.sum(axis=1)
+        enough = trades >= min_observations
+        position_returns = np.where(traded, positions * returns, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            statistics.setdefault("signal_return", []).append(
+                np.where(enough, position_returns.sum(axis=1) / trades, np.nan))
+            statistics.setdefault("hit_rate", []).append(
+                np.where(enough, (position_returns > 0).sum(axis=1) / trades, np.nan))
+    return BacktestResult(signal_name, prices.tickers, horizons, lag,
+                          {name: np.stack(values) for name, values in statistics.items()})
+
+
+def lagged_correlations(signal: Panel, prices: Panel, max_lag: int = 5,
+                        min_observations: int = _MIN_OBSERVATIONS) -> Tuple[np.ndarray, np.ndarray]:
+    """Correlation of the signal on day t with the one day log return into day t + lag, for every ticker and lag
+    in [-max_lag, max_lag]. Negative lags correlate with returns before the signal (prices moving the chatter),
+    positive ones with returns after it. Returns the lags and a (lags, tickers) array."""
+    signal_values = signal.reindex(prices.tickers, prices.days).values
+    log_prices = _log_prices(prices.values)
+    daily_returns = np.full(prices.values.shape, np.nan)
+    daily_returns[:, 1:] = log_prices[:, 1:] - log_prices[:, :-1]
+    lags = np.arange(-max_lag, max_lag + 1)
+    correlations = np.stack([_regress(signal_values, _shift(daily_returns, lag), min_observations)["correlation"]
+                             for lag in lags.tolist()])
+    return lags, correlations
+
+
+def backtest_mention_store(store: MentionStore, prices: Panel, horizons: Sequence[int] = HORIZONS,
+                           lag: int = _ENTRY_LAG) -> Dict[str, BacktestResult]:
+    """Backtests the mentions and sentiment signals of every ticker in the store over the price panel's days.
+    Days without stored mentions count as days without mentions, so the store should cover the whole period."""
+    from_date, to_date = (datetime.utcfromtimestamp(int(day.astype("datetime64[s]").astype(np.int64)))
+                          for day in (prices.days[0], prices.days[-1] + 1))
+    columns = store.rollup_columns(from_date, to_date, "day")
+    results = {name: backtest(panel, prices, horizons, lag, signal_name=name)
+               for name, panel in signal_panels(columns, prices.days).items()}
+    logger.info(f"Backtested {len(results)} signals of {len(prices.tickers)} tickers from {prices.days[0]} "
+                f"to {prices.days[-1]}.")
+    return results
+
+
+def _log_prices(prices: np.ndarray) -> np.ndarray:
+    """Log of every close, NaN where the close is missing or not positive (bad data, which has no log)"""
+    log_prices = np.full(prices.shape, np.nan)
+    np.log(prices, out=log_prices, where=prices > 0)
+    return log_prices
+
+
+def _shift(values: np.ndarray, days: int) -> np.ndarray:
+    """values[:, t + days] at column t, NaN past either end"""
+    shifted = np.full(values.shape, np.nan)
+    if days >= 0:
+        shifted[:, :values.shape[1] - days] = values[:, days:]
+    else:
+        shifted[:, -days:] = values[:, :days]
+    return shifted
+
+
+def _regress(x: np.ndarray, y: np.ndarray, min_observations: int) -> Dict[str, np.ndarray]:
+    """Per row least squares fit of y on x over the columns where both are known"""
+    valid = np.isfinite(x) & np.isfinite(y)
+    observations = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = np.where(valid, x, 0).sum(axis=1) / observations
+        mean_y = np.where(valid, y, 0).sum(axis=1) / observations
+        dx = np.where(valid, x - mean_x[:, None], 0)
+        dy = np.where(valid, y - mean_y[:, None], 0)
+        sxx, syy, sxy = (dx * dx).sum(axis=1), (dy * dy).sum(axis=1), (dx * dy).sum(axis=1)
+        correlation = sxy / np.sqrt(sxx * syy)
+        slope = sxy / sxx
+        t_stat = correlation * np.sqrt((observations - 2) / (1 - correlation ** 2))
+    enough = (observations >= max(min_observations, 3)) & (sxx > 0) & (syy > 0)
+    return {"observations": observations, "correlation": np.where(enough, correlation, np.nan),
+            "slope": np.where(enough, slope, np.nan), "intercept": np.where(enough, mean_y - slope * mean_x, np.nan),
+            "t_stat": np.where(enough, t_stat, np.nan)}
+
+
+def _positions(signal: np.ndarray) -> np.ndarray:
+    """+1 where the signal is above the mean of its earlier values, -1 below, NaN without earlier values"""
+    known = np.isfinite(signal)
+    values = np.where(known, signal, 0)
+    earlier_sums = np.cumsum(values, axis=1) - values
+    earlier_counts = np.cumsum(known, axis=1) - known
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.sign(signal - earlier_sums / earlier_counts)
@@ -0,0 +1,180 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_CACHE_FILE = "comment_cache.sqlite"
+_DEFAULT_MAX_SIZE_BYTES = 512 * 1024 * 1024
+# Comments newer than this are still being ingested/voted on, so windows reaching into it are never marked complete
+_OPEN_WINDOW_SECONDS = 60 * 60
+# Number of cached comments yielded per page, mirrors the API page size
+_PAGE_SIZE = 100
+
+PageFetcher = Callable[[int, int], Iterator[List[Dict]]]
+AsyncPageFetcher = Callable[[int, int], AsyncIterator[List[Dict]]]
+
+
+class CommentCache:
+    """SQLite cache of raw pushshift comment records.
+
+    Records are stored per (query, subreddit) together with the ranges of created_utc values that have been fetched
+    completely. Closed ranges are served from disk without any network call, only the gaps (usually the open tail
+    of a window reaching up to now) are fetched. When the stored records grow beyond max_size_bytes, the least
+    recently used ranges and their records are evicted."""
+
+    def __init__(self, file_name: str = _DEFAULT_CACHE_FILE, max_size_bytes: int = _DEFAULT_MAX_SIZE_BYTES):
+        self.file_name = file_name
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        with self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS comments (
+                    query TEXT NOT NULL,
+                    subreddit TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    created_utc INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    record TEXT NOT NULL,
+                    PRIMARY KEY (query, subreddit, id)
+                );
+                CREATE INDEX IF NOT EXISTS comments_by_time ON comments (query, subreddit, created_utc, id);
+                CREATE TABLE IF NOT EXISTS coverage (
+                    query TEXT NOT NULL,
+                    subreddit TEXT NOT NULL,
+                    first_utc INTEGER NOT NULL,
+                    last_utc INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                );
+            """)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_pages(self, fetch_pages: PageFetcher, query: Optional[str], subreddit: Optional[str],
+                   after: int, before: int) -> Iterator[List[Dict]]:
+        """Yields pages of comments with after < created_utc < before in ascending order.
+        fetch_pages(after, before) is called for every part of the window that is not cached yet."""
+        key = (query or "", subreddit or "")
+        for first_utc, last_utc, cached in self._segments(key, after + 1, before - 1):
+            if cached:
+                yield from self._read_pages(key, first_utc, last_utc)
+                continue
+            for page in fetch_pages(first_utc - 1, last_utc + 1):
+                self._store(key, page)
+                yield page
+            # Only reached when the gap was fetched completely
+            self._complete(key, first_utc, last_utc)
+        self._evict()
+
+    async def iter_pages_async(self, fetch_pages: AsyncPageFetcher, query: Optional[str], subreddit: Optional[str],
+                               after: int, before: int) -> AsyncIterator[List[Dict]]:
+        """Same as iter_pages for an async fetch_pages"""
+        key = (query or "", subreddit or "")
+        for first_utc, last_utc, cached in self._segments(key, after + 1, before - 1):
+            if cached:
+                for page in self._read_pages(key, first_utc, last_utc):
+                    yield page
+                continue
+            async for page in fetch_pages(first_utc - 1, last_utc + 1):
+                self._store(key, page)
+                yield page
+            self._complete(key, first_utc, last_utc)
+        self._evict()
+
+    def _segments(self, key: Tuple[str, str], first_utc: int, last_utc: int) -> List[Tuple[int, int, bool]]:
+        """Splits [first_utc, last_utc] into consecutive (first, last, cached) segments."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT first_utc, last_utc FROM coverage WHERE query = ? AND subreddit = ? "
+                "AND last_utc >= ? AND first_utc <= ? ORDER BY first_utc", (*key, first_utc, last_utc)).fetchall()
+            if rows:
+                with self._connection:
+                    self._connection.execute(
+                        "UPDATE coverage SET last_used = ? WHERE query = ? AND subreddit = ? "
+                        "AND last_utc >= ? AND first_utc <= ?", (time.time(), *key, first_utc, last_utc))
+        segments = []
+        cursor = first_utc
+        for covered_first, covered_last in rows:
+            if covered_first > cursor:
+                segments.append((cursor, covered_first - 1, False))
+            if covered_last >= cursor:
+                segments.append((max(cursor, covered_first), min(covered_last, last_utc), True))
+                cursor = covered_last + 1
+        if cursor <= last_utc:
+            segments.append((cursor, last_utc, False))
+        return segments
+
+    def _read_pages(self, key: Tuple[str, str], first_utc: int, last_utc: int) -> Iterator[List[Dict]]:
+        """Reads one page at a time (keyset pagination on created_utc, id) so large ranges never sit in memory"""
+        logger.debug(f"Serving {key} from {first_utc} to {last_utc} from cache.")
+        cursor_utc, cursor_id = first_utc - 1, ""
+        while True:
+            with self._lock:
+                rows = self._connection.execute(
+                    "SELECT created_utc, id, record FROM comments WHERE query = ? AND subreddit = ? "
+                    "AND (created_utc > ? OR (created_utc = ? AND id > ?)) AND created_utc BETWEEN ? AND ? "
+                    "ORDER BY created_utc, id LIMIT ?",
+                    (*key, cursor_utc, cursor_utc, cursor_id, first_utc, last_utc, _PAGE_SIZE)).fetchall()
+            if not rows:
+                break
+            yield [json.loads(record) for _, _, record in rows]
+            cursor_utc, cursor_id = rows[-1][0], rows[-1][1]
+
+    def _store(self, key: Tuple[str, str], page: List[Dict]):
+        rows = []
+        for comment in page:
+            record = json.dumps(comment)
+            rows.append((*key, str(comment.get("id")), int(comment.get("created_utc", 0)), len(record), record))
+        with self._lock, self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO comments VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def _complete(self, key: Tuple[str, str], first_utc: int, last_utc: int):
+        """Marks a fetched range as complete, except for the part that is still open"""
+        closed_utc = int(time.time()) - _OPEN_WINDOW_SECONDS
+        if first_utc <= closed_utc:
+            self._add_coverage(key, first_utc, min(last_utc, closed_utc))
+
+    def _add_coverage(self, key: Tuple[str, str], first_utc: int, last_utc: int):
+        """Records [first_utc, last_utc] as complete, merging it with overlapping or adjacent ranges."""
+        with self._lock, self._connection:
+            overlapping = self._connection.execute(
+                "SELECT rowid, first_utc, last_utc FROM coverage WHERE query = ? AND subreddit = ? "
+                "AND last_utc >= ? AND first_utc <= ?", (*key, first_utc - 1, last_utc + 1)).fetchall()
+            for rowid, covered_first, covered_last in overlapping:
+                first_utc = min(first_utc, covered_first)
+                last_utc = max(last_utc, covered_last)
+                self._connection.execute("DELETE FROM coverage WHERE rowid = ?", (rowid,))
+            self._connection.execute("INSERT INTO coverage VALUES (?, ?, ?, ?, ?)",
+                                     (*key, first_utc, last_utc, time.time()))
+
+    def size(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM comments").fetchone()[0]
+
+    def _evict(self):
+        while self.size() > self.max_size_bytes:
+            with self._lock, self._connection:
+                oldest = self._connection.execute(
+                    "SELECT rowid, query, subreddit, first_utc, last_utc FROM coverage "
+                    "ORDER BY last_used LIMIT 1").fetchone()
+                if oldest:
+                    rowid, query, subreddit, first_utc, last_utc = oldest
+                    self._connection.execute("DELETE FROM coverage WHERE rowid = ?", (rowid,))
+                    self._connection.execute(
+                        "DELETE FROM comments WHERE query = ? AND subreddit = ? AND created_utc BETWEEN ? AND ?",
+                        (query, subreddit, first_utc, last_utc))
+                else:
+                    # Only records of open windows are left, they are refetched on the next run anyway
+                    self._connection.execute("DELETE FROM comments")
+            logger.debug(f"Evicted cached comments, cache size is now {self.size()} bytes.")
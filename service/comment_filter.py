@@ -0,0 +1,184 @@
+import hashlib
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from util.metrics import REGISTRY
+
+# Authors whose comments are never counted or classified
+_BLOCKED_AUTHORS = ("AutoModerator",)
+# Ids and fingerprints of this many recent comments are remembered, older ones are forgotten a generation at a time
+_DEFAULT_CAPACITY = 100_000
+# Bodies whose SimHash fingerprints differ in at most this many of 64 bits are near-duplicates
+_MAX_HAMMING_DISTANCE = 3
+# Shorter bodies ("buy GME") are too common to be spam when repeated, so only their ids are deduplicated
+_MIN_NEAR_DUPLICATE_TOKENS = 4
+# Fingerprints are indexed by this many 16 bit bands. Near-duplicates agree on at least one band (pigeonhole),
+# which holds as long as _MAX_HAMMING_DISTANCE is below this
+_SIMHASH_BANDS = 4
+# Words, and every other non-space character on its own, so emoji spam is part of the fingerprint
+_TOKEN_REGEX = re.compile(r"\w+|[^\w\s]")
+# Odd 64 bit constant combining the hashes of adjacent words into the hash of their shingle
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class RotatingIdSet:
+    """Set of recently added ids in bounded memory. Ids are added to the current generation; once it holds
+    capacity ids it replaces the previous generation, which is forgotten. Between capacity and 2 * capacity of
+    the most recent ids are remembered, enough for the repeats of pagination and of the monitor's re-fetch, which
+    are at most a few pages apart."""
+
+    def __init__(self, capacity: int = _DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._current: Set[str] = set()
+        self._previous: Set[str] = set()
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def __contains__(self, comment_id: str):
+        return comment_id in self._current or comment_id in self._previous
+
+    def add(self, comment_id: str) -> bool:
+        """Adds the id, returns False if it was already present"""
+        if comment_id in self:
+            return False
+        if len(self._current) >= self.capacity:
+            self._previous, self._current = self._current, set()
+        self._current.add(comment_id)
+        return True
+
+
+class SimHashIndex:
+    """Finds near-duplicate bodies: every body is reduced to a 64 bit SimHash fingerprint, and bodies whose
+    fingerprints differ in at most max_distance bits are considered the same text. Fingerprints are looked up by
+    band, so a lookup only compares against the few fingerprints that share a band. Memory is bounded by rotating
+    generations like RotatingIdSet."""
+
+    def __init__(self, capacity: int = _DEFAULT_CAPACITY, max_distance: int = _MAX_HAMMING_DISTANCE):
+        if max_distance >= _SIMHASH_BANDS:
+            raise ValueError(f"max_distance must be below {_SIMHASH_BANDS}, got {max_distance}.")
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self._current: Dict[int, List[int]] = {}
+        self._previous: Dict[int, List[int]] = {}
+        self._current_size = 0
+
+    def add(self, fingerprint: int) -> bool:
+        """Adds the fingerprint, returns False if a near-duplicate was already present"""
+        keys = _band_keys(fingerprint)
+        for generation in self._current, self._previous:
+            for key in keys:
+                for other in generation.get(key, ()):
+                    if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                        return False
+        if self._current_size >= self.capacity:
+            self._previous, self._current, self._current_size = self._current, {}, 0
+        for key in keys:
+            self._current.setdefault(key, []).append(fingerprint)
+        self._current_size += 1
+        return True
+
+
+class CommentFilter:
+    """Drops the comments that should not be counted or classified, in order of cost: ids seen before (repeated where a
+    page restarts and re-fetched by the monitor), comments below min_score, comments by blocked authors and bodies that
+    nearly duplicate an earlier one (copy-pasted spam). Keep one filter per crawl; it remembers what it has seen.
+    min_score=None keeps comments of any score, near_duplicates=False only deduplicates ids."""
+
+    def __init__(self, min_score: Optional[int] = None, blocked_authors: Iterable[str] = _BLOCKED_AUTHORS,
+                 near_duplicates: bool = True, capacity: int = _DEFAULT_CAPACITY,
+                 max_distance: int = _MAX_HAMMING_DISTANCE):
+        self.min_score = min_score
+        self.blocked_authors = frozenset(blocked_authors)
+        self.seen_ids = RotatingIdSet(capacity)
+        self.fingerprints = SimHashIndex(capacity, max_distance) if near_duplicates else None
+        # Number of dropped comments by reason
+        self.dropped: Dict[str, int] = {}
+
+    def filter(self, comments: Iterable[Dict]) -> List[Dict]:
+        """Returns the comments to keep, in order. Fingerprints are computed for all remaining comments (usually
+        a page) at once."""
+        kept = [comment for comment in comments if not self._drop(self._drop_reason(comment))]
+        if not self.fingerprints:
+            return kept
+        token_lists = [_TOKEN_REGEX.findall((comment.get("body") or "").lower()) for comment in kept]
+        long_bodies = [i for i, tokens in enumerate(token_lists) if len(tokens) >= _MIN_NEAR_DUPLICATE_TOKENS]
+        near_duplicates = set()
+        for i, fingerprint in zip(long_bodies, simhashes([token_lists[i] for i in long_bodies])):
+            if not self.fingerprints.add(fingerprint):
+                near_duplicates.add(i)
+                self._drop("near_duplicate")
+        return [comment for i, comment in enumerate(kept) if i not in near_duplicates]
+
+    def _drop_reason(self, comment: Dict) -> Optional[str]:
+        if not self.seen_ids.add(comment.get("id")):
+            return "duplicate_id"
+        if self.min_score is not None and (comment.get("score") or 0) < self.min_score:
+            return "low_score"
+        if comment.get("author") in self.blocked_authors:
+            return "blocked_author"
+        return None
+
+    def _drop(self, reason: Optional[str]) -> bool:
+        if reason:
+            self.dropped[reason] = self.dropped.get(reason, 0) + 1
+            REGISTRY.counter("comments_filtered_total", "Comments dropped before counting or classification",
+                             reason=reason).inc()
+        return reason is not None
+
+
+def simhash(tokens: List[str]) -> int:
+    """64 bit SimHash of a token list: every bit is set if more of its distinct shingles (pairs of adjacent tokens)
+    have it set in their hash than not. Counting distinct shingles rather than occurrences keeps bodies that
+    repeat a common word from all sharing that word's hash."""
+    return simhashes([tokens])[0]
+
+
+def simhashes(token_lists: List[List[str]]) -> List[int]:
+    """simhash of every non-empty token list, computed for the whole batch at once"""
+    if not token_lists:
+        return []
+    lengths = np.fromiter((len(tokens) for tokens in token_lists), dtype=np.int64, count=len(token_lists))
+    hashes = np.fromiter((_token_hash(token) for tokens in token_lists for token in tokens), dtype=np.uint64,
+                         count=int(lengths.sum()))
+    documents = np.repeat(np.arange(len(token_lists)), lengths)
+    # Word hashes repeat and are cached, shingle hashes are mixed from them without hashing strings again. A
+    # single word document is its own shingle
+    pairs = documents[:-1] == documents[1:]
+    singles = np.flatnonzero(lengths == 1)
+    first = np.cumsum(lengths) - lengths
+    hashes = np.concatenate([_mix(hashes[:-1][pairs] * _SHINGLE_MULTIPLIER + hashes[1:][pairs]),
+                             hashes[first[singles]]])
+    documents = np.concatenate([documents[:-1][pairs], singles])
+    # Sort by document, then hash, and keep the distinct shingles of every document
+    order = np.lexsort((hashes, documents))
+    hashes, documents = hashes[order], documents[order]
+    distinct = np.ones(len(hashes), dtype=bool)
+    distinct[1:] = (hashes[1:] != hashes[:-1]) | (documents[1:] != documents[:-1])
+    hashes, documents = hashes[distinct], documents[distinct]
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(len(hashes), 64)
+    # Every document has at least one shingle, and the shingles of a document are contiguous
+    shingle_counts = np.bincount(documents, minlength=len(token_lists))
+    bit_counts = np.add.reduceat(bits, np.cumsum(shingle_counts) - shingle_counts, axis=0, dtype=np.int64)
+    majority = (2 * bit_counts > shingle_counts[:, None]).astype(np.uint8)
+    return [int.from_bytes(row.tobytes(), "big") for row in np.packbits(majority, axis=1)]
+
+
+@lru_cache(maxsize=1 << 16)
+def _token_hash(token: str) -> int:
+    # Stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, spreads every input bit over the whole 64 bit output"""
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _band_keys(fingerprint: int) -> List[int]:
+    return [band << 16 | (fingerprint >> (16 * band)) & 0xFFFF for band in range(_SIMHASH_BANDS)]
@@ -1,11 +1,24 @@
 import csv
+import logging
+import os
 from datetime import datetime
-from typing import List
+from typing import BinaryIO, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 
 from classifier.naive_bayes import ClassificationData
+from service.backtest_service import BacktestResult, TickerBacktestData
+from service.sentiment_service import SentimentDataDTO, TickerSentimentData
 from service.ticker_service import TickerDataDTO, AggregateTickerData
 
 _DATE_FMT = "%Y%m%d"
+_COLUMNAR_EXTENSION = "npcol"
+# Kind of a column holding strings, stored as utf-8 bytes plus offsets. Other columns store their numpy dtype
+_STR_KIND = "str"
+_TICKER_COUNT_COLUMNS = [("ticker", _STR_KIND), ("count", "<i8"), ("failed_during_fetch", "|b1")]
+_SENTIMENT_COLUMNS = [("comment", _STR_KIND), ("classification", "|i1")]
+
+logger = logging.getLogger(__name__)
 
 
 def write_ticker_count_to_csv(data: TickerDataDTO):
@@ -13,8 +26,8 @@ def write_ticker_count_to_csv(data: TickerDataDTO):
     with open(file_name, 'w', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(AggregateTickerData.__fields__)
-        for ticker_data in data.aggregate_data:
-            writer.writerow(ticker_data.dict().values())
+        writer.writerows([[getattr(ticker_data, field) for field in AggregateTickerData.__fields__]
+                          for ticker_data in data.aggregate_data])
     return file_name
 
 
@@ -23,8 +36,45 @@ def write_comment_sentiment_to_csv(data: List[ClassificationData], ticker: str):
     with open(file_name, 'w', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(ClassificationData.__fields__)
-        for classification_data in data:
-            writer.writerow(classification_data.dict().values())
+        writer.writerows([[classification_data.comment, classification_data.classification]
+                          for classification_data in data])
+    return file_name
+
+
+def write_comment_sentiment_batches_to_csv(batches: Iterable[List[List]], ticker: str):
+    """Writes [comment, classification] batches as they are produced. The file is named like
+    write_comment_sentiment_to_csv once the number of comments is known."""
+    partial_file_name = f'sentiment_analysis_{ticker}_{datetime.utcnow().strftime(_DATE_FMT)}.csv.partial'
+    row_count = 0
+    with open(partial_file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(ClassificationData.__fields__)
+        for batch in batches:
+            writer.writerows(batch)
+            row_count += len(batch)
+    file_name = f'sentiment_analysis_{ticker}_{row_count}_{datetime.utcnow().strftime(_DATE_FMT)}.csv'
+    os.replace(partial_file_name, file_name)
+    return file_name
+
+
+def write_ticker_sentiment_to_csv(data: SentimentDataDTO):
+    file_name = f'sentiment_{len(data.sentiment_data)}_tickers_{data.from_date.strftime(_DATE_FMT)}-{data.to_date.strftime(_DATE_FMT)}.csv'
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TickerSentimentData.__fields__)
+        writer.writerows([[getattr(sentiment_data, field) for field in TickerSentimentData.__fields__]
+                          for sentiment_data in data.sentiment_data])
+    return file_name
+
+
+def write_backtest_to_csv(result: BacktestResult):
+    """One row per ticker and horizon, the strongest relationships first"""
+    rows = sorted(result.rows(), key=lambda row: (row.horizon, -abs(row.t_stat)))
+    file_name = f'backtest_{result.signal_name}_{len(result.tickers)}_tickers_{datetime.utcnow().strftime(_DATE_FMT)}.csv'
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(TickerBacktestData.__fields__)
+        writer.writerows([[getattr(row, field) for field in TickerBacktestData.__fields__] for row in rows])
     return file_name
 
 
@@ -33,3 +83,163 @@ def read_csv(file_name: str):
         reader = csv.reader(f)
         data = list(reader)
     return data
+
+
+class ColumnarWriter:
+    """Writes rows to a columnar binary file in row groups, so a streaming run can keep appending.
+
+    The file is a sequence of .npy arrays: first the (name, kind) schema, then for every row group one array per
+    numeric column and an offsets plus a utf-8 bytes array per string column. read_columnar() loads only the
+    requested columns and skips the bytes of the others.
+    With append, an existing file with the same schema is extended with new row groups instead of being replaced.
+    row_count then includes the rows already in the file."""
+
+    def __init__(self, file_name: str, columns: Sequence[Tuple[str, str]], append: bool = False):
+        self.file_name = file_name
+        self.columns = [tuple(column) for column in columns]
+        self.append = append
+        self.row_count = 0
+        self._file: Optional[BinaryIO] = None
+
+    def __enter__(self):
+        if self.append and os.path.isfile(self.file_name):
+            self._file = open(self.file_name, 'r+b')
+            try:
+                self._seek_to_end_of_row_groups()
+            except Exception:
+                self._file.close()
+                raise
+        else:
+            self._file = open(self.file_name, 'wb')
+            np.lib.format.write_array(self._file, np.array(self.columns, dtype=str), allow_pickle=False)
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+    def _seek_to_end_of_row_groups(self):
+        """Validates the schema of the existing file, counts its rows and positions the file after its last complete
+        row group. A row group cut short by a crash is cut off."""
+        schema = [tuple(column) for column in _read_array(self._file).tolist()]
+        if schema != self.columns:
+            raise ValueError(f"Cannot append to {self.file_name}, it has columns {schema} instead of {self.columns}.")
+        file_size = os.fstat(self._file.fileno()).st_size
+        end = self._file.tell()
+        try:
+            while end < file_size:
+                # Rows of the group's first column, an offsets array holds one more value than there are strings
+                rows = _skip_array(self._file) - (schema[0][1] == _STR_KIND)
+                for _ in range(len(_row_group_arrays(schema)) - 1):
+                    _skip_array(self._file)
+                if self._file.tell() > file_size:
+                    break
+                self.row_count += rows
+                end = self._file.tell()
+        except ValueError:
+            pass
+        if end < file_size:
+            logger.warning(f"Cutting off an incomplete row group at the end of {self.file_name}.")
+            self._file.truncate(end)
+        self._file.seek(end)
+
+    def write_rows(self, rows: Sequence[Sequence]):
+        """Appends rows (one value per column, in schema order) as one row group"""
+        if rows:
+            self.write_columns([[row[i] for row in rows] for i in range(len(self.columns))])
+
+    def write_columns(self, columns: Sequence[Sequence]):
+        """Appends one row group given as one sequence of values per column, in schema order"""
+        for (_, kind), values in zip(self.columns, columns):
+            if kind == _STR_KIND:
+                encoded = [value.encode('utf-8') for value in values]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(value) for value in encoded], out=offsets[1:])
+                np.lib.format.write_array(self._file, offsets, allow_pickle=False)
+                np.lib.format.write_array(self._file, np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                                          allow_pickle=False)
+            else:
+                np.lib.format.write_array(self._file, np.asarray(values, dtype=kind), allow_pickle=False)
+        self.row_count += len(columns[0]) if columns else 0
+
+
+def read_columnar(file_name: str, columns: Sequence[str] = None) -> Dict[str, Union[np.ndarray, List[str]]]:
+    """Reads the given columns (all by default) of a file written by ColumnarWriter. Numeric columns are returned
+    as numpy arrays, string columns as lists of str."""
+    with open(file_name, 'rb') as f:
+        schema = [tuple(column) for column in _read_array(f).tolist()]
+        wanted = set(columns or [name for name, _ in schema])
+        parts: Dict[str, list] = {name: [] for name, _ in schema if name in wanted}
+        # Every row group repeats the schema's arrays until the end of the file
+        while f.peek(1):
+            for name, kind in schema:
+                arrays = 2 if kind == _STR_KIND else 1
+                if name not in wanted:
+                    for _ in range(arrays):
+                        _read_array(f, skip=True)
+                elif kind == _STR_KIND:
+                    offsets, data = _read_array(f), _read_array(f).tobytes()
+                    parts[name].extend(data[start:end].decode('utf-8')
+                                       for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()))
+                else:
+                    parts[name].append(_read_array(f))
+    result = {}
+    for name, kind in schema:
+        if name in parts:
+            result[name] = parts[name] if kind == _STR_KIND else \
+                np.concatenate(parts[name]) if parts[name] else np.array([], dtype=kind)
+    return result
+
+
+def _row_group_arrays(schema: Sequence[Tuple[str, str]]) -> List[str]:
+    """Name of the column of every array in a row group"""
+    return [name for name, kind in schema for _ in range(2 if kind == _STR_KIND else 1)]
+
+
+def _read_header(f: BinaryIO) -> Tuple[Tuple[int, ...], np.dtype]:
+    if np.lib.format.read_magic(f) == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
+
+
+def _skip_array(f: BinaryIO) -> int:
+    """Skips an array, returns its length"""
+    shape, dtype = _read_header(f)
+    f.seek(int(np.prod(shape)) * dtype.itemsize, os.SEEK_CUR)
+    return shape[0]
+
+
+def _read_array(f: BinaryIO, skip: bool = False) -> Optional[np.ndarray]:
+    shape, dtype = _read_header(f)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    if skip:
+        f.seek(nbytes, os.SEEK_CUR)
+        return None
+    return np.frombuffer(f.read(nbytes), dtype=dtype).reshape(shape)
+
+
+def write_ticker_count_to_columnar(data: TickerDataDTO):
+    file_name = f'ticker_{len(data.aggregate_data)}_{data.from_date.strftime(_DATE_FMT)}-{data.to_date.strftime(_DATE_FMT)}.{_COLUMNAR_EXTENSION}'
+    with ColumnarWriter(file_name, _TICKER_COUNT_COLUMNS) as writer:
+        writer.write_columns([[ticker_data.ticker for ticker_data in data.aggregate_data],
+                              [ticker_data.count for ticker_data in data.aggregate_data],
+                              [ticker_data.failed_during_fetch for ticker_data in data.aggregate_data]])
+    return file_name
+
+
+def write_comment_sentiment_to_columnar(data: List[ClassificationData], ticker: str):
+    return write_comment_sentiment_batches_to_columnar([[[classification_data.comment,
+                                                          classification_data.classification]
+                                                         for classification_data in data]], ticker)
+
+
+def write_comment_sentiment_batches_to_columnar(batches: Iterable[List[List]], ticker: str):
+    """Columnar counterpart of write_comment_sentiment_batches_to_csv, every batch becomes one row group"""
+    partial_file_name = f'sentiment_analysis_{ticker}_{datetime.utcnow().strftime(_DATE_FMT)}.{_COLUMNAR_EXTENSION}.partial'
+    with ColumnarWriter(partial_file_name, _SENTIMENT_COLUMNS) as writer:
+        for batch in batches:
+            writer.write_rows(batch)
+    file_name = f'sentiment_analysis_{ticker}_{writer.row_count}_{datetime.utcnow().strftime(_DATE_FMT)}.{_COLUMNAR_EXTENSION}'
+    os.replace(partial_file_name, file_name)
+    return file_name
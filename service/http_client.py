@@ -0,0 +1,159 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from util.metrics import REGISTRY
+
+# Number of times to retry calling the API if call fails, shared by the blocking and the async client
+API_RETRY_ATTEMPTS = 10
+# Status codes the API uses to signal that we are sending requests too quickly
+_RATE_LIMIT_STATUS_CODES = {409, 429}
+_BACKOFF_BASE_SECONDS = 1
+_BACKOFF_CAP_SECONDS = 60
+# Requests per second to start with, the limiter adapts between the min and max rate from there
+_INITIAL_REQUEST_RATE = 1.0
+_MIN_REQUEST_RATE = 0.1
+_MAX_REQUEST_RATE = 4.0
+_MAX_REQUESTS_IN_FLIGHT = 4
+_REQUEST_TIMEOUT_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delay(retry_attempt: int, retry_after: Optional[float] = None) -> float:
+    """Seconds to wait before the next retry: the server's Retry-After when given, otherwise exponential backoff
+    with full jitter. See: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/"""
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(_BACKOFF_CAP_SECONDS, _BACKOFF_BASE_SECONDS * 2 ** retry_attempt))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Shared request rate limiter. The rate grows additively after successful requests and is halved whenever
+    the API reports rate limiting, in which case no tokens are handed out until Retry-After has passed."""
+
+    def __init__(self, rate: float = _INITIAL_REQUEST_RATE, min_rate: float = _MIN_REQUEST_RATE,
+                 max_rate: float = _MAX_REQUEST_RATE, capacity: float = 1):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.min_rate)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        self.rate = max(self.min_rate, self.rate / 2)
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        logger.debug(f"Rate limited by API, lowering request rate to {self.rate:.2f} requests per second.")
+
+
+class AsyncFetcher:
+    """Fetches pushshift pages through one aiohttp session with a shared limiter and a bounded number of
+    requests in flight. Use as an async context manager."""
+
+    def __init__(self, limiter: TokenBucket = None, max_in_flight: int = _MAX_REQUESTS_IN_FLIGHT,
+                 retry_attempts: int = API_RETRY_ATTEMPTS):
+        self.limiter = limiter or TokenBucket()
+        self.retry_attempts = retry_attempts
+        self._max_in_flight = max_in_flight
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self._max_in_flight)
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=_REQUEST_TIMEOUT_SECONDS))
+        return self
+
+    async def __aexit__(self, *args):
+        await self._session.close()
+
+    async def get_comments(self, api_call: str) -> List[Dict]:
+        for retry_attempt in range(self.retry_attempts):
+            wait_start = time.perf_counter()
+            await self.limiter.acquire()
+            REGISTRY.counter("api_rate_limiter_wait_seconds_total",
+                             "Seconds spent waiting for the request rate limiter").inc(time.perf_counter() - wait_start)
+            retry_after = None
+            async with self._semaphore:
+                request_start = time.perf_counter()
+                try:
+                    async with self._session.get(api_call) as resp:
+                        status_code = resp.status
+                        body = await resp.read()
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status_code, body = None, str(e).encode()
+            record_request(status_code, time.perf_counter() - request_start, len(body))
+            if status_code == 200:
+                self.limiter.on_success()
+                try:
+                    return json.loads(body).get("data")
+                except Exception as e:
+                    logger.exception(f"Unexpected exception occurred.\n"
+                                     f"API CALL: {api_call}\n"
+                                     f"RESPONSE TEXT: {body.decode(errors='replace')}")
+                    raise e
+            if status_code in _RATE_LIMIT_STATUS_CODES:
+                self.limiter.on_rate_limited(retry_after)
+            delay = backoff_delay(retry_attempt, retry_after)
+            record_retry(status_code, delay)
+            logger.debug(f"Error occurred during call to: {api_call}.\n"
+                         f"Status code: {status_code}\n"
+                         f"Sleeping for {delay:.2f} seconds.")
+            await asyncio.sleep(delay)
+        raise ApiError(f"{api_call} failed too many times in a row.")
+
+
+def record_request(status_code: Optional[int], seconds: float, response_bytes: int):
+    """Records one API request. status_code is None when no response was received."""
+    status = str(status_code) if status_code else "error"
+    REGISTRY.counter("api_requests_total", "API requests by response status", status=status).inc()
+    REGISTRY.histogram("api_request_seconds", "API request latency by response status", status=status) \
+        .observe(seconds)
+    REGISTRY.counter("api_response_bytes_total", "Bytes of API response bodies").inc(response_bytes)
+
+
+def record_retry(status_code: Optional[int], delay: float):
+    status = str(status_code) if status_code else "error"
+    REGISTRY.counter("api_retries_total", "API requests retried, by the status that caused the retry",
+                     status=status).inc()
+    REGISTRY.counter("api_backoff_seconds_total", "Seconds spent sleeping before retrying API requests").inc(delay)
+
+
+class ApiError(Exception):
+    pass
@@ -0,0 +1,191 @@
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel
+
+from service.ticker_service import AggregateTickerData, TickerDataDTO, sort_aggregate_data_by_count
+from util.dates import utc_timestamp
+
+_DEFAULT_STORE_FILE = "mentions.sqlite"
+# Rollup granularities and their length in seconds
+BUCKET_SECONDS = {"hour": 60 * 60, "day": 24 * 60 * 60}
+
+logger = logging.getLogger(__name__)
+
+
+class MentionRecord(BaseModel):
+    comment_id: str
+    created_utc: int
+    ticker: str
+    score: int = 0
+    classification: Optional[int] = None
+
+
+class MentionBucket(BaseModel):
+    ticker: str
+    bucket_start: datetime
+    mentions: int
+    positive: int
+    negative: int
+    score_sum: int
+
+
+class MentionStore:
+    """SQLite store of ticker mentions (one row per comment and ticker) with hourly and daily rollups per ticker.
+
+    Rollups are updated in the same transaction as the mentions they summarize, counting only mentions that
+    were not stored before, so re-adding an overlapping crawl does not double count. Range queries read the
+    rollups instead of the mentions."""
+
+    def __init__(self, file_name: str = _DEFAULT_STORE_FILE):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        with self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS mentions (
+                    comment_id TEXT NOT NULL,
+                    ticker TEXT NOT NULL,
+                    created_utc INTEGER NOT NULL,
+                    score INTEGER NOT NULL,
+                    classification INTEGER,
+                    PRIMARY KEY (comment_id, ticker)
+                );
+                CREATE TABLE IF NOT EXISTS rollups (
+                    ticker TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    bucket_start INTEGER NOT NULL,
+                    mentions INTEGER NOT NULL,
+                    positive INTEGER NOT NULL,
+                    negative INTEGER NOT NULL,
+                    score_sum INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, ticker, bucket_start)
+                );
+                CREATE INDEX IF NOT EXISTS rollups_by_time ON rollups (bucket, bucket_start);
+            """)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_mentions(self, records: Iterable[MentionRecord]) -> int:
+        """Stores new mentions and updates the rollups. Returns the number of mentions that were not stored yet."""
+        deltas: Dict[Tuple[str, str, int], List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+        added = 0
+        with self._lock, self._connection:
+            for record in records:
+                cursor = self._connection.execute(
+                    "INSERT OR IGNORE INTO mentions VALUES (?, ?, ?, ?, ?)",
+                    (record.comment_id, record.ticker, record.created_utc, record.score, record.classification))
+                if cursor.rowcount:
+                    added += 1
+                    _add_to_deltas(deltas, record.ticker, record.created_utc,
+                                   (1, record.classification == 1, record.classification == 0, record.score))
+            self._apply_deltas(deltas)
+        return added
+
+    def add_comments(self, ticker: str, comments: List[Dict]) -> int:
+        """Stores raw pushshift comment records as mentions of ticker. Matches the on_comments hook of
+        aggregate_ticker_comment_count, so a crawl can be recorded while it runs."""
+        return self.add_mentions(MentionRecord(comment_id=comment.get("id"), created_utc=comment.get("created_utc"),
+                                               ticker=ticker, score=comment.get("score", 0)) for comment in comments)
+
+    def set_classifications(self, classifications: Iterable[Tuple[str, int]]) -> int:
+        """Sets the sentiment of stored comments from (comment_id, classification) pairs and updates the
+        positive/negative rollups. Returns the number of mentions that changed."""
+        deltas: Dict[Tuple[str, str, int], List[int]] = defaultdict(lambda: [0, 0, 0, 0])
+        changed = 0
+        with self._lock, self._connection:
+            for comment_id, classification in classifications:
+                rows = self._connection.execute(
+                    "SELECT ticker, created_utc, classification FROM mentions WHERE comment_id = ?",
+                    (comment_id,)).fetchall()
+                for ticker, created_utc, previous in rows:
+                    if previous == classification:
+                        continue
+                    changed += 1
+                    _add_to_deltas(deltas, ticker, created_utc,
+                                   (0, (classification == 1) - (previous == 1),
+                                    (classification == 0) - (previous == 0), 0))
+                self._connection.execute("UPDATE mentions SET classification = ? WHERE comment_id = ?",
+                                         (classification, comment_id))
+            self._apply_deltas(deltas)
+        return changed
+
+    def _apply_deltas(self, deltas: Dict[Tuple[str, str, int], List[int]]):
+        self._connection.executemany("""
+            INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (bucket, ticker, bucket_start) DO UPDATE SET
+                mentions = mentions + excluded.mentions,
+                positive = positive + excluded.positive,
+                negative = negative + excluded.negative,
+                score_sum = score_sum + excluded.score_sum
+        """, [(ticker, bucket, bucket_start, *delta) for (ticker, bucket, bucket_start), delta in deltas.items()])
+
+    def ticker_counts(self, from_date: datetime, to_date: datetime) -> TickerDataDTO:
+        """Mentions per ticker in [from_date, to_date), sorted by count like aggregate_ticker_comment_count.
+        Whole-day ranges are answered from the daily rollups, anything else from the hourly ones, so the range is
+        effectively rounded to whole hours."""
+        bucket = _bucket_for_range(from_date, to_date)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT ticker, SUM(mentions) FROM rollups WHERE bucket = ? AND bucket_start >= ? AND bucket_start < ? "
+                "GROUP BY ticker", (bucket, utc_timestamp(from_date), utc_timestamp(to_date))).fetchall()
+        aggregate_data = [AggregateTickerData(ticker=ticker, count=count) for ticker, count in rows]
+        sort_aggregate_data_by_count(aggregate_data)
+        return TickerDataDTO(aggregate_data=aggregate_data, from_date=from_date, to_date=to_date)
+
+    def mention_series(self, ticker: str, from_date: datetime, to_date: datetime,
+                       bucket: str = "hour") -> List[MentionBucket]:
+        """Rollup rows of one ticker in [from_date, to_date) in time order. Buckets without mentions are left out."""
+        if bucket not in BUCKET_SECONDS:
+            raise ValueError(f"Unknown bucket {bucket}, expected one of {list(BUCKET_SECONDS)}.")
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT bucket_start, mentions, positive, negative, score_sum FROM rollups "
+                "WHERE bucket = ? AND ticker = ? AND bucket_start >= ? AND bucket_start < ? ORDER BY bucket_start",
+                (bucket, ticker, utc_timestamp(from_date), utc_timestamp(to_date))).fetchall()
+        return [MentionBucket(ticker=ticker, bucket_start=datetime.utcfromtimestamp(bucket_start), mentions=mentions,
+                              positive=positive, negative=negative, score_sum=score_sum)
+                for bucket_start, mentions, positive, negative, score_sum in rows]
+
+    def rollup_columns(self, from_date: datetime, to_date: datetime, bucket: str = "day") -> Dict[str, np.ndarray]:
+        """Rollup rows of every ticker in [from_date, to_date) as columns (ticker, bucket_start, mentions, positive,
+        negative, score_sum), read in one query. Meant for analyses over many tickers, e.g. backtest_service."""
+        if bucket not in BUCKET_SECONDS:
+            raise ValueError(f"Unknown bucket {bucket}, expected one of {list(BUCKET_SECONDS)}.")
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT ticker, bucket_start, mentions, positive, negative, score_sum FROM rollups "
+                "WHERE bucket = ? AND bucket_start >= ? AND bucket_start < ?",
+                (bucket, utc_timestamp(from_date), utc_timestamp(to_date))).fetchall()
+        columns = list(zip(*rows)) or [()] * 6
+        return {"ticker": np.array(columns[0], dtype=str),
+                **{name: np.array(column, dtype=np.int64) for name, column in
+                   zip(("bucket_start", "mentions", "positive", "negative", "score_sum"), columns[1:])}}
+
+
+def _add_to_deltas(deltas: Dict[Tuple[str, str, int], List[int]], ticker: str, created_utc: int,
+                   values: Tuple[int, int, int, int]):
+    for bucket, seconds in BUCKET_SECONDS.items():
+        delta = deltas[(ticker, bucket, created_utc // seconds * seconds)]
+        for i, value in enumerate(values):
+            delta[i] += value
+
+
+def _bucket_for_range(from_date: datetime, to_date: datetime) -> str:
+    """Daily rollups when the range covers whole days, hourly rollups otherwise"""
+    day_seconds = BUCKET_SECONDS["day"]
+    if utc_timestamp(from_date) % day_seconds == 0 and utc_timestamp(to_date) % day_seconds == 0:
+        return "day"
+    return "hour"
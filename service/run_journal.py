@@ -0,0 +1,163 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_DEFAULT_JOURNAL_FILE = "run_journal.sqlite"
+# Progress is written to disk at most this long after it was made, and whenever a run is closed
+_FLUSH_INTERVAL_SECONDS = 5.0
+# Windows ending less than this long ago still receive comments (and votes), so their runs are never final, see
+# RunJournal.resume
+_OPEN_WINDOW_SECONDS = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class RunJournal:
+    """SQLite journal of aggregation runs, so an interrupted or partly failed run can be resumed.
+
+    A run is identified by its parameters (window, subreddit, mode). Per-ticker runs record the count of every
+    finished ticker; single-pass scans record the created_utc cursor of the last processed page together with the
+    running counts. Progress is buffered and flushed every flush_interval_seconds and on close, so a crash loses
+    at most that much work.
+
+    A window that is still open (ending less than _OPEN_WINDOW_SECONDS ago) keeps changing, so the progress of its
+    run is only reused to resume an interrupted invocation: it is forgotten once a run finishes without failures or
+    once it is older than _OPEN_WINDOW_SECONDS, and a scan of it is never marked complete."""
+
+    def __init__(self, file_name: str = _DEFAULT_JOURNAL_FILE, flush_interval_seconds: float = _FLUSH_INTERVAL_SECONDS):
+        self.file_name = file_name
+        self.flush_interval_seconds = flush_interval_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(file_name, check_same_thread=False)
+        with self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_key TEXT PRIMARY KEY,
+                    params TEXT NOT NULL,
+                    started REAL NOT NULL,
+                    scan_cursor INTEGER,
+                    scan_counts TEXT,
+                    scan_complete INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS ticker_results (
+                    run_key TEXT NOT NULL,
+                    ticker TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    failed INTEGER NOT NULL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (run_key, ticker)
+                );
+            """)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def resume(self, from_timestamp: int, to_timestamp: int, subreddit: Optional[str], single_pass: bool = False,
+               tickers: Iterable[str] = None) -> "JournalRun":
+        """Returns the run with these parameters, creating it if it was never started. Per-ticker runs track every
+        ticker separately, so their ticker list may change between invocations. The running counts of a scan are
+        only valid for one ticker list, so scans pass tickers to make it part of the run's identity."""
+        params = {"from": from_timestamp, "to": to_timestamp, "subreddit": subreddit or "", "single_pass": single_pass}
+        if tickers is not None:
+            params["tickers"] = hashlib.sha1("\n".join(sorted(tickers)).encode()).hexdigest()
+        run_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        now = time.time()
+        open_window = to_timestamp > now - _OPEN_WINDOW_SECONDS
+        with self._lock, self._connection:
+            if open_window:
+                stale = self._connection.execute("SELECT 1 FROM runs WHERE run_key = ? AND started < ?",
+                                                 (run_key, now - _OPEN_WINDOW_SECONDS)).fetchone()
+                if stale:
+                    logger.info("Discarding the progress of an earlier run, its window was still open.")
+                    self._delete(run_key)
+            self._connection.execute("INSERT OR IGNORE INTO runs (run_key, params, started) VALUES (?, ?, ?)",
+                                     (run_key, json.dumps(params), now))
+        return JournalRun(self, run_key, open_window)
+
+    def _delete(self, run_key: str):
+        self._connection.execute("DELETE FROM ticker_results WHERE run_key = ?", (run_key,))
+        self._connection.execute("DELETE FROM runs WHERE run_key = ?", (run_key,))
+
+
+class JournalRun:
+    """Progress of one run. Use as a context manager, leaving it flushes all buffered progress."""
+
+    def __init__(self, journal: RunJournal, run_key: str, open_window: bool = False):
+        self.journal = journal
+        self.run_key = run_key
+        # The window still receives comments, so the progress is not final, see RunJournal.resume
+        self.open_window = open_window
+        self._pending_tickers: List[Tuple[str, str, int, bool, float]] = []
+        self._pending_scan: Optional[Tuple[int, Dict[str, int], bool]] = None
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+    def finished_tickers(self) -> Dict[str, int]:
+        """Counts of the tickers that were counted without fetch failures. Failed tickers are left out, so they
+        are counted again."""
+        with self.journal._lock:
+            rows = self.journal._connection.execute(
+                "SELECT ticker, count FROM ticker_results WHERE run_key = ? AND NOT failed", (self.run_key,))
+            return dict(rows.fetchall())
+
+    def record_ticker(self, ticker: str, count: int, failed_during_fetch: bool):
+        self._pending_tickers.append((self.run_key, ticker, count, failed_during_fetch, time.time()))
+        self._maybe_flush()
+
+    def scan_state(self) -> Tuple[Optional[int], Dict[str, int], bool]:
+        """(cursor, counts, complete) of a single-pass scan. Comments up to and including created_utc == cursor
+        are already in counts, None means the scan has not processed any page yet."""
+        with self.journal._lock:
+            cursor, counts, complete = self.journal._connection.execute(
+                "SELECT scan_cursor, scan_counts, scan_complete FROM runs WHERE run_key = ?",
+                (self.run_key,)).fetchone()
+        return cursor, json.loads(counts) if counts else {}, bool(complete)
+
+    def record_scan_page(self, cursor: int, counts: Dict[str, int], complete: bool = False):
+        """Records that the scan has counted everything up to cursor. counts is copied at the next flush, so the
+        caller may keep updating the same dict. A scan of an open window is never recorded as complete."""
+        complete = complete and not self.open_window
+        self._pending_scan = (cursor, counts, complete)
+        self._maybe_flush(force=complete)
+
+    def finish(self, failed: bool):
+        """Flushes the progress. A run of an open window that finished without failures is forgotten, so the next
+        run counts the window again instead of reusing counts that have gone stale."""
+        self.flush()
+        if self.open_window and not failed:
+            with self.journal._lock, self.journal._connection:
+                self.journal._delete(self.run_key)
+
+    def _maybe_flush(self, force: bool = False):
+        if force or time.monotonic() - self._last_flush >= self.journal.flush_interval_seconds:
+            self.flush()
+
+    def flush(self):
+        pending_tickers, self._pending_tickers = self._pending_tickers, []
+        pending_scan, self._pending_scan = self._pending_scan, None
+        with self.journal._lock, self.journal._connection:
+            self.journal._connection.executemany("INSERT OR REPLACE INTO ticker_results VALUES (?, ?, ?, ?, ?)",
+                                                 pending_tickers)
+            if pending_scan:
+                cursor, counts, complete = pending_scan
+                self.journal._connection.execute(
+                    "UPDATE runs SET scan_cursor = ?, scan_counts = ?, scan_complete = ? WHERE run_key = ?",
+                    (cursor, json.dumps(counts), complete, self.run_key))
+        self._last_flush = time.monotonic()
+        if pending_tickers or pending_scan:
+            logger.debug(f"Flushed progress of {len(pending_tickers)} tickers to {self.journal.file_name}.")
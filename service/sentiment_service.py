@@ -0,0 +1,107 @@
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import BaseModel
+
+from classifier.naive_bayes import NaiveBayes
+from service.comment_cache import CommentCache
+from service.comment_filter import CommentFilter
+from service.http_client import ApiError
+from service.ticker_matcher import TickerMatcher
+from service.ticker_service import CommentSink, get_start_and_end_date, stream_comment_pages
+from util.dates import utc_timestamp
+from util.timer import Timer
+
+logger = logging.getLogger(__name__)
+
+# Called with the (comment id, classification) pairs of every classified batch, e.g. MentionStore.set_classifications
+ClassificationSink = Callable[[List[Tuple[str, int]]], None]
+
+
+class TickerSentimentData(BaseModel):
+    ticker: str
+    comment_count: int
+    positive: int
+    negative: int
+    # Share of positive comments
+    positive_ratio: float
+
+
+class SentimentDataDTO(BaseModel):
+    sentiment_data: List[TickerSentimentData]
+    from_date: datetime
+    to_date: datetime
+    failed_during_fetch: bool = False
+
+
+def aggregate_ticker_sentiment(ticker_list: List[str], naive_bayes: NaiveBayes, days_to_look_back: int = 1,
+                               subreddit_to_search: str = None, end_datetime: datetime = None,
+                               cache: CommentCache = None, max_workers: Optional[int] = None,
+                               on_comments: CommentSink = None,
+                               on_classified: ClassificationSink = None) -> SentimentDataDTO:
+    """Sentiment of every ticker in one pass: pages through every comment in the window once, attributes each
+    comment to the tickers it mentions and classifies it once with the shared model, however many tickers it
+    mentions. The model should ignore every ticker symbol (words_to_ignore=ticker_list), so the symbols do not
+    sway the sentiment. Tickers without comments are left out.
+    on_comments receives the comments of every page that mention a ticker, before on_classified receives their
+    classifications, so both can be recorded in a MentionStore."""
+    timer = Timer()
+    timer.start()
+    start_datetime, end_datetime = get_start_and_end_date(end_datetime, days_to_look_back)
+    matcher = TickerMatcher(ticker_list)
+    # Id and tickers of every comment handed to the classifier whose result has not come back yet
+    pending: Deque[Tuple[str, Set[str]]] = deque()
+    fetch_failed = []
+    # Every upvote count is kept, only duplicates and spam are not worth classifying
+    comment_filter = CommentFilter()
+
+    def iter_mentioning_comments() -> Iterator[str]:
+        try:
+            for content in stream_comment_pages(None, utc_timestamp(start_datetime), utc_timestamp(end_datetime),
+                                                subreddit_to_search, cache):
+                comments_by_ticker: Dict[str, List[Dict]] = {}
+                bodies = []
+                for comment in comment_filter.filter(content):
+                    tickers = matcher.find_tickers(comment.get("body"))
+                    if tickers:
+                        pending.append((comment.get("id"), tickers))
+                        bodies.append(comment.get("body") or "")
+                        for ticker in tickers:
+                            comments_by_ticker.setdefault(ticker, []).append(comment)
+                if on_comments:
+                    for ticker, comments in comments_by_ticker.items():
+                        on_comments(ticker, comments)
+                yield from bodies
+        except ApiError:
+            logger.warning(f"Failed to fetch all comments, continuing with {len(pending)} comments.")
+            fetch_failed.append(True)
+
+    positive: Dict[str, int] = {}
+    negative: Dict[str, int] = {}
+    classified = 0
+    for batch in naive_bayes.iter_classify_batches(iter_mentioning_comments(), max_workers):
+        classifications = []
+        for _, classification in batch:
+            comment_id, tickers = pending.popleft()
+            counts = positive if classification == 1 else negative
+            for ticker in tickers:
+                counts[ticker] = counts.get(ticker, 0) + 1
+            classifications.append((comment_id, classification))
+        classified += len(batch)
+        if on_classified:
+            on_classified(classifications)
+    sentiment_data = []
+    for ticker in sorted(positive.keys() | negative.keys()):
+        num_positive, num_negative = positive.get(ticker, 0), negative.get(ticker, 0)
+        sentiment_data.append(TickerSentimentData(ticker=ticker, comment_count=num_positive + num_negative,
+                                                  positive=num_positive, negative=num_negative,
+                                                  positive_ratio=num_positive / (num_positive + num_negative)))
+    sentiment_data.sort(key=lambda data: data.comment_count, reverse=True)
+    if comment_filter.dropped:
+        logger.debug(f"Dropped comments: {comment_filter.dropped}")
+    logger.info(f"Classified {classified} comments mentioning {len(sentiment_data)} tickers "
+                f"in {int(timer.end())} seconds.")
+    return SentimentDataDTO(sentiment_data=sentiment_data, from_date=start_datetime, to_date=end_datetime,
+                            failed_during_fetch=bool(fetch_failed))
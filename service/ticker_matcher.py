@@ -0,0 +1,39 @@
+import re
+from typing import Dict, Iterable, Set
+
+# A candidate symbol: optional cashtag, letters, and an optional one or two letter class suffix (e.g. BRK.B), bounded
+# by non-word chars. Longer words after a dot ("GME.buy") are the next sentence, not a suffix
+_TOKEN_REGEX = re.compile(r'(?<![\w$])(\$?)([A-Za-z]+)(?:\.([A-Za-z]{1,2}))?(?!\w)')
+
+
+class TickerMatcher:
+    """Finds mentions of many tickers in a text with a single regex pass and a set lookup per token.
+    Bare words only match when written in upper case (so "it" or "a" do not count as tickers) unless
+    match_lowercase is set. Cashtags ($tsla, $TSLA) always match regardless of case."""
+
+    def __init__(self, tickers: Iterable[str], match_lowercase: bool = False):
+        self.tickers: Set[str] = {ticker.upper() for ticker in tickers if ticker}
+        self.match_lowercase = match_lowercase
+
+    def find_tickers(self, text: str) -> Set[str]:
+        """Returns every ticker mentioned in the text at least once."""
+        found = set()
+        if not text:
+            return found
+        for cashtag, token, suffix in _TOKEN_REGEX.findall(text):
+            if suffix and f"{token}.{suffix}".upper() in self.tickers:
+                token = f"{token}.{suffix}"
+            symbol = token.upper()
+            if symbol not in self.tickers:
+                continue
+            if cashtag or self.match_lowercase or token == symbol:
+                found.add(symbol)
+        return found
+
+    def count_mentions(self, texts: Iterable[str]) -> Dict[str, int]:
+        """Counts how many texts mention each ticker. A text mentioning a ticker several times counts once."""
+        counts: Dict[str, int] = {}
+        for text in texts:
+            for symbol in self.find_tickers(text):
+                counts[symbol] = counts.get(symbol, 0) + 1
+        return counts
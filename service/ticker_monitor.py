@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+from classifier.naive_bayes import NaiveBayes
+from service.comment_filter import CommentFilter
+from service.http_client import ApiError, AsyncFetcher
+from service.ticker_matcher import TickerMatcher
+from service.ticker_service import iter_comment_pages_async
+
+# Sliding windows kept by the monitor: name -> (window length, bucket length) in seconds
+WINDOWS = {"1h": (60 * 60, 60), "24h": (24 * 60 * 60, 60 * 60), "7d": (7 * 24 * 60 * 60, 60 * 60)}
+_TICK_INTERVAL_SECONDS = 5 * 60
+# Comments show up in the API a while after they were posted, so every tick re-fetches this far behind the cursor.
+# The comments fetched twice are dropped by their id
+_INGEST_LAG_SECONDS = 2 * 60
+_DEFAULT_SNAPSHOT_FILE = "monitor_snapshot.json"
+_DEFAULT_STATE_FILE = "monitor_state.npz"
+# Columns of the per ticker values in every window
+_MENTIONS, _POSITIVE, _NEGATIVE = range(3)
+
+logger = logging.getLogger(__name__)
+
+
+class TickerWindowData(BaseModel):
+    ticker: str
+    mentions: int
+    positive: int
+    negative: int
+    # Share of positive comments, None without a sentiment model
+    positive_ratio: Optional[float] = None
+
+
+class MonitorSnapshot(BaseModel):
+    timestamp: datetime
+    # created_utc of the newest comment seen per subreddit ("" for all subreddits)
+    cursors: Dict[str, int]
+    # Tickers with mentions in each window, most mentioned first
+    windows: Dict[str, List[TickerWindowData]]
+
+
+class RollingWindow:
+    """Per ticker sums over the last window_seconds, kept in a ring of buckets of bucket_seconds each. A bucket is
+    reused once it slides out of the window, so memory stays fixed however long the monitor runs, and reading the
+    totals costs one sum over the ring."""
+
+    def __init__(self, window_seconds: int, bucket_seconds: int, num_tickers: int, num_columns: int = 3):
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = window_seconds // bucket_seconds
+        self.values = np.zeros((self.num_buckets, num_tickers, num_columns), dtype=np.int64)
+        # Bucket number (created_utc // bucket_seconds) held by each slot, -1 for slots never used
+        self.bucket_ids = np.full(self.num_buckets, -1, dtype=np.int64)
+
+    def add(self, timestamps: np.ndarray, ticker_ids: np.ndarray, values: np.ndarray, now: int):
+        """Adds the (n, num_columns) values of n mentions. Mentions outside the window ending at now are dropped."""
+        buckets = timestamps // self.bucket_seconds
+        current = now // self.bucket_seconds
+        in_window = (buckets > current - self.num_buckets) & (buckets <= current)
+        buckets, ticker_ids, values = buckets[in_window], ticker_ids[in_window], values[in_window]
+        slots = buckets % self.num_buckets
+        # Clear the slots whose bucket slid out of the window before reusing them for a newer bucket
+        newest = np.full(self.num_buckets, -1, dtype=np.int64)
+        np.maximum.at(newest, slots, buckets)
+        reused = newest > self.bucket_ids
+        self.values[reused] = 0
+        self.bucket_ids[reused] = newest[reused]
+        # Mentions older than what their slot holds now belong to a bucket that already left the window
+        current_bucket = self.bucket_ids[slots] == buckets
+        np.add.at(self.values, (slots[current_bucket], ticker_ids[current_bucket]), values[current_bucket])
+
+    def totals(self, now: int) -> np.ndarray:
+        """(num_tickers, num_columns) sums over the window ending at now"""
+        current = now // self.bucket_seconds
+        live = (self.bucket_ids > current - self.num_buckets) & (self.bucket_ids <= current)
+        return self.values[live].sum(axis=0)
+
+
+class TickerMonitor:
+    """Long running monitor of ticker mentions and sentiment over the sliding WINDOWS.
+
+    Every tick fetches only the comments posted since the cursor of each subreddit (the first tick backfills the
+    longest window), counts the comments mentioning a ticker into the ring buffers of every window, classifies them
+    with naive_bayes if given, and writes a MonitorSnapshot to snapshot_file. Cursors and windows are saved to
+    state_file after every tick, so a restarted monitor continues where it stopped instead of backfilling again.
+    Fresh comments have hardly been voted on yet, so mentions are not filtered by score."""
+
+    def __init__(self, tickers: Iterable[str], subreddits: Iterable[Optional[str]], naive_bayes: NaiveBayes = None,
+                 snapshot_file: Optional[str] = _DEFAULT_SNAPSHOT_FILE,
+                 state_file: Optional[str] = _DEFAULT_STATE_FILE):
+        self.matcher = TickerMatcher(tickers)
+        self.tickers = sorted(self.matcher.tickers)
+        self.ticker_ids = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.subreddits = [subreddit or "" for subreddit in subreddits]
+        self.naive_bayes = naive_bayes
+        self.snapshot_file = snapshot_file
+        self.state_file = state_file
+        self.windows = {name: RollingWindow(window_seconds, bucket_seconds, len(self.tickers))
+                        for name, (window_seconds, bucket_seconds) in WINDOWS.items()}
+        self.cursors: Dict[str, int] = {}
+        # Created on a subreddit's first fetch, so the ids of the comments fetched twice are known
+        self._comment_filters: Dict[str, CommentFilter] = {}
+        if state_file and os.path.isfile(state_file):
+            self._load_state()
+
+    def run(self, interval_seconds: float = _TICK_INTERVAL_SECONDS, max_ticks: Optional[int] = None,
+            stop: threading.Event = None):
+        """Ticks every interval_seconds until stop is set, max_ticks ticks were made or the process is interrupted"""
+        stop = stop or threading.Event()
+        ticks = 0
+        logger.info(f"Monitoring {len(self.tickers)} tickers in {len(self.subreddits)} subreddits "
+                    f"every {interval_seconds} seconds.")
+        try:
+            while max_ticks is None or ticks < max_ticks:
+                started = time.monotonic()
+                self.tick()
+                ticks += 1
+                if stop.wait(max(0.0, interval_seconds - (time.monotonic() - started))):
+                    break
+        except KeyboardInterrupt:
+            logger.info("Monitor stopped.")
+
+    def tick(self, now: int = None) -> MonitorSnapshot:
+        now = now or int(time.time())
+        asyncio.run(self._fetch_all(now))
+        snapshot = self.snapshot(now)
+        if self.snapshot_file:
+            _write_atomically(self.snapshot_file, snapshot.json(indent=2).encode("utf-8"))
+        if self.state_file:
+            self.save_state()
+        return snapshot
+
+    async def _fetch_all(self, now: int):
+        async with AsyncFetcher() as fetcher:
+            await asyncio.gather(*(self._fetch(fetcher, subreddit, now) for subreddit in self.subreddits))
+
+    async def _fetch(self, fetcher: AsyncFetcher, subreddit: str, now: int):
+        backfill_from = now - max(window_seconds for window_seconds, _ in WINDOWS.values())
+        cursor = self.cursors.get(subreddit, backfill_from)
+        if subreddit in self._comment_filters:
+            after = max(cursor - _INGEST_LAG_SECONDS, backfill_from)
+        else:
+            # Nothing fetched by this process yet: without the ids of the last tick, re-fetching would count twice
+            self._comment_filters[subreddit] = CommentFilter()
+            after = max(cursor, backfill_from)
+        pages = 0
+        try:
+            # A single shard keeps the pages in created_utc order, so a failed fetch never leaves a gap behind the cursor
+            async for content in iter_comment_pages_async(fetcher, None, after, now, subreddit or None, shard_count=1):
+                pages += 1
+                self._add_comments(self._comment_filters[subreddit].filter(content), now)
+                cursor = max(cursor, content[-1].get("created_utc"))
+        except ApiError:
+            logger.warning(f"Failed to fetch all new comments of {subreddit or 'all subreddits'}, "
+                           f"continuing from {datetime.utcfromtimestamp(cursor)} next tick.")
+        self.cursors[subreddit] = cursor
+        logger.debug(f"Fetched {pages} pages of {subreddit or 'all subreddits'}.")
+
+    def _add_comments(self, comments: List[Dict], now: int):
+        mentioning = []
+        for comment in comments:
+            tickers = self.matcher.find_tickers(comment.get("body"))
+            if tickers:
+                mentioning.append((comment, tickers))
+        if not mentioning:
+            return
+        labels = np.full(len(mentioning), -1)
+        if self.naive_bayes:
+            classified = self.naive_bayes.classify_batch([comment.get("body") or "" for comment, _ in mentioning])
+            labels = np.array([classification for _, classification in classified])
+        rows = [(comment.get("created_utc"), self.ticker_ids[ticker], label)
+                for (comment, tickers), label in zip(mentioning, labels.tolist()) for ticker in tickers]
+        timestamps, ticker_ids, row_labels = (np.array(column, dtype=np.int64) for column in zip(*rows))
+        values = np.stack([np.ones_like(row_labels), row_labels == 1, row_labels == 0], axis=1).astype(np.int64)
+        for window in self.windows.values():
+            window.add(timestamps, ticker_ids, values, now)
+
+    def snapshot(self, now: int = None) -> MonitorSnapshot:
+        now = now or int(time.time())
+        windows = {}
+        for name, window in self.windows.items():
+            totals = window.totals(now)
+            data = [TickerWindowData(ticker=self.tickers[i], mentions=mentions, positive=positive, negative=negative,
+                                     positive_ratio=positive / (positive + negative) if positive + negative else None)
+                    for i, (mentions, positive, negative) in enumerate(totals.tolist()) if mentions]
+            data.sort(key=lambda ticker_data: ticker_data.mentions, reverse=True)
+            windows[name] = data
+        return MonitorSnapshot(timestamp=datetime.utcfromtimestamp(now), cursors=dict(self.cursors), windows=windows)
+
+    def save_state(self):
+        arrays = {"tickers": np.array(self.tickers, dtype=str), "subreddits": np.array(list(self.cursors), dtype=str),
+                  "cursors": np.array(list(self.cursors.values()), dtype=np.int64)}
+        for name, window in self.windows.items():
+            arrays[f"{name}_values"] = window.values
+            arrays[f"{name}_bucket_ids"] = window.bucket_ids
+        with open(f"{self.state_file}.tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(f"{self.state_file}.tmp", self.state_file)
+
+    def _load_state(self):
+        with np.load(self.state_file) as state:
+            if state["tickers"].tolist() != self.tickers or any(
+                    state[f"{name}_values"].shape != window.values.shape for name, window in self.windows.items()):
+                logger.warning(f"Ignoring {self.state_file}, it was saved for other tickers or windows.")
+                return
+            self.cursors = dict(zip(state["subreddits"].tolist(), state["cursors"].tolist()))
+            for name, window in self.windows.items():
+                window.values = state[f"{name}_values"]
+                window.bucket_ids = state[f"{name}_bucket_ids"]
+        logger.info(f"Resumed monitor from {self.state_file}.")
+
+
+def _write_atomically(file_name: str, content: bytes):
+    with open(f"{file_name}.tmp", "wb") as f:
+        f.write(content)
+    os.replace(f"{file_name}.tmp", file_name)
@@ -0,0 +1,127 @@
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+from urllib import request
+
+import numpy as np
+from pydantic import BaseModel
+
+_TICKER_FILES = ["ftp://ftp.nasdaqtrader.com/SymbolDirectory/nasdaqlisted.txt",
+                 "ftp://ftp.nasdaqtrader.com/SymbolDirectory/otherlisted.txt"]
+_SNAPSHOT_FILE = "ticker_registry.npz"
+# Exchange code used for symbols from nasdaqlisted.txt, otherlisted.txt carries its own codes (N, A, P, Z, V)
+_NASDAQ_EXCHANGE = "Q"
+# Symbols that are also common words, so matching them in comments mostly finds the word and not the ticker
+_COMMON_WORD_SYMBOLS = {"A", "ALL", "AM", "AN", "ANY", "ARE", "AT", "BE", "BIG", "BY", "CAN", "CEO", "DD", "EDIT",
+                        "EOD", "FOR", "FUN", "GO", "GOOD", "HAS", "HE", "HOLD", "I", "IT", "LOVE", "LOW", "MAN",
+                        "MOON", "NEW", "NOW", "ON", "ONE", "OR", "OUT", "PLAY", "REAL", "RUN", "SEE", "SO", "TWO",
+                        "UP", "USA", "WELL", "YOLO"}
+
+logger = logging.getLogger(__name__)
+
+
+class TickerInfo(BaseModel):
+    symbol: str
+    security_name: str
+    exchange: str
+    etf: bool
+    test_issue: bool
+
+
+class TickerRegistry:
+    """Every symbol listed in the NASDAQ symbol directory files, parsed once into columnar arrays.
+
+    Symbols are sorted and indexed, so looking up a symbol is a dict access and filtering the whole universe is a
+    handful of vectorized numpy operations. Use load() to build the registry: it keeps a binary snapshot next to
+    the source files and only re-parses them when their modification times change."""
+
+    def __init__(self, symbols: np.ndarray, security_names: np.ndarray, exchanges: np.ndarray, etf: np.ndarray,
+                 test_issue: np.ndarray):
+        self.symbols = symbols
+        self.security_names = security_names
+        self.exchanges = exchanges
+        self.etf = etf
+        self.test_issue = test_issue
+        self.index: Dict[str, int] = {symbol: i for i, symbol in enumerate(symbols.tolist())}
+        # Precomputed so filter() only combines boolean masks
+        self.symbol_lengths = np.char.str_len(symbols)
+        self.common_word = np.isin(symbols, list(_COMMON_WORD_SYMBOLS))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol: str):
+        return symbol in self.index
+
+    def get(self, symbol: str) -> Optional[TickerInfo]:
+        i = self.index.get(symbol)
+        if i is None:
+            return None
+        return TickerInfo(symbol=str(self.symbols[i]), security_name=str(self.security_names[i]),
+                          exchange=str(self.exchanges[i]), etf=bool(self.etf[i]), test_issue=bool(self.test_issue[i]))
+
+    def filter(self, exclude_test_issues: bool = True, etf: Optional[bool] = None,
+               exchanges: Iterable[str] = None, min_length: int = 1, exclude_common_words: bool = False) -> List[str]:
+        """Returns the matching symbols in sorted order.
+        etf=True keeps only ETFs, etf=False drops them, None keeps both.
+        min_length=2 drops single-letter symbols, exclude_common_words drops symbols such as IT or ON."""
+        mask = np.ones(len(self.symbols), dtype=bool)
+        if exclude_test_issues:
+            mask &= ~self.test_issue
+        if etf is not None:
+            mask &= self.etf == etf
+        if exchanges is not None:
+            mask &= np.isin(self.exchanges, list(exchanges))
+        if min_length > 1:
+            mask &= self.symbol_lengths >= min_length
+        if exclude_common_words:
+            mask &= ~self.common_word
+        return self.symbols[mask].tolist()
+
+    @classmethod
+    def load(cls, directory: str = "", snapshot_file: str = _SNAPSHOT_FILE) -> "TickerRegistry":
+        """Downloads missing symbol files into directory, then reads the snapshot if it is up to date or parses the
+        files and writes a new snapshot otherwise."""
+        file_names = [os.path.join(directory, os.path.basename(url)) for url in _TICKER_FILES]
+        for url, file_name in zip(_TICKER_FILES, file_names):
+            # Skip downloading NASDAQ ticker files if they have been downloaded previously
+            if not os.path.isfile(file_name):
+                logger.info(f"Fetching {file_name} from source.")
+                request.urlretrieve(url, file_name)
+        mtimes = np.array([os.path.getmtime(file_name) for file_name in file_names])
+        snapshot_file = os.path.join(directory, snapshot_file)
+        if os.path.isfile(snapshot_file):
+            with np.load(snapshot_file) as snapshot:
+                if np.array_equal(snapshot["mtimes"], mtimes):
+                    logger.debug(f"Loaded tickers from snapshot {snapshot_file}.")
+                    return cls(snapshot["symbols"], snapshot["security_names"], snapshot["exchanges"],
+                               snapshot["etf"], snapshot["test_issue"])
+        registry = cls.parse(*file_names)
+        np.savez(snapshot_file, mtimes=mtimes, symbols=registry.symbols, security_names=registry.security_names,
+                 exchanges=registry.exchanges, etf=registry.etf, test_issue=registry.test_issue)
+        logger.info(f"Sourced {len(registry)} tickers, saved snapshot to {snapshot_file}.")
+        return registry
+
+    @classmethod
+    def parse(cls, nasdaq_listed_file: str, other_listed_file: str) -> "TickerRegistry":
+        # symbol -> (security name, exchange, etf, test issue), first listing wins
+        rows: Dict[str, tuple] = {}
+        for file_name, exchange_column, etf_column, test_issue_column in (
+                (nasdaq_listed_file, None, 6, 3), (other_listed_file, 2, 4, 6)):
+            with open(file_name, "r") as f:
+                # Ignore first row (only contains metadata)
+                next(f, None)
+                for line in f:
+                    columns = line.rstrip("\n").split("|")
+                    # The last row holds the file creation time instead of a symbol
+                    if len(columns) <= test_issue_column or line.startswith("File Creation Time"):
+                        continue
+                    exchange = columns[exchange_column] if exchange_column is not None else _NASDAQ_EXCHANGE
+                    rows.setdefault(columns[0], (columns[1].strip(), exchange, columns[etf_column] == "Y",
+                                                 columns[test_issue_column] == "Y"))
+        symbols = sorted(rows)
+        return cls(np.array(symbols, dtype=str),
+                   np.array([rows[symbol][0] for symbol in symbols], dtype=str),
+                   np.array([rows[symbol][1] for symbol in symbols], dtype=str),
+                   np.array([rows[symbol][2] for symbol in symbols], dtype=bool),
+                   np.array([rows[symbol][3] for symbol in symbols], dtype=bool))
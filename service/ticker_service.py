@@ -1,33 +1,50 @@
+import asyncio
 import json
 import logging
 import os
-from concurrent import futures
+import queue
+import threading
 from datetime import datetime, timedelta
 from time import sleep
-from typing import Dict, List, Optional
-from urllib import request
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
 
 import requests
 from pydantic import BaseModel
 
+from service.comment_cache import CommentCache
+from service.comment_filter import CommentFilter
+from service.http_client import (API_RETRY_ATTEMPTS, ApiError, AsyncFetcher, backoff_delay, parse_retry_after,
+                                 record_request, record_retry)
+from service.run_journal import RunJournal
+from service.ticker_matcher import TickerMatcher
+from service.ticker_registry import TickerRegistry
+from util.dates import utc_timestamp
+from util.metrics import COUNT_BUCKETS, REGISTRY
 from util.timer import Timer
 
 _PUSHSHIFT_COMMENT_API = "https://api.pushshift.io/reddit/search/comment/"
-_TICKER_FILES = ["ftp://ftp.nasdaqtrader.com/SymbolDirectory/nasdaqlisted.txt",
-                 "ftp://ftp.nasdaqtrader.com/SymbolDirectory/otherlisted.txt"]
-# Number of times to retry calling the API if call fails
-_API_RETRY_ATTEMPTS = 10
 # How many upvotes the comment should have to be included in search
 _UPVOTE_THRESHOLD = 2
 # 100 is upper limit of search results. Do not increase above 100
 _API_SEARCH_RESULT_SIZE = 100
-
-# Two workers seems to be the max before we get a 409 response from api
-_THREAD_COUNT = 2
-_SECONDS_TO_SLEEP_BEFORE_NEW_REQUEST = 3
+# Number of sub-windows a search window is split into and fetched concurrently
+_SHARD_COUNT = 4
+# Shards are only subdivided further while they span more than twice this many seconds
+_MIN_SHARD_SECONDS = 15 * 60
+# Number of times a shard is resumed from its last cursor after the API failed too many times in a row
+_SHARD_RETRY_ATTEMPTS = 3
+# Pages fetched ahead of a synchronous consumer of stream_comment_pages before fetching pauses
+_STREAM_BUFFER_PAGES = 8
+# How often a paused fetch checks whether the consumer stopped
+_STREAM_POLL_SECONDS = 0.1
+# How long a consumer that stops early waits for the cancelled fetch to wind down, the thread is a daemon
+_STREAM_JOIN_SECONDS = 5
 
 logger = logging.getLogger(__name__)
 
+# Called with (ticker, comments) for the upvoted comments counted towards a ticker, e.g. MentionStore.add_comments
+CommentSink = Callable[[str, List[Dict]], None]
+
 
 class AggregateTickerData(BaseModel):
     ticker: str
@@ -42,70 +59,381 @@ class TickerDataDTO(BaseModel):
 
 
 def aggregate_ticker_comment_count(ticker_list: List[str], days_to_look_back: int = 1, subreddit_to_search: str = None,
-                                   end_datetime: datetime = datetime.utcnow()) -> TickerDataDTO:
+                                   end_datetime: datetime = None,
+                                   single_pass: bool = False, cache: CommentCache = None,
+                                   on_comments: CommentSink = None, journal: RunJournal = None) -> TickerDataDTO:
+    """single_pass pages through every comment in the window once and matches all tickers locally,
+    instead of running one search query per ticker. Best suited to large ticker lists on a single subreddit.
+    on_comments receives every counted comment, e.g. to record the crawl in a MentionStore.
+    With a journal, progress is checkpointed and calling again with the same parameters only counts the tickers
+    (or, in single_pass mode, the part of the window) that were not finished, including those that failed."""
+    if single_pass:
+        return scan_ticker_comment_count(ticker_list, days_to_look_back, subreddit_to_search, end_datetime, cache,
+                                         on_comments, journal)
     timer = Timer()
     timer.start()
     start_datetime, end_datetime = get_start_and_end_date(end_datetime, days_to_look_back)
-    aggregate_data_list: List[AggregateTickerData] = []
     if subreddit_to_search:
         logger.info(f"Searching in subreddit: {subreddit_to_search}")
     else:
         logger.info("Searching in all subreddits")
-    with futures.ThreadPoolExecutor(max_workers=_THREAD_COUNT) as executor:
-        future_list = []
-        completed = 0
-        for ticker in ticker_list:
-            future_list.append(
-                executor.submit(count_ticker_comments, ticker, start_datetime, end_datetime, subreddit_to_search))
-        for future in futures.as_completed(future_list):
-            completed += 1
-            aggregate_data = future.result()
-            if aggregate_data.count:
-                aggregate_data_list.append(aggregate_data)
-            if completed % 10 == 0:
-                logger.info(f"Analyzed {completed} tickers. Elapsed time: {int(timer.get_elapsed_time())} seconds")
-            logger.debug(
-                f"Found {aggregate_data.count} mentions of {aggregate_data.ticker} with at least {_UPVOTE_THRESHOLD} upvotes from {start_datetime} to {end_datetime}.")
+    run = journal.resume(utc_timestamp(start_datetime), utc_timestamp(end_datetime), subreddit_to_search) \
+        if journal else None
+    finished = run.finished_tickers() if run else {}
+    remaining_tickers = [ticker for ticker in ticker_list if ticker not in finished]
+    if finished:
+        logger.info(f"Resuming run: {len(ticker_list) - len(remaining_tickers)} tickers were already counted, "
+                    f"{len(remaining_tickers)} remaining.")
+    failed_tickers = []
+
+    def on_counted(data: AggregateTickerData):
+        if data.failed_during_fetch:
+            failed_tickers.append(data.ticker)
+        if run:
+            run.record_ticker(data.ticker, data.count, data.failed_during_fetch)
+
+    try:
+        aggregate_data_list = asyncio.run(
+            count_all_ticker_comments_async(remaining_tickers, start_datetime, end_datetime, subreddit_to_search,
+                                            cache, timer, on_comments, on_counted=on_counted))
+    finally:
+        if run:
+            run.flush()
+    if run:
+        run.finish(failed=bool(failed_tickers))
+    aggregate_data_list.extend(AggregateTickerData(ticker=ticker, count=finished[ticker])
+                               for ticker in ticker_list if finished.get(ticker))
     sort_aggregate_data_by_count(aggregate_data_list)
     logger.info(aggregate_data_list)
-    logger.info(f"Analyzed {len(ticker_list)} tickers in {int(timer.end())} seconds.")
+    logger.info(f"Analyzed {len(remaining_tickers)} tickers in {int(timer.end())} seconds.")
     return TickerDataDTO(aggregate_data=aggregate_data_list, from_date=start_datetime, to_date=end_datetime)
 
 
-def filter_comments_by_upvotes(comment_list: List[Dict]) -> int:
-    upvoted_comments = 0
-    for comment in comment_list:
-        if comment.get("score") >= _UPVOTE_THRESHOLD:
-            upvoted_comments += 1
-    return upvoted_comments
+async def count_all_ticker_comments_async(ticker_list: List[str], from_date: datetime, to_date: datetime,
+                                          subreddit_to_search: Optional[str], cache: CommentCache = None,
+                                          timer: Timer = None, on_comments: CommentSink = None,
+                                          fetcher: AsyncFetcher = None,
+                                          on_counted: Callable[[AggregateTickerData], None] = None
+                                          ) -> List[AggregateTickerData]:
+    """Counts the comments of every ticker concurrently. The number of requests in flight and the request rate are
+    bounded by one shared AsyncFetcher, a default one unless an entered fetcher is passed in.
+    on_counted receives the result of every ticker as soon as it is known. Tickers without mentions are left out
+    of the returned list."""
+    if fetcher is None:
+        async with AsyncFetcher() as fetcher:
+            return await count_all_ticker_comments_async(ticker_list, from_date, to_date, subreddit_to_search, cache,
+                                                         timer, on_comments, fetcher, on_counted)
+    aggregate_data_list: List[AggregateTickerData] = []
+    completed = 0
+    for future in asyncio.as_completed(
+            [count_ticker_comments_async(fetcher, ticker, from_date, to_date, subreddit_to_search, cache,
+                                         on_comments) for ticker in ticker_list]):
+        completed += 1
+        aggregate_data = await future
+        if on_counted:
+            on_counted(aggregate_data)
+        if aggregate_data.count:
+            aggregate_data_list.append(aggregate_data)
+        if timer and completed % 10 == 0:
+            logger.info(f"Analyzed {completed} tickers. Elapsed time: {int(timer.get_elapsed_time())} seconds")
+        logger.debug(
+            f"Found {aggregate_data.count} mentions of {aggregate_data.ticker} with at least {_UPVOTE_THRESHOLD} upvotes from {from_date} to {to_date}.")
+    return aggregate_data_list
+
+
+async def count_ticker_comments_async(fetcher: AsyncFetcher, ticker: str, from_date: datetime, to_date: datetime,
+                                      subreddit_to_search: Optional[str], cache: CommentCache = None,
+                                      on_comments: CommentSink = None) -> AggregateTickerData:
+    aggregate_data = AggregateTickerData(ticker=ticker, count=0)
+    # A page restarting at the created_utc of the previous page's last comment can repeat the comments of that
+    # second, the filter counts every comment id once
+    comment_filter = CommentFilter(min_score=_UPVOTE_THRESHOLD)
+    pages = 0
+    try:
+        async for content in iter_comment_pages_async(fetcher, ticker, utc_timestamp(from_date),
+                                                      utc_timestamp(to_date), subreddit_to_search, cache):
+            pages += 1
+            comments = comment_filter.filter(content)
+            aggregate_data.count += len(comments)
+            if on_comments:
+                on_comments(ticker, comments)
+    except ShardFetchError as e:
+        logger.warning(f"Count of {ticker} is missing windows {e.failed_windows}.")
+        aggregate_data.failed_during_fetch = True
+    except ApiError:
+        aggregate_data.failed_during_fetch = True
+    record_ticker_pages(pages, aggregate_data.failed_during_fetch)
+    log_dropped_comments(ticker, comment_filter)
+    return aggregate_data
+
+
+async def iter_comment_pages_async(fetcher: AsyncFetcher, query: Optional[str], from_timestamp: int,
+                                   to_timestamp: int, subreddit_to_search: Optional[str],
+                                   cache: CommentCache = None,
+                                   shard_count: int = _SHARD_COUNT) -> AsyncIterator[List[Dict]]:
+    """Async version of iter_comment_pages that splits the window into shard_count sub-windows and fetches them
+    concurrently. Shards do not overlap, but pages are yielded as they arrive, so they are not in created_utc
+    order, and comments sharing a created_utc may repeat where a page restarts. With shard_count=1 the window is
+    fetched sequentially and pages are in created_utc order. Raises ShardFetchError listing the failed
+    sub-windows once every other shard has finished."""
+
+    async def fetch_pages(after: int, before: int) -> AsyncIterator[List[Dict]]:
+        pages = asyncio.Queue()
+        failed_windows: List[Tuple[int, int]] = []
+
+        async def fetch_shard(shard_after: int, shard_before: int):
+            failed_attempts = 0
+            while True:
+                try:
+                    content = await fetcher.get_comments(
+                        create_api_call(query, shard_after, shard_before, subreddit_to_search))
+                except ApiError:
+                    failed_attempts += 1
+                    if failed_attempts > _SHARD_RETRY_ATTEMPTS:
+                        failed_windows.append((shard_after, shard_before))
+                        return
+                    logger.debug(f"Resuming shard ({shard_after}, {shard_before}) of {query}.")
+                    continue
+                if content:
+                    await pages.put(content)
+                if len(content) < _API_SEARCH_RESULT_SIZE:
+                    return
+                shard_after = content[-1].get("created_utc")
+                # A full page means the shard is dense, so fetch the rest of it as two concurrent halves
+                if shard_count > 1 and shard_before - shard_after > 2 * _MIN_SHARD_SECONDS:
+                    middle = (shard_after + shard_before) // 2
+                    await asyncio.gather(fetch_shard(shard_after, middle + 1), fetch_shard(middle, shard_before))
+                    return
+
+        async def fetch_all_shards():
+            try:
+                await asyncio.gather(*[fetch_shard(shard_after, shard_before)
+                                       for shard_after, shard_before in split_window(after, before, shard_count)])
+            finally:
+                await pages.put(None)
+
+        task = asyncio.create_task(fetch_all_shards())
+        try:
+            while True:
+                content = await pages.get()
+                if content is None:
+                    break
+                yield content
+            await task
+        finally:
+            task.cancel()
+        if failed_windows:
+            raise ShardFetchError(f"Failed to fetch {query} in windows {failed_windows}.", failed_windows)
+
+    pages = cache.iter_pages_async(fetch_pages, query, subreddit_to_search, from_timestamp, to_timestamp) \
+        if cache else fetch_pages(from_timestamp, to_timestamp)
+    async for page in pages:
+        yield page
+
+
+def stream_comment_pages(query: Optional[str], from_timestamp: int, to_timestamp: int,
+                         subreddit_to_search: Optional[str], cache: CommentCache = None) -> Iterator[List[Dict]]:
+    """Synchronous iterator over iter_comment_pages_async for consumers that are not async, such as the
+    classification pipelines. An event loop in a background thread fetches the shards through an AsyncFetcher, so
+    requests are rate limited and retried like those of every other crawl. At most _STREAM_BUFFER_PAGES pages are
+    fetched ahead of the consumer, fetching pauses while it is busy.
+    Pages are not in created_utc order. Raises the error that ended the fetch after yielding the pages before it."""
+    pages: queue.Queue = queue.Queue(maxsize=_STREAM_BUFFER_PAGES)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        """Waits until there is room for item, returns False if the consumer stopped in the meantime"""
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=_STREAM_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def fetch():
+        loop = asyncio.get_running_loop()
+        async with AsyncFetcher() as fetcher:
+            async for content in iter_comment_pages_async(fetcher, query, from_timestamp, to_timestamp,
+                                                          subreddit_to_search, cache):
+                # Wait for room in a worker thread, so the shards in flight keep being received meanwhile
+                if not await loop.run_in_executor(None, put, content):
+                    return
+
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(fetch())
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            # The consumer stopped, nobody reads the queue anymore
+            pass
+        except Exception as e:
+            put(e)
+        else:
+            put(None)
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    thread = threading.Thread(target=run, name=f"fetch-{query or 'all'}", daemon=True)
+    thread.start()
+    try:
+        while True:
+            content = pages.get()
+            if content is None:
+                return
+            if isinstance(content, Exception):
+                raise content
+            yield content
+    finally:
+        stopped.set()
+        try:
+            # Cancelling ends the requests in flight instead of waiting for them and their retries
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            # The loop is already closed, the fetch ended by itself
+            pass
+        thread.join(_STREAM_JOIN_SECONDS)
+
+
+def split_window(after: int, before: int, shard_count: int) -> List[Tuple[int, int]]:
+    """Splits the exclusive (after, before) window into at most shard_count adjacent, non-overlapping windows"""
+    first_utc, last_utc = after + 1, before - 1
+    shard_count = max(1, min(shard_count, last_utc - first_utc + 1))
+    boundaries = [first_utc + (last_utc - first_utc + 1) * i // shard_count for i in range(shard_count + 1)]
+    return [(boundaries[i] - 1, boundaries[i + 1]) for i in range(shard_count)]
+
+
+def scan_ticker_comment_count(ticker_list: List[str], days_to_look_back: int = 1, subreddit_to_search: str = None,
+                              end_datetime: datetime = None, cache: CommentCache = None,
+                              on_comments: CommentSink = None, journal: RunJournal = None) -> TickerDataDTO:
+    timer = Timer()
+    timer.start()
+    start_datetime, end_datetime = get_start_and_end_date(end_datetime, days_to_look_back)
+    from_timestamp = utc_timestamp(start_datetime)
+    to_timestamp = utc_timestamp(end_datetime)
+    matcher = TickerMatcher(ticker_list)
+    run = journal.resume(from_timestamp, to_timestamp, subreddit_to_search, single_pass=True,
+                         tickers=matcher.tickers) if journal else None
+    cursor, counts, complete = run.scan_state() if run else (None, {}, False)
+    if cursor is not None:
+        logger.info(f"Resuming scan after {datetime.utcfromtimestamp(cursor)}, {sum(counts.values())} mentions "
+                    f"were already counted.")
+    failed_during_fetch = False
+    pages = 0
+    comment_filter = CommentFilter(min_score=_UPVOTE_THRESHOLD)
+    logger.info(f"Scanning {'subreddit: ' + subreddit_to_search if subreddit_to_search else 'all subreddits'} "
+                f"for {len(matcher.tickers)} tickers in a single pass")
+
+    async def scan():
+        nonlocal pages
+        async with AsyncFetcher() as fetcher:
+            # A single shard fetches the window sequentially, so pages arrive in created_utc order and the journal's
+            # cursor marks everything before it as counted
+            async for content in iter_comment_pages_async(fetcher, None, cursor or from_timestamp, to_timestamp,
+                                                          subreddit_to_search, cache, shard_count=1):
+                pages += 1
+                comments_by_ticker: Dict[str, List[Dict]] = {}
+                for comment in comment_filter.filter(content):
+                    for ticker in matcher.find_tickers(comment.get("body")):
+                        comments_by_ticker.setdefault(ticker, []).append(comment)
+                for ticker, comments in comments_by_ticker.items():
+                    counts[ticker] = counts.get(ticker, 0) + len(comments)
+                    if on_comments:
+                        on_comments(ticker, comments)
+                if run:
+                    run.record_scan_page(content[-1].get("created_utc"), counts)
+                if pages % 100 == 0:
+                    logger.info(f"Scanned {pages} pages. Elapsed time: {int(timer.get_elapsed_time())} seconds")
+
+    try:
+        if not complete:
+            asyncio.run(scan())
+            if run:
+                run.record_scan_page(to_timestamp, counts, complete=True)
+    except ApiError:
+        logger.warning(f"Failed to fetch all comments of {subreddit_to_search or 'all subreddits'}, counts only "
+                       f"cover the {pages} pages scanned.")
+        failed_during_fetch = True
+    finally:
+        if run:
+            run.flush()
+    if run:
+        run.finish(failed=failed_during_fetch)
+    aggregate_data_list = [AggregateTickerData(ticker=ticker, count=count, failed_during_fetch=failed_during_fetch)
+                           for ticker, count in counts.items()]
+    sort_aggregate_data_by_count(aggregate_data_list)
+    logger.info(aggregate_data_list)
+    log_dropped_comments(subreddit_to_search or "all subreddits", comment_filter)
+    logger.info(f"Scanned {pages} pages for {len(ticker_list)} tickers in {int(timer.end())} seconds.")
+    return TickerDataDTO(aggregate_data=aggregate_data_list, from_date=start_datetime, to_date=end_datetime)
 
 
 def count_ticker_comments(ticker: str, from_date: datetime, to_date: datetime,
-                          subreddit_to_search: Optional[str]) -> AggregateTickerData:
+                          subreddit_to_search: Optional[str], cache: CommentCache = None) -> AggregateTickerData:
     # Turn datetime into unix timestamp with no milliseconds
-    from_timestamp = int(from_date.timestamp())
-    to_timestamp = int(to_date.timestamp())
+    from_timestamp = utc_timestamp(from_date)
+    to_timestamp = utc_timestamp(to_date)
     aggregate_data = AggregateTickerData(ticker=ticker, count=0)
+    comment_filter = CommentFilter(min_score=_UPVOTE_THRESHOLD)
+    pages = 0
     with requests.Session() as session:
+        try:
+            for content in iter_comment_pages(session, ticker, from_timestamp, to_timestamp, subreddit_to_search,
+                                              cache):
+                pages += 1
+                aggregate_data.count += len(comment_filter.filter(content))
+        except ApiError:
+            aggregate_data.failed_during_fetch = True
+    record_ticker_pages(pages, aggregate_data.failed_during_fetch)
+    log_dropped_comments(ticker, comment_filter)
+    return aggregate_data
+
+
+def log_dropped_comments(query: str, comment_filter: CommentFilter):
+    if comment_filter.dropped:
+        logger.debug(f"Dropped comments of {query}: {comment_filter.dropped}")
+
+
+def record_ticker_pages(pages: int, failed_during_fetch: bool):
+    """Records how many pages (pagination depth) it took to count one ticker"""
+    REGISTRY.histogram("ticker_pages", "Pages fetched to count one ticker", COUNT_BUCKETS).observe(pages)
+    REGISTRY.counter("tickers_counted_total", "Tickers counted, by whether fetching failed",
+                     failed=str(failed_during_fetch).lower()).inc()
+
+
+def iter_comment_pages(session: requests.Session, query: Optional[str], from_timestamp: int, to_timestamp: int,
+                       subreddit_to_search: Optional[str], cache: CommentCache = None) -> Iterator[List[Dict]]:
+    """Yields pages of comments in ascending created_utc order. Raises ApiError if a page cannot be fetched.
+    With a cache, only the parts of the window that are not cached yet are requested from the API."""
+
+    def fetch_pages(after: int, before: int) -> Iterator[List[Dict]]:
         while True:
-            try:
-                api_call = create_api_call(aggregate_data.ticker, from_timestamp, to_timestamp, subreddit_to_search)
-                content = get_comments_from_api(session, api_call)
-            except ApiError:
-                aggregate_data.failed_during_fetch = True
-                break
+            api_call = create_api_call(query, after, before, subreddit_to_search)
+            content = get_comments_from_api(session, api_call)
+            if content:
+                yield content
             if len(content) < _API_SEARCH_RESULT_SIZE:
                 break
-            else:
-                from_timestamp = content[_API_SEARCH_RESULT_SIZE - 1].get("created_utc")
-            aggregate_data.count += filter_comments_by_upvotes(content)
-    return aggregate_data
+            after = content[-1].get("created_utc")
+
+    if cache:
+        yield from cache.iter_pages(fetch_pages, query, subreddit_to_search, from_timestamp, to_timestamp)
+    else:
+        yield from fetch_pages(from_timestamp, to_timestamp)
 
 
-def create_api_call(ticker: str, from_timestamp: int, to_timestamp: int, subreddit_to_search: Optional[str]) -> str:
+def create_api_call(ticker: Optional[str], from_timestamp: int, to_timestamp: int,
+                    subreddit_to_search: Optional[str]) -> str:
+    """Passing no ticker fetches every comment in the window"""
     logger.debug(
-        f"Fetching {ticker} data from date: {datetime.fromtimestamp(from_timestamp)} to date: {datetime.fromtimestamp(to_timestamp)}")
-    search_params = f"?q={ticker}&sort=asc&sort_type=created_utc&after={from_timestamp}&before={to_timestamp}&size={_API_SEARCH_RESULT_SIZE}"
+        f"Fetching {ticker or 'all'} data from date: {datetime.utcfromtimestamp(from_timestamp)} to date: {datetime.utcfromtimestamp(to_timestamp)}")
+    search_params = f"?sort=asc&sort_type=created_utc&after={from_timestamp}&before={to_timestamp}&size={_API_SEARCH_RESULT_SIZE}"
+    if ticker:
+        search_params += f"&q={ticker}"
     if subreddit_to_search:
         search_params += f"&subreddit={subreddit_to_search}"
     return os.path.join(_PUSHSHIFT_COMMENT_API, search_params)
@@ -113,16 +441,19 @@ def create_api_call(ticker: str, from_timestamp: int, to_timestamp: int, subredd
 
 def get_comments_from_api(session: requests.Session, api_call: str) -> List[Dict]:
     content: List[Dict] = []
-    for retry_attempt in range(_API_RETRY_ATTEMPTS):
+    for retry_attempt in range(API_RETRY_ATTEMPTS):
         resp = session.get(api_call)
+        record_request(resp.status_code, resp.elapsed.total_seconds(), len(resp.content))
         # Ensure we retry calling api when response is an error code
         if resp.status_code != 200:
+            # Back off exponentially (or as long as the API asks us to) to reduce requests on API
+            delay = backoff_delay(retry_attempt, parse_retry_after(resp.headers.get("Retry-After")))
+            record_retry(resp.status_code, delay)
             logger.debug(f"Error occurred during call to: {api_call}.\n"
                          f"Status code: {resp.status_code}\n"
-                         f"Sleeping for {_SECONDS_TO_SLEEP_BEFORE_NEW_REQUEST + retry_attempt} seconds.")
-            # We sleep for longer as number of retries increases to reduce requests on API
-            sleep(_SECONDS_TO_SLEEP_BEFORE_NEW_REQUEST + retry_attempt)
-            if retry_attempt is _API_RETRY_ATTEMPTS - 1:
+                         f"Sleeping for {delay:.2f} seconds.")
+            sleep(delay)
+            if retry_attempt == API_RETRY_ATTEMPTS - 1:
                 raise ApiError(f"{api_call} failed too many times in a row.")
         else:
             try:
@@ -138,23 +469,8 @@ def get_comments_from_api(session: requests.Session, api_call: str) -> List[Dict
 
 
 def get_list_of_tickers() -> List[str]:
-    ticker_list = []
-    for url in _TICKER_FILES:
-        filename = os.path.basename(url)
-        # Skip downloading NASDAQ ticker files if they have been downloaded previously
-        if os.path.isfile(filename):
-            logger.info(f"{filename} already exists. Skip fetching tickers.")
-        else:
-            logger.info(f"Fetching {filename} from source.")
-            request.urlretrieve(url, filename)
-        with open(filename, "r") as f:
-            for j, line in enumerate(f):
-                # Ignore first row (only contains metadata)
-                if j != 0:
-                    ticker = line.split("|")[0]
-                    # Remove duplicate ticker(s) (if any)
-                    if ticker not in ticker_list:
-                        ticker_list.append(ticker)
+    """Every symbol except test issues. Use TickerRegistry directly for finer filtering."""
+    ticker_list = TickerRegistry.load().filter()
     logger.info(f"Sourced {len(ticker_list)} tickers")
     return ticker_list
 
@@ -164,41 +480,76 @@ def sort_aggregate_data_by_count(data: List[AggregateTickerData]):
 
 
 def get_ticker_comments(ticker: str, days_to_look_back: int = 1, subreddit_to_search: str = None,
-                        end_datetime: datetime = datetime.utcnow()) -> List[str]:
+                        end_datetime: datetime = None, cache: CommentCache = None) -> List[str]:
     timer = Timer()
     timer.start()
     start_datetime, end_datetime = get_start_and_end_date(end_datetime, days_to_look_back)
-    from_timestamp = int(start_datetime.timestamp())
-    to_timestamp = int(end_datetime.timestamp())
-    comments = []
-    with requests.Session() as session:
-        while True:
-            try:
-                api_call = create_api_call(ticker, from_timestamp, to_timestamp, subreddit_to_search)
-                content = get_comments_from_api(session, api_call)
-            except ApiError:
-                break
-            if len(content) < _API_SEARCH_RESULT_SIZE:
-                break
-            else:
-                from_timestamp = content[_API_SEARCH_RESULT_SIZE - 1].get("created_utc")
-        comments.extend(get_comments_from_content(content))
+    from_timestamp = utc_timestamp(start_datetime)
+    to_timestamp = utc_timestamp(end_datetime)
+    comments = asyncio.run(
+        get_ticker_comments_async(ticker, from_timestamp, to_timestamp, subreddit_to_search, cache))
     logger.debug(
         f"Found {len(comments)} comments of {ticker} with at least {_UPVOTE_THRESHOLD} upvotes from {start_datetime} to {end_datetime}.")
     logger.info(f"Analyzed {len(comments)} comments from ticker: {ticker} in {int(timer.end())} seconds")
     return comments
 
 
+def iter_ticker_comments(ticker: str, days_to_look_back: int = 1, subreddit_to_search: str = None,
+                         end_datetime: datetime = None, cache: CommentCache = None) -> Iterator[Dict]:
+    """Yields comment records one page at a time as they are fetched, so a window never sits in memory as a whole.
+    The shards of the window are fetched concurrently (see stream_comment_pages), so pages are not in created_utc
+    order. Duplicates, spam and comments with fewer than _UPVOTE_THRESHOLD upvotes are filtered out, see
+    CommentFilter. Stops early (after logging a warning) if a page cannot be fetched."""
+    start_datetime, end_datetime = get_start_and_end_date(end_datetime, days_to_look_back)
+    comment_filter = CommentFilter(min_score=_UPVOTE_THRESHOLD)
+    comment_count = 0
+    try:
+        for content in stream_comment_pages(ticker, utc_timestamp(start_datetime), utc_timestamp(end_datetime),
+                                            subreddit_to_search, cache):
+            comments = comment_filter.filter(content)
+            comment_count += len(comments)
+            yield from comments
+    except ApiError:
+        logger.warning(f"Failed to fetch all comments of {ticker}, stopping after {comment_count} comments.")
+    log_dropped_comments(ticker, comment_filter)
+    logger.info(f"Streamed {comment_count} comments from ticker: {ticker}")
+
+
+async def get_ticker_comments_async(ticker: str, from_timestamp: int, to_timestamp: int,
+                                    subreddit_to_search: Optional[str], cache: CommentCache = None) -> List[str]:
+    comments: Dict[str, Dict] = {}
+    async with AsyncFetcher() as fetcher:
+        try:
+            async for content in iter_comment_pages_async(fetcher, ticker, from_timestamp, to_timestamp,
+                                                          subreddit_to_search, cache):
+                comments.update((comment.get("id"), comment) for comment in content)
+        except ApiError:
+            logger.warning(f"Failed to fetch all comments of {ticker}, continuing with {len(comments)} comments.")
+    # Shards arrive out of order, restore chronological order before filtering, so the earliest copy of a
+    # near-duplicate body is the one kept
+    comment_filter = CommentFilter(min_score=_UPVOTE_THRESHOLD)
+    content = comment_filter.filter(sorted(comments.values(), key=lambda comment: comment.get("created_utc")))
+    log_dropped_comments(ticker, comment_filter)
+    return get_comments_from_content(content)
+
+
 def get_comments_from_content(content: List[Dict]):
     return [comment.get("body") for comment in content]
 
 
-def get_start_and_end_date(end_datetime: datetime, days_to_look_back: int):
-    end_datetime = end_datetime.replace(hour=23, minute=59, second=59, microsecond=999999)
+def get_start_and_end_date(end_datetime: Optional[datetime], days_to_look_back: int):
+    """end_datetime defaults to now. It is read per call, a default argument would be evaluated only once at import
+    time and leave a long running process querying a stale window."""
+    end_datetime = (end_datetime or datetime.utcnow()).replace(hour=23, minute=59, second=59, microsecond=999999)
     start_datetime = (end_datetime - timedelta(days=days_to_look_back))
     logger.info(f"Start date is: {start_datetime}, end date is: {end_datetime}")
     return start_datetime, end_datetime
 
 
-class ApiError(Exception):
-    pass
+class ShardFetchError(ApiError):
+    """Raised when some shards of a window could not be fetched. The comments of every other shard were
+    still delivered."""
+
+    def __init__(self, message: str, failed_windows: List[Tuple[int, int]]):
+        super().__init__(message)
+        self.failed_windows = failed_windows
@@ -0,0 +1,53 @@
+import requests
+
+from benchmarks import run
+from benchmarks.corpus import generate_comments, generate_pushshift_comments, generate_training_data
+from benchmarks.fake_pushshift import FakePushshift
+
+
+def test_corpus_is_reproducible_and_zipfian():
+    comments = generate_comments(2000, vocabulary_size=500, seed=3)
+    assert comments == generate_comments(2000, vocabulary_size=500, seed=3)
+    counts = {}
+    for word in " ".join(comments).split():
+        counts[word] = counts.get(word, 0) + 1
+    frequencies = sorted(counts.values(), reverse=True)
+    # Rank 1 is about ten times as frequent as rank 10 with an exponent of 1.1
+    assert 6 < frequencies[0] / frequencies[9] < 20
+    training_data = generate_training_data(100, vocabulary_size=500)
+    assert sum(data.classification for data in training_data) == 50
+
+
+def test_fake_pushshift_paginates_and_rate_limits():
+    comments = generate_pushshift_comments(300, ["GME", "AMC"], 1000, 2000, vocabulary_size=200)
+    with FakePushshift(comments, rate_limit=1, burst=2) as server:
+        url = f"{server.comment_api}?sort=asc&sort_type=created_utc&after=1000&before=2000&size=100&q=gme"
+        page = requests.get(url).json()["data"]
+        assert len(page) == 100
+        assert all("gme" in comment["body"].lower() for comment in page)
+        assert [c["created_utc"] for c in page] == sorted(c["created_utc"] for c in page)
+        requests.get(url)
+        rate_limited = requests.get(url)
+    assert rate_limited.status_code == 429
+    assert float(rate_limited.headers["Retry-After"]) > 0
+
+
+def test_benchmarks_run_and_compare_to_baseline():
+    config = run.BenchmarkConfig(comments=500, training_comments=500, vocabulary_size=300, chunk_size=100,
+                                 tickers=3, aggregation_comments=500, latency_ms=0, rate_limit=None, repeat=1,
+                                 backtest_tickers=50, backtest_days=100)
+    results = run.run_benchmarks(config)
+    assert list(results) == ["preprocess", "train", "classify", "aggregate", "backtest"]
+    assert results["classify"].items == 500
+    assert results["aggregate"].items > 0
+    assert all(result.throughput > 0 and result.p99_ms >= result.p50_ms for result in results.values())
+    baseline = {"results": {name: result.dict() for name, result in results.items()}}
+    assert run.compare(results, baseline, tolerance=0.2) == []
+    baseline["results"]["train"]["seconds"] = results["train"].seconds / 2
+    assert len(run.compare(results, baseline, tolerance=0.2)) == 1
+
+
+def test_corpora_with_different_seeds_share_their_vocabulary():
+    first = set(" ".join(generate_comments(200, vocabulary_size=100, seed=1)).split())
+    second = set(" ".join(generate_comments(200, vocabulary_size=100, seed=2)).split())
+    assert len(first & second) > 0.8 * len(first | second)
@@ -0,0 +1,38 @@
+import numpy as np
+
+from classifier.evaluation import FeatureMatrix, assign_folds, cross_validate
+from classifier.naive_bayes import NaiveBayes
+
+
+def test_cached_features_score_like_a_retrained_model(classification_data):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    data_list = training_data + expected_output
+    model = NaiveBayes(words_to_ignore=[ticker])
+    features = FeatureMatrix.build(data_list, model)
+    fold_of_document = assign_folds(features.labels, 3)
+    assert np.bincount(fold_of_document).tolist() == [len(data_list) // 3 + (i < len(data_list) % 3)
+                                                      for i in range(3)]
+    test_rows = fold_of_document == 0
+    for tf_mode in NaiveBayes.Mode:
+        for tfidf in True, False:
+            for alpha in 1, 0.5:
+                naive_bayes = NaiveBayes(alpha, words_to_ignore=[ticker])
+                naive_bayes.train([data for data, test in zip(data_list, test_rows) if not test], tf_mode, tfidf)
+                comments = list(naive_bayes.preprocess_data([data.comment for data, test in
+                                                             zip(data_list, test_rows) if test]))
+                margins = features.margins(~test_rows, test_rows, tf_mode, tfidf, alpha)
+                assert np.allclose(margins, naive_bayes.score_documents(comments))
+
+
+def test_cross_validation_reports_every_configuration(classification_data):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    data_list = training_data + expected_output
+    model = NaiveBayes(words_to_ignore=[ticker])
+    report = cross_validate(data_list, folds=3, add_alpha_smoothing=(1, 0.1), model=model, max_workers=1)
+    assert len(report.results) == 8
+    assert report.num_documents == len(data_list)
+    assert [result.f1 for result in report.results] == sorted((result.f1 for result in report.results), reverse=True)
+    assert all(0 <= result.accuracy <= 1 and result.seconds >= 0 for result in report.results)
+    parallel = cross_validate(data_list, folds=3, add_alpha_smoothing=(1, 0.1), model=model, max_workers=2)
+    assert [result.dict(exclude={"seconds"}) for result in parallel.results] == \
+           [result.dict(exclude={"seconds"}) for result in report.results]
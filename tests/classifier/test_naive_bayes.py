@@ -1,3 +1,5 @@
+import numpy as np
+
 from classifier.naive_bayes import NaiveBayes
 
 
@@ -10,3 +12,81 @@ def test_naive_bayes_classifies_correctly(classification_data):
     # convert to frozenset so assertion order does not matter (since we use concurrency)
     assert {frozenset(item) for item in actual_output} == {frozenset(item) for item in expected_output}
     assert sorted(actual_list_output) == sorted(list_output)
+
+
+def test_naive_bayes_process_pool_keeps_input_order(classification_data):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    naive_bayes = NaiveBayes(words_to_ignore=[ticker])
+    naive_bayes.train(training_data)
+    documents = test_data * 3
+    actual_output = naive_bayes.classify_batch(documents, max_workers=2, chunk_size=2)
+    expected_list_output = [[item.comment, item.classification] for item in expected_output] * 3
+    assert actual_output == expected_list_output
+
+
+def test_naive_bayes_streams_batches_in_order(classification_data):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    naive_bayes = NaiveBayes(words_to_ignore=[ticker])
+    naive_bayes.train(training_data)
+    documents = (document for _ in range(3) for document in test_data)
+    batches = list(naive_bayes.iter_classify_batches(documents, max_workers=2, chunk_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 4, 3]
+    expected_list_output = [[item.comment, item.classification] for item in expected_output] * 3
+    assert [row for batch in batches for row in batch] == expected_list_output
+
+
+def test_naive_bayes_saved_model_classifies_like_trained_model(classification_data, tmp_path):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    naive_bayes = NaiveBayes(words_to_ignore=[ticker])
+    naive_bayes.train(training_data)
+    model_file = str(tmp_path / "naive_bayes.model")
+    naive_bayes.save(model_file)
+    loaded = NaiveBayes.load(model_file)
+    assert loaded.filters == [ticker]
+    # Every array used for scoring is mapped from the file, none is copied per process
+    assert isinstance(loaded.log_odds, np.memmap)
+    assert loaded.classify_batch(test_data) == naive_bayes.classify_batch(test_data)
+    assert loaded.classify_batch(test_data * 3, max_workers=2, chunk_size=4) == \
+           naive_bayes.classify_batch(test_data * 3, max_workers=1)
+
+
+def test_naive_bayes_partial_fit_matches_full_training(classification_data):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    for tf_mode in NaiveBayes.Mode:
+        for tfidf in True, False:
+            full = NaiveBayes(words_to_ignore=[ticker])
+            full.train(training_data, tf_mode, tfidf)
+            incremental = NaiveBayes(words_to_ignore=[ticker])
+            comments = list(full.preprocess_data(test_data))
+            for i in range(0, len(training_data), 2):
+                incremental.partial_fit(training_data[i:i + 2], tf_mode, tfidf)
+                # Scoring in between refreshes only the words of the batch
+                incremental.score_documents(comments)
+            assert np.allclose(incremental.log_likelihoods, full.log_likelihoods)
+            assert np.allclose(incremental.score_documents(comments), full.score_documents(comments))
+            assert incremental.classify_batch(test_data) == full.classify_batch(test_data)
+
+
+def test_naive_bayes_scores_match_labels_and_explain_words(classification_data, tmp_path):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    naive_bayes = NaiveBayes(words_to_ignore=[ticker])
+    naive_bayes.train(training_data)
+    scores = naive_bayes.score_batch(test_data, top_k=2)
+    assert [[score.comment, score.classification] for score in scores] == naive_bayes.classify_batch(test_data)
+    assert all((score.margin >= 0) == (score.probability >= 0.5) for score in scores)
+    for score in scores:
+        assert len(score.top_words) <= 2
+        assert [abs(value) for _, value in score.top_words] == sorted((abs(v) for _, v in score.top_words),
+                                                                      reverse=True)
+        assert all(word in score.comment.split() for word, _ in score.top_words)
+
+    calibration = naive_bayes.calibrate(training_data)
+    assert calibration != (1.0, 0.0)
+    model_file = str(tmp_path / "naive_bayes.model")
+    naive_bayes.save(model_file)
+    loaded = NaiveBayes.load(model_file)
+    assert loaded.calibration == calibration
+    assert np.allclose([score.probability for score in loaded.score_batch(test_data)],
+                       [score.probability for score in naive_bayes.score_batch(test_data)])
+    assert [[word for word, _ in score.top_words] for score in loaded.score_batch(test_data, top_k=2)] == \
+           [[word for word, _ in score.top_words] for score in naive_bayes.score_batch(test_data, top_k=2)]
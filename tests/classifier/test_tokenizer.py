@@ -0,0 +1,11 @@
+from classifier.tokenizer import Tokenizer
+
+
+def test_tokenizer_ignores_whole_words_case_insensitively():
+    tokenizer = Tokenizer(words_to_ignore=["GME", "GM", "AAPL"])
+    assert tokenizer.normalize("GME.buy gme AAPLE gm GMEX, Gm") == "buy aaple gmex"
+
+
+def test_tokenizer_drops_stopwords_and_adds_ngrams():
+    tokenizer = Tokenizer(stopwords=["the"], ngram_range=(1, 2))
+    assert tokenizer.tokenize(tokenizer.normalize("To the MOON!")) == ["to", "moon", "to moon"]
@@ -0,0 +1,28 @@
+import numpy as np
+
+from classifier.vectorizer import MappedVocabulary, Vocabulary, count_matrix
+
+
+def test_count_matrix_merges_repeated_words():
+    vocabulary = Vocabulary()
+    token_ids = [vocabulary.add("buy buy hold".split()), [], vocabulary.add("sell hold".split())]
+    matrix = count_matrix(token_ids, len(vocabulary))
+    assert matrix.num_rows == 3
+    assert list(matrix.row_sums()) == [3, 0, 2]
+    assert list(matrix.column_counts()) == [1, 2, 1]
+    assert list(matrix.dot(np.array([1.0, 10.0, 100.0]))) == [12, 0, 110]
+
+
+def test_vocabulary_lookup_skips_unknown_words():
+    vocabulary = Vocabulary()
+    vocabulary.add(["moon", "hold"])
+    assert vocabulary.lookup(["hold", "tendies", "moon"]) == [1, 0]
+
+
+def test_mapped_vocabulary_finds_words_of_any_length():
+    words = sorted(word.encode("utf-8") for word in
+                   ["moon", "mo", "moonshot", "moonshots", "https://example.com/a/very/long/link", "", "é", "z" * 20])
+    vocabulary = MappedVocabulary.from_words(words)
+    queries = [word.decode("utf-8") for word in words] + ["moonsho", "moonshotz", "m", "zz", "https://example.com"]
+    assert vocabulary.lookup_array(queries).tolist() == list(range(len(words))) + [-1] * 5
+    assert vocabulary.words_for(np.array([2, 0])) == [words[2].decode("utf-8"), ""]
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import numpy as np
+
+from service import backtest_service
+from service.backtest_service import Panel, backtest, forward_returns, lagged_correlations, load_price_csv
+from service.mention_store import MentionRecord, MentionStore
+
+_DAY = 24 * 60 * 60
+
+
+def _synthetic_panels(tickers: int = 20, days: int = 300):
+    rng = np.random.default_rng(0)
+    signal = rng.normal(size=(tickers, days))
+    returns = rng.normal(0, 0.01, size=(tickers, days))
+    # Ticker 0 moves with its signal of two days before, the others do not
+    returns[0, 2:] += 0.01 * signal[0, :-2]
+    names = [f"T{i}" for i in range(tickers)]
+    trading_days = np.datetime64("2021-01-04") + np.arange(days)
+    return Panel(names, trading_days, signal), Panel(names, trading_days, 10 * np.exp(np.cumsum(returns, axis=1)))
+
+
+def test_backtest_matches_per_ticker_regression_and_finds_the_signal():
+    signal, prices = _synthetic_panels()
+    signal.values[3, ::7] = np.nan
+    result = backtest(signal, prices, horizons=(1, 5))
+    returns = forward_returns(prices.values, 1)
+    assert np.allclose(returns[:, :-2], np.diff(np.log(prices.values), axis=1)[:, 1:])
+    known = np.isfinite(signal.values[3]) & np.isfinite(returns[3])
+    slope, intercept = np.polyfit(signal.values[3, known], returns[3, known], 1)
+    assert np.isclose(result.statistics["slope"][0, 3], slope)
+    assert np.isclose(result.statistics["intercept"][0, 3], intercept)
+    assert np.isclose(result.statistics["correlation"][0, 3],
+                      np.corrcoef(signal.values[3, known], returns[3, known])[0, 1])
+    assert result.top(1, 1)[0].ticker == "T0"
+    assert result.statistics["signal_return"][0, 0] > 0
+    assert [summary.tickers for summary in result.summary()] == [20, 20]
+
+    lags, correlations = lagged_correlations(signal, prices, max_lag=3)
+    assert lags[np.argmax(correlations[:, 0])] == 2
+
+
+def test_mention_store_signals_are_aligned_on_trading_days(tmp_path):
+    # Mon 2021-01-04 .. Fri 2021-01-08, then Mon 2021-01-11
+    trading_days = ["2021-01-04", "2021-01-05", "2021-01-06", "2021-01-07", "2021-01-08", "2021-01-11"]
+    price_file = tmp_path / "prices.csv"
+    price_file.write_text("date,ticker,close\n" + "".join(f"{day},GME,{10 + i}\n{day},AMC,5\n"
+                                                          for i, day in enumerate(trading_days)))
+    prices = load_price_csv(str(price_file))
+    assert prices.tickers == ["AMC", "GME"]
+    assert prices.values[1].tolist() == [10, 11, 12, 13, 14, 15]
+
+    saturday = int(np.datetime64("2021-01-09", "s").astype(np.int64))
+    monday = int(np.datetime64("2021-01-04", "s").astype(np.int64))
+    with MentionStore(str(tmp_path / "mentions.sqlite")) as store:
+        store.add_mentions([MentionRecord(comment_id="1", created_utc=monday + 3600, ticker="GME", classification=1),
+                            MentionRecord(comment_id="2", created_utc=saturday + 3600, ticker="GME", classification=0),
+                            MentionRecord(comment_id="3", created_utc=saturday + _DAY, ticker="GME")])
+        columns = store.rollup_columns(datetime.utcfromtimestamp(monday),
+                                       datetime.utcfromtimestamp(saturday + 3 * _DAY))
+        results = backtest_service.backtest_mention_store(store, prices, horizons=(1,))
+    panels = backtest_service.signal_panels(columns, prices.days)
+    assert panels["mentions"].tickers == ["GME"]
+    # The weekend's mentions count towards Monday
+    assert np.expm1(panels["mentions"].values[0]).round().tolist() == [1, 0, 0, 0, 0, 2]
+    assert np.isnan(panels["sentiment"].values[0, 1:5]).all()
+    assert panels["sentiment"].values[0, [0, 5]].tolist() == [1, -1]
+    # Far too few days for any statistic
+    assert results["mentions"].rows() == []
+
+
+def test_missing_and_non_positive_closes_are_skipped(tmp_path):
+    price_file = tmp_path / "prices.csv"
+    price_file.write_text("date,ticker,close\n2021-01-04,GME,10\n2021-01-05,GME,\n2021-01-06,GME,null\n"
+                          "2021-01-07,GME,0\n2021-01-08,GME,11\n2021-01-11,GME,12\n")
+    prices = load_price_csv(str(price_file))
+    assert np.isnan(prices.values[0, 1:3]).all()
+    returns = forward_returns(prices.values, 1, lag=0)
+    assert np.isnan(returns[0, :4]).all()
+    assert np.isclose(returns[0, 4], np.log(12 / 11))
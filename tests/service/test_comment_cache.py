@@ -0,0 +1,45 @@
+import os
+import time
+
+from service.comment_cache import CommentCache
+
+
+def make_fetcher(comments, calls):
+    def fetch_pages(after, before):
+        calls.append((after, before))
+        yield [comment for comment in comments if after < comment["created_utc"] < before]
+    return fetch_pages
+
+
+def test_comment_cache_serves_closed_window_and_fetches_gaps(tmp_path):
+    comments = [{"id": str(i), "created_utc": 1000 + i, "body": f"comment {i}", "score": 5} for i in range(100)]
+    calls = []
+    with CommentCache(os.path.join(tmp_path, "cache.sqlite")) as cache:
+        first = [c for page in cache.iter_pages(make_fetcher(comments, calls), "GME", "wsb", 1000, 1050) for c in page]
+        assert first == comments[1:50]
+        second = [c for page in cache.iter_pages(make_fetcher(comments, calls), "GME", "wsb", 1020, 1080) for c in page]
+        assert second == comments[21:80]
+    # Second window only requests the part that was not fetched before
+    assert calls == [(1000, 1050), (1049, 1080)]
+
+
+def test_comment_cache_does_not_cover_open_window(tmp_path):
+    now = int(time.time())
+    comments = [{"id": "1", "created_utc": now - 10, "body": "fresh", "score": 5}]
+    calls = []
+    with CommentCache(os.path.join(tmp_path, "cache.sqlite")) as cache:
+        for _ in range(2):
+            list(cache.iter_pages(make_fetcher(comments, calls), "GME", None, now - 20, now + 20))
+    assert len(calls) == 2
+
+
+def test_comment_cache_evicts_least_recently_used(tmp_path):
+    comments = [{"id": str(i), "created_utc": 1000 + i, "body": "x" * 100, "score": 5} for i in range(100)]
+    calls = []
+    with CommentCache(os.path.join(tmp_path, "cache.sqlite"), max_size_bytes=5000) as cache:
+        list(cache.iter_pages(make_fetcher(comments, calls), "GME", None, 999, 1030))
+        list(cache.iter_pages(make_fetcher(comments, calls), "AAPL", None, 999, 1030))
+        assert cache.size() <= 5000
+        list(cache.iter_pages(make_fetcher(comments, calls), "AAPL", None, 999, 1030))
+        list(cache.iter_pages(make_fetcher(comments, calls), "GME", None, 999, 1030))
+    assert len(calls) == 3
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from service import ticker_service
+from service.comment_filter import CommentFilter, RotatingIdSet, SimHashIndex, simhash
+
+_SPAM = "GME to the moon, buy now before it is too late 🚀🚀🚀🚀"
+
+
+def test_rotating_id_set_remembers_recent_ids_in_bounded_memory():
+    ids = RotatingIdSet(capacity=3)
+    assert all(ids.add(str(i)) for i in range(10))
+    assert not ids.add("9")
+    assert len(ids) <= 6
+    assert "0" not in ids
+    assert ids.add("0")
+
+
+def test_simhash_index_finds_fingerprints_within_max_distance():
+    index = SimHashIndex(max_distance=3)
+    fingerprint = simhash(_SPAM.lower().split())
+    assert fingerprint == simhash(_SPAM.lower().split())
+    assert index.add(fingerprint)
+    assert not index.add(fingerprint ^ (1 << 63 | 1 << 40 | 1))
+    assert index.add(fingerprint ^ 0b1111 << 20)
+    assert index.add(simhash("i sold my calls on tsla this morning at a loss".split()))
+
+
+def test_comment_filter_drops_duplicates_spam_and_low_scores():
+    comment_filter = CommentFilter(min_score=2)
+    comments = [{"id": "1", "score": 5, "author": "a", "body": _SPAM},
+                {"id": "1", "score": 5, "author": "a", "body": _SPAM},
+                {"id": "2", "score": 1, "author": "b", "body": "GME"},
+                {"id": "3", "score": 9, "author": "AutoModerator", "body": "Please read the rules"},
+                {"id": "4", "score": 3, "author": "c", "body": _SPAM + "🚀"},
+                {"id": "5", "score": 3, "author": "d", "body": "buy GME"},
+                {"id": "6", "score": 3, "author": "e", "body": "buy GME"}]
+    assert [comment["id"] for comment in comment_filter.filter(comments)] == ["1", "5", "6"]
+    assert comment_filter.dropped == {"duplicate_id": 1, "low_score": 1, "blocked_author": 1, "near_duplicate": 1}
+
+
+def test_count_ticker_comments_skips_comments_repeated_at_page_boundaries(monkeypatch):
+    pages = [[{"id": str(i), "created_utc": 100 + i // 2, "score": 3, "body": f"GME {i}"} for i in range(4)],
+             [{"id": str(i), "created_utc": 100 + i // 2, "score": 3, "body": f"GME {i}"} for i in range(2, 6)],
+             [{"id": str(i), "created_utc": 200 + i, "score": 3, "body": _SPAM} for i in range(6, 9)]]
+    monkeypatch.setattr(ticker_service, "iter_comment_pages", lambda *args: iter(pages))
+    aggregate_data = ticker_service.count_ticker_comments("GME", datetime(2021, 3, 1), datetime(2021, 3, 2), None)
+    assert aggregate_data.count == 7
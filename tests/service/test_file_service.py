@@ -1,6 +1,8 @@
 import csv
 import os
 
+import pytest
+
 from service import file_service
 
 
@@ -13,3 +15,53 @@ def test_file_writes_csv(ticker_return_data):
         actual_output = list(reader)
     assert file_output == actual_output
     os.remove(file_name)
+
+
+def test_file_writes_sentiment_batches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    batches = iter([[["buy the dip", 1], ["sell", 0]], [["hold", 1]]])
+    file_name = file_service.write_comment_sentiment_batches_to_csv(batches, "GME")
+    assert file_name.startswith("sentiment_analysis_GME_3_")
+    assert file_service.read_csv(file_name) == [['comment', 'classification'], ['buy the dip', '1'], ['sell', '0'],
+                                                ['hold', '1']]
+
+
+def test_file_writes_columnar(tmp_path, monkeypatch, ticker_return_data):
+    monkeypatch.chdir(tmp_path)
+    ticker_data, _ = ticker_return_data
+    file_name = file_service.write_ticker_count_to_columnar(ticker_data)
+    columns = file_service.read_columnar(file_name, columns=["ticker", "count"])
+    assert columns["ticker"] == ["AAPL", "TSLA", "SPCE", "GME"]
+    assert columns["count"].tolist() == [10, 1000, 50, 30000]
+    assert "failed_during_fetch" not in columns
+
+
+def test_file_writes_sentiment_batches_columnar(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    batches = iter([[["buy the dip 🚀", 1], ["sell", 0]], [], [["hold", 1]]])
+    file_name = file_service.write_comment_sentiment_batches_to_columnar(batches, "GME")
+    assert file_name.startswith("sentiment_analysis_GME_3_")
+    columns = file_service.read_columnar(file_name)
+    assert columns["comment"] == ["buy the dip 🚀", "sell", "hold"]
+    assert columns["classification"].tolist() == [1, 0, 1]
+    assert file_service.read_columnar(file_name, columns=["classification"])["classification"].tolist() == [1, 0, 1]
+
+
+def test_columnar_writer_appends_row_groups(tmp_path):
+    file_name = str(tmp_path / "sentiment.npcol")
+    columns = [("comment", "str"), ("classification", "|i1")]
+    with file_service.ColumnarWriter(file_name, columns) as writer:
+        writer.write_rows([["buy", 1], ["sell", 0]])
+    # A crash in the middle of a row group leaves a partial group, which is cut off
+    with open(file_name, "ab") as f:
+        f.write(b"\x93NUMPY")
+    with file_service.ColumnarWriter(file_name, columns, append=True) as writer:
+        assert writer.row_count == 2
+        writer.write_rows([["hold", 1]])
+    assert writer.row_count == 3
+    appended = file_service.read_columnar(file_name)
+    assert appended["comment"] == ["buy", "sell", "hold"]
+    assert appended["classification"].tolist() == [1, 0, 1]
+    with pytest.raises(ValueError):
+        with file_service.ColumnarWriter(file_name, [("comment", "str")], append=True):
+            pass
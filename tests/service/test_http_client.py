@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from service import http_client, ticker_service
+from service.http_client import AsyncFetcher, TokenBucket
+from util.metrics import REGISTRY
+
+_COMMENTS = [{"id": str(i), "created_utc": 1000 + i, "body": f"GME {i}", "score": i % 4} for i in range(250)]
+
+
+def make_stub_app(requests_seen):
+    async def comments(request):
+        requests_seen.append(dict(request.query))
+        # Every third request is rate limited, like the real API when we send requests too quickly
+        if len(requests_seen) % 3 == 1:
+            return web.Response(status=429, headers={"Retry-After": "0"})
+        after, before = int(request.query["after"]), int(request.query["before"])
+        page = [c for c in _COMMENTS if after < c["created_utc"] < before][:int(request.query["size"])]
+        return web.json_response({"data": page})
+
+    app = web.Application()
+    app.router.add_get("/comment/", comments)
+    return app
+
+
+def test_async_fetcher_paginates_through_rate_limited_stub_server(monkeypatch):
+    requests_seen = []
+    rate_limited_retries = REGISTRY.counter("api_retries_total", status="429").value
+
+    async def run():
+        async with TestServer(make_stub_app(requests_seen)) as server:
+            monkeypatch.setattr(ticker_service, "_PUSHSHIFT_COMMENT_API", str(server.make_url("/comment/")))
+            limiter = TokenBucket(rate=100, min_rate=50, max_rate=200)
+            async with AsyncFetcher(limiter=limiter) as fetcher:
+                return await ticker_service.count_ticker_comments_async(
+                    fetcher, "GME", datetime.utcfromtimestamp(999), datetime.utcfromtimestamp(2000), None)
+
+    aggregate_data = asyncio.run(run())
+    assert not aggregate_data.failed_during_fetch
+    assert aggregate_data.count == sum(1 for c in _COMMENTS if c["score"] >= 2)
+    assert len(requests_seen) > 3
+    assert REGISTRY.counter("api_retries_total", status="429").value - rate_limited_retries == \
+        sum(1 for i in range(len(requests_seen)) if i % 3 == 0)
+
+
+def test_failed_shard_keeps_other_shards(monkeypatch):
+    async def comments(request):
+        after, before = int(request.query["after"]), int(request.query["before"])
+        if after < 1100 < before:
+            return web.Response(status=500)
+        return web.json_response({"data": [c for c in _COMMENTS if after < c["created_utc"] < before][:100]})
+
+    app = web.Application()
+    app.router.add_get("/comment/", comments)
+
+    async def run():
+        async with TestServer(app) as server:
+            monkeypatch.setattr(ticker_service, "_PUSHSHIFT_COMMENT_API", str(server.make_url("/comment/")))
+            async with AsyncFetcher(limiter=TokenBucket(rate=100, min_rate=50, max_rate=200),
+                                    retry_attempts=1) as fetcher:
+                return await ticker_service.count_ticker_comments_async(
+                    fetcher, "GME", datetime.utcfromtimestamp(999), datetime.utcfromtimestamp(1200), None)
+
+    monkeypatch.setattr(http_client, "_BACKOFF_BASE_SECONDS", 0)
+    aggregate_data = asyncio.run(run())
+    assert aggregate_data.failed_during_fetch
+    # Only the shard (1099, 1150) fails, the three other shards are still counted
+    assert aggregate_data.count == sum(1 for c in _COMMENTS if c["score"] >= 2 and
+                                       1000 <= c["created_utc"] < 1200 and not 1100 <= c["created_utc"] < 1150)
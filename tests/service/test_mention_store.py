@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from service.mention_store import MentionRecord, MentionStore
+
+_DAY = 24 * 60 * 60
+
+
+def test_mention_store_rolls_up_and_ignores_duplicates(tmp_path):
+    with MentionStore(str(tmp_path / "mentions.sqlite")) as store:
+        comments = [{"id": str(i), "created_utc": _DAY + i * 1800, "score": 3} for i in range(4)]
+        assert store.add_comments("GME", comments) == 4
+        assert store.add_comments("GME", comments[2:]) == 0
+        store.add_mentions([MentionRecord(comment_id="x", created_utc=2 * _DAY, ticker="AAPL", score=1)])
+        assert store.set_classifications([("0", 1), ("1", 0), ("2", 1)]) == 3
+
+        counts = store.ticker_counts(datetime.utcfromtimestamp(0), datetime.utcfromtimestamp(3 * _DAY))
+        assert [(data.ticker, data.count) for data in counts.aggregate_data] == [("GME", 4), ("AAPL", 1)]
+        series = store.mention_series("GME", datetime.utcfromtimestamp(_DAY), datetime.utcfromtimestamp(2 * _DAY))
+        assert [(bucket.mentions, bucket.positive, bucket.negative) for bucket in series] == [(2, 1, 1), (2, 1, 0)]
+        daily = store.mention_series("GME", datetime.utcfromtimestamp(0), datetime.utcfromtimestamp(3 * _DAY), "day")
+        assert [(bucket.mentions, bucket.score_sum) for bucket in daily] == [(4, 12)]
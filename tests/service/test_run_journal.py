@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from service import ticker_service
+from service.http_client import ApiError
+from service.run_journal import RunJournal
+from service.ticker_service import AggregateTickerData
+from util.dates import utc_timestamp
+
+_END = datetime(2021, 3, 1)
+_START_UTC = utc_timestamp(ticker_service.get_start_and_end_date(_END, 1)[0])
+
+
+def test_resumed_run_only_counts_unfinished_and_failed_tickers(tmp_path, monkeypatch):
+    counted = []
+    failing = {"TSLA"}
+
+    async def count_ticker_comments_async(fetcher, ticker, *args):
+        counted.append(ticker)
+        return AggregateTickerData(ticker=ticker, count=len(ticker), failed_during_fetch=ticker in failing)
+
+    monkeypatch.setattr(ticker_service, "count_ticker_comments_async", count_ticker_comments_async)
+    with RunJournal(str(tmp_path / "journal.sqlite")) as journal:
+        first = ticker_service.aggregate_ticker_comment_count(["GME", "TSLA", "AMC"], 1, "wsb", _END,
+                                                              journal=journal)
+        assert sorted(counted) == ["AMC", "GME", "TSLA"]
+        assert [data.failed_during_fetch for data in first.aggregate_data if data.ticker == "TSLA"] == [True]
+        counted.clear()
+        failing.clear()
+        second = ticker_service.aggregate_ticker_comment_count(["GME", "TSLA", "AMC", "AAPL"], 1, "wsb", _END,
+                                                               journal=journal)
+    assert sorted(counted) == ["AAPL", "TSLA"]
+    assert {data.ticker: data.count for data in second.aggregate_data} == {"GME": 3, "TSLA": 4, "AMC": 3,
+                                                                             "AAPL": 4}
+    assert not any(data.failed_during_fetch for data in second.aggregate_data)
+
+
+def test_resumed_scan_continues_from_cursor(tmp_path, monkeypatch):
+    pages = [[{"id": "a", "created_utc": _START_UTC + 100, "score": 5, "body": "GME"}],
+             [{"id": "b", "created_utc": _START_UTC + 200, "score": 5, "body": "$TSLA and GME"}],
+             [{"id": "c", "created_utc": _START_UTC + 300, "score": 5, "body": "TSLA"}]]
+    calls = []
+
+    async def iter_comment_pages_async(fetcher, query, from_timestamp, *args, shard_count):
+        assert shard_count == 1
+        calls.append(from_timestamp)
+        remaining = [page for page in pages if page[0]["created_utc"] > from_timestamp]
+        for page in remaining:
+            if len(calls) == 1 and page[0]["id"] == "c":
+                raise ApiError("failed too many times in a row")
+            yield page
+
+    monkeypatch.setattr(ticker_service, "iter_comment_pages_async", iter_comment_pages_async)
+    with RunJournal(str(tmp_path / "journal.sqlite"), flush_interval_seconds=0) as journal:
+        first = ticker_service.aggregate_ticker_comment_count(["GME", "TSLA"], 1, "wsb", _END, single_pass=True,
+                                                              journal=journal)
+        assert all(data.failed_during_fetch for data in first.aggregate_data)
+        second = ticker_service.aggregate_ticker_comment_count(["GME", "TSLA"], 1, "wsb", _END, single_pass=True,
+                                                               journal=journal)
+        third = ticker_service.aggregate_ticker_comment_count(["GME", "TSLA"], 1, "wsb", _END, single_pass=True,
+                                                              journal=journal)
+    # The second run resumes after the last page of the first one, the third finds the scan complete
+    assert calls == [_START_UTC, _START_UTC + 200]
+    assert {data.ticker: data.count for data in second.aggregate_data} == {"GME": 2, "TSLA": 2}
+    assert second == third
+
+
+def test_run_of_open_window_is_not_reused_once_finished(tmp_path, monkeypatch):
+    counted = []
+
+    async def count_ticker_comments_async(fetcher, ticker, *args):
+        counted.append(ticker)
+        return AggregateTickerData(ticker=ticker, count=len(ticker))
+
+    monkeypatch.setattr(ticker_service, "count_ticker_comments_async", count_ticker_comments_async)
+    async def iter_comment_pages_async(*args, **kwargs):
+        for page in []:
+            yield page
+
+    monkeypatch.setattr(ticker_service, "iter_comment_pages_async", iter_comment_pages_async)
+    with RunJournal(str(tmp_path / "journal.sqlite"), flush_interval_seconds=0) as journal:
+        # Without end_datetime the window ends today, so it is still open
+        for _ in range(2):
+            ticker_service.aggregate_ticker_comment_count(["GME", "AMC"], 1, "wsb", journal=journal)
+            ticker_service.aggregate_ticker_comment_count(["GME", "AMC"], 1, "wsb", single_pass=True,
+                                                          journal=journal)
+        assert journal._connection.execute("SELECT COUNT(*) FROM runs").fetchone() == (0,)
+    assert sorted(counted) == ["AMC", "AMC", "GME", "GME"]
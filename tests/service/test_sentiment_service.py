@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from classifier.naive_bayes import NaiveBayes
+from service import sentiment_service
+from service.http_client import ApiError
+
+_PAGES = [[{"id": "1", "created_utc": 1, "body": "GME to the moon, buy and hold"},
+           {"id": "2", "created_utc": 2, "body": "nothing to see here"},
+           {"id": "3", "created_utc": 3, "body": "sell $TSLA and GME now, short it"}],
+          [{"id": "4", "created_utc": 4, "body": "TSLA buy buy buy"}]]
+
+
+def test_one_pass_attributes_sentiment_to_every_mentioned_ticker(classification_data, monkeypatch):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    fetched = []
+
+    def stream_comment_pages(query, *args):
+        fetched.append(query)
+        yield from _PAGES
+        raise ApiError("failed too many times in a row")
+
+    monkeypatch.setattr(sentiment_service, "stream_comment_pages", stream_comment_pages)
+    naive_bayes = NaiveBayes(words_to_ignore=["GME", "TSLA"])
+    naive_bayes.train(training_data)
+    expected = naive_bayes.classify_batch([comment["body"] for page in _PAGES for comment in page])
+    classified, mentioned = [], []
+    data = sentiment_service.aggregate_ticker_sentiment(
+        ["GME", "TSLA", "AAPL"], naive_bayes, end_datetime=datetime(2021, 3, 1),
+        on_comments=lambda ticker, comments: mentioned.append((ticker, [c["id"] for c in comments])),
+        on_classified=classified.extend)
+
+    assert fetched == [None]
+    assert data.failed_during_fetch
+    labels = {comment_id: label for comment_id, label in classified}
+    assert labels == {"1": expected[0][1], "3": expected[2][1], "4": expected[3][1]}
+    by_ticker = {sentiment.ticker: sentiment for sentiment in data.sentiment_data}
+    assert set(by_ticker) == {"GME", "TSLA"}
+    assert by_ticker["GME"].comment_count == 2
+    assert by_ticker["GME"].positive == labels["1"] + labels["3"]
+    assert by_ticker["TSLA"].positive_ratio == (labels["3"] + labels["4"]) / 2
+    assert sorted(mentioned) == [("GME", ["1", "3"]), ("TSLA", ["3"]), ("TSLA", ["4"])]
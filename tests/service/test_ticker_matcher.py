@@ -0,0 +1,15 @@
+from service.ticker_matcher import TickerMatcher
+
+
+def test_ticker_matcher_applies_word_boundary_and_cashtag_rules():
+    matcher = TickerMatcher(["GME", "TSLA", "A", "BRK.B", "IT"])
+    assert matcher.find_tickers("Bought GME and $tsla. Is it over?") == {"GME", "TSLA"}
+    assert matcher.find_tickers("GAMESTOP, AGME and gme do not count") == set()
+    assert matcher.find_tickers("Holding BRK.B since A long time") == {"BRK.B", "A"}
+    assert matcher.find_tickers("GME.buy more TSLA.It is BRK.") == {"GME", "TSLA"}
+
+
+def test_ticker_matcher_counts_each_comment_once():
+    matcher = TickerMatcher(["GME", "AAPL"])
+    counts = matcher.count_mentions(["GME GME GME", "$GME vs AAPL", "nothing here", None])
+    assert counts == {"GME": 2, "AAPL": 1}
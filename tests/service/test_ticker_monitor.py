@@ -0,0 +1,58 @@
+import numpy as np
+
+from classifier.naive_bayes import NaiveBayes
+from service import ticker_monitor
+from service.ticker_monitor import RollingWindow, TickerMonitor
+
+_NOW = 1_614_600_000
+
+
+def test_rolling_window_forgets_buckets_that_slide_out():
+    window = RollingWindow(window_seconds=600, bucket_seconds=60, num_tickers=2, num_columns=1)
+    timestamps = np.array([_NOW - 700, _NOW - 500, _NOW - 10, _NOW])
+    window.add(timestamps, np.array([0, 0, 1, 1]), np.ones((4, 1), dtype=np.int64), _NOW)
+    assert window.totals(_NOW)[:, 0].tolist() == [1, 2]
+    assert window.totals(_NOW + 120)[:, 0].tolist() == [0, 2]
+    # The slot of the oldest bucket is reused for a new one
+    window.add(np.array([_NOW + 100]), np.array([0]), np.ones((1, 1), dtype=np.int64), _NOW + 120)
+    assert window.totals(_NOW + 120)[:, 0].tolist() == [1, 2]
+
+
+def test_monitor_fetches_only_new_comments_and_resumes_from_state(classification_data, monkeypatch, tmp_path):
+    ticker, training_data, test_data, expected_output, list_output = classification_data
+    comments = [{"id": "1", "created_utc": _NOW - 2 * 86400, "body": "GME to the moon"},
+                {"id": "2", "created_utc": _NOW - 1800, "body": "sell $TSLA and GME"},
+                {"id": "3", "created_utc": _NOW - 60, "body": "nothing to see"}]
+    requested = []
+
+    async def iter_comment_pages_async(fetcher, query, after, before, subreddit, shard_count):
+        assert shard_count == 1
+        requested.append((after, before))
+        page = [comment for comment in comments if after < comment["created_utc"] < before]
+        if page:
+            yield page
+
+    monkeypatch.setattr(ticker_monitor, "iter_comment_pages_async", iter_comment_pages_async)
+    naive_bayes = NaiveBayes(words_to_ignore=["GME", "TSLA"])
+    naive_bayes.train(training_data)
+    state_file = str(tmp_path / "state.npz")
+    snapshot_file = str(tmp_path / "snapshot.json")
+    monitor = TickerMonitor(["GME", "TSLA"], ["wallstreetbets"], naive_bayes, snapshot_file, state_file)
+    snapshot = monitor.tick(_NOW)
+    assert requested == [(_NOW - 7 * 86400, _NOW)]
+    assert {data.ticker: data.mentions for data in snapshot.windows["7d"]} == {"GME": 2, "TSLA": 1}
+    assert {data.ticker: data.mentions for data in snapshot.windows["24h"]} == {"GME": 1, "TSLA": 1}
+    assert all(data.positive + data.negative == data.mentions for data in snapshot.windows["7d"])
+
+    # Re-fetched comments behind the cursor are not counted twice
+    comments.append({"id": "4", "created_utc": _NOW + 30, "body": "GME GME GME"})
+    snapshot = monitor.tick(_NOW + 300)
+    assert requested[1] == (_NOW - 60 - ticker_monitor._INGEST_LAG_SECONDS, _NOW + 300)
+    assert {data.ticker: data.mentions for data in snapshot.windows["1h"]} == {"GME": 2, "TSLA": 1}
+    assert snapshot.cursors == {"wallstreetbets": _NOW + 30}
+
+    restarted = TickerMonitor(["GME", "TSLA"], ["wallstreetbets"], naive_bayes, snapshot_file, state_file)
+    restarted_snapshot = restarted.tick(_NOW + 600)
+    assert requested[2] == (_NOW + 30, _NOW + 600)
+    assert restarted_snapshot.windows == snapshot.windows
+    assert ticker_monitor.MonitorSnapshot.parse_file(snapshot_file) == restarted_snapshot
@@ -0,0 +1,29 @@
+import os
+
+from service.ticker_registry import TickerRegistry
+
+_NASDAQ_LISTED = """Symbol|Security Name|Market Category|Test Issue|Financial Status|Round Lot Size|ETF|NextShares
+AAPL|Apple Inc. - Common Stock|Q|N|N|100|N|N
+QQQ|Invesco QQQ Trust, Series 1|G|N|N|100|Y|N
+ZXZZT|NASDAQ TEST STOCK|G|Y|N|100|N|N
+File Creation Time: 0202202103:03|||||||
+"""
+_OTHER_LISTED = """ACT Symbol|Security Name|Exchange|CQS Symbol|ETF|Round Lot Size|Test Issue|NASDAQ Symbol
+A|Agilent Technologies, Inc. Common Stock|N|A|N|100|N|A
+AAPL|Duplicate listing|N|AAPL|N|100|N|AAPL
+GME|GameStop Corporation Common Stock|N|GME|N|100|N|GME
+File Creation Time: 0202202103:03||||||
+"""
+
+
+def test_ticker_registry_parses_filters_and_snapshots(tmp_path):
+    for file_name, content in ("nasdaqlisted.txt", _NASDAQ_LISTED), ("otherlisted.txt", _OTHER_LISTED):
+        (tmp_path / file_name).write_text(content)
+    registry = TickerRegistry.load(str(tmp_path))
+    assert os.path.isfile(tmp_path / "ticker_registry.npz")
+    assert registry.filter() == ["A", "AAPL", "GME", "QQQ"]
+    assert registry.filter(etf=True) == ["QQQ"]
+    assert registry.filter(etf=False, min_length=2, exchanges=["N"]) == ["GME"]
+    assert registry.get("AAPL").security_name == "Apple Inc. - Common Stock"
+    assert TickerRegistry.load(str(tmp_path)).filter(exclude_test_issues=False) == ["A", "AAPL", "GME", "QQQ",
+                                                                                     "ZXZZT"]
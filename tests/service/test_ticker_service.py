@@ -1,4 +1,12 @@
-from service.ticker_service import sort_aggregate_data_by_count
+import asyncio
+import threading
+import time
+
+import pytest
+
+from service import ticker_service
+from service.http_client import ApiError
+from service.ticker_service import sort_aggregate_data_by_count, split_window
 
 
 def test_sort_aggregate_data_by_count_sorts_list(ticker_aggregate_data_list):
@@ -8,3 +16,45 @@ def test_sort_aggregate_data_by_count_sorts_list(ticker_aggregate_data_list):
     for i in range(len(agg_data) - 1):
         assert agg_data[i].count > agg_data[i + 1].count
 
+
+def test_split_window_covers_window_without_overlap():
+    shards = split_window(999, 1100, 4)
+    covered = [t for after, before in shards for t in range(after + 1, before)]
+    assert covered == list(range(1000, 1100))
+    assert split_window(999, 1002, 8) == [(999, 1001), (1000, 1002)]
+
+
+def test_stream_comment_pages_hands_over_async_pages_and_errors(monkeypatch):
+    pages = [[{"id": str(i), "created_utc": i}] for i in range(20)]
+
+    async def iter_comment_pages_async(fetcher, query, *args):
+        for page in pages:
+            yield page
+        raise ApiError("failed too many times in a row")
+
+    monkeypatch.setattr(ticker_service, "iter_comment_pages_async", iter_comment_pages_async)
+    streamed = []
+    with pytest.raises(ApiError):
+        for content in ticker_service.stream_comment_pages("GME", 0, 100, None):
+            streamed.append(content)
+    assert streamed == pages
+    # Closing the iterator early stops the background fetch
+    iterator = ticker_service.stream_comment_pages("GME", 0, 100, None)
+    assert next(iterator) == pages[0]
+    iterator.close()
+    assert not [thread for thread in threading.enumerate() if thread.name == "fetch-GME"]
+
+
+def test_stream_comment_pages_cancels_requests_in_flight_when_closed(monkeypatch):
+    async def iter_comment_pages_async(fetcher, query, *args):
+        yield [{"id": "0", "created_utc": 0}]
+        # A request that would otherwise hang until it times out
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(ticker_service, "iter_comment_pages_async", iter_comment_pages_async)
+    iterator = ticker_service.stream_comment_pages("AMC", 0, 100, None)
+    next(iterator)
+    started = time.monotonic()
+    iterator.close()
+    assert time.monotonic() - started < 1
+    assert not [thread for thread in threading.enumerate() if thread.name == "fetch-AMC"]
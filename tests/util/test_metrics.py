@@ -0,0 +1,55 @@
+import asyncio
+import json
+import pickle
+
+from util.metrics import MetricsRegistry, MetricsReporter
+
+
+def test_counters_histograms_and_timers():
+    registry = MetricsRegistry()
+    registry.counter("api_requests_total", "API requests", status="200").inc()
+    registry.counter("api_requests_total", status="200").inc(2)
+    registry.counter("api_requests_total", status="429").inc()
+    for value in (0.001, 0.02, 0.02, 3):
+        registry.histogram("api_request_seconds").observe(value)
+
+    @registry.timed("stage_seconds", stage="sync")
+    def work():
+        return 1
+
+    @registry.timed("stage_seconds", stage="async")
+    async def async_work():
+        return 2
+
+    assert work() == 1 and asyncio.run(async_work()) == 2
+    snapshot = registry.snapshot()["metrics"]
+    assert snapshot["api_requests_total"]["samples"] == [{"labels": {"status": "200"}, "value": 3.0},
+                                                         {"labels": {"status": "429"}, "value": 1.0}]
+    latency = snapshot["api_request_seconds"]["samples"][0]
+    assert latency["count"] == 4 and latency["p50"] == 0.025 and latency["p99"] == 5
+    assert [sample["count"] for sample in snapshot["stage_seconds"]["samples"]] == [1, 1]
+
+    prometheus = registry.to_prometheus()
+    assert "# HELP api_requests_total API requests\n# TYPE api_requests_total counter\n" in prometheus
+    assert 'api_requests_total{status="429"} 1.0' in prometheus
+    assert 'api_request_seconds_bucket{le="0.025"} 3' in prometheus
+    assert 'api_request_seconds_bucket{le="+Inf"} 4' in prometheus
+    assert "api_request_seconds_count 4" in prometheus
+
+
+def test_drained_metrics_merge_into_another_registry(tmp_path):
+    worker = MetricsRegistry()
+    worker.counter("classifier_documents_total").inc(5)
+    worker.histogram("classifier_stage_seconds", stage="score").observe(0.2)
+    parent = MetricsRegistry()
+    parent.counter("classifier_documents_total").inc(1)
+    parent.merge(pickle.loads(pickle.dumps(worker.drain())))
+    assert worker.snapshot()["metrics"] == {}
+
+    file_name = str(tmp_path / "metrics.json")
+    with MetricsReporter(file_name, interval_seconds=60, registry=parent):
+        pass
+    with open(file_name) as f:
+        metrics = json.load(f)["metrics"]
+    assert metrics["classifier_documents_total"]["samples"][0]["value"] == 6
+    assert metrics["classifier_stage_seconds"]["samples"][0]["count"] == 1
@@ -0,0 +1,7 @@
+from datetime import datetime, timezone
+
+
+def utc_timestamp(date: datetime) -> int:
+    """Unix timestamp of a naive UTC datetime, like those of datetime.utcnow(). Aware datetimes are converted.
+    datetime.timestamp() would read a naive datetime as local time."""
+    return int((date if date.tzinfo else date.replace(tzinfo=timezone.utc)).timestamp())
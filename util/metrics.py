@@ -0,0 +1,256 @@
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Upper bounds of histogram buckets for counts such as the number of pages fetched for one ticker
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+logger = logging.getLogger(__name__)
+
+_MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def __getstate__(self):
+        return {"value": self.value}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.value = state["value"]
+
+
+class Histogram:
+    """Counts observations per bucket, Prometheus style. Quantiles are estimated from the bucket bounds."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, or the largest bound if it is in the unbounded one"""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def merge(self, other: "Histogram"):
+        with self._lock:
+            self.bucket_counts = [a + b for a, b in zip(self.bucket_counts, other.bucket_counts)]
+            self.sum += other.sum
+            self.count += other.count
+
+    def __getstate__(self):
+        return {"buckets": self.buckets, "bucket_counts": self.bucket_counts, "sum": self.sum, "count": self.count}
+
+    def __setstate__(self, state):
+        self.__init__(state["buckets"])
+        self.bucket_counts, self.sum, self.count = state["bucket_counts"], state["sum"], state["count"]
+
+
+class MetricsRegistry:
+    """Named counters and histograms, each optionally split by labels (e.g. status="429").
+
+    Metrics are created on first use, so instrumented code only names what it records:
+
+        REGISTRY.counter("api_requests_total", status="200").inc()
+        with REGISTRY.time("classifier_stage_seconds", stage="score"):
+            ...
+
+    snapshot() and to_prometheus() export everything recorded so far, MetricsReporter does so periodically."""
+
+    def __init__(self):
+        self._metrics: Dict[_MetricKey, object] = {}
+        self._descriptions: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, description: str = "", **labels: str) -> Counter:
+        return self._get(name, "counter", description, labels, Counter)
+
+    def histogram(self, name: str, description: str = "", buckets: Sequence[float] = LATENCY_BUCKETS,
+                  **labels: str) -> Histogram:
+        return self._get(name, "histogram", description, labels, lambda: Histogram(buckets))
+
+    def _get(self, name: str, metric_type: str, description: str, labels: Dict[str, str], factory):
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                if name in self._descriptions and self._descriptions[name][0] != metric_type:
+                    raise ValueError(f"Metric {name} is a {self._descriptions[name][0]}, not a {metric_type}.")
+                if description or name not in self._descriptions:
+                    self._descriptions[name] = (metric_type, description)
+                metric = self._metrics.setdefault(key, factory())
+        return metric
+
+    @contextmanager
+    def time(self, name: str, description: str = "", **labels: str) -> Iterator[None]:
+        """Observes the seconds spent in the with block in the histogram name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name, description, **labels).observe(time.perf_counter() - start)
+
+    def timed(self, name: str, description: str = "", **labels: str):
+        """Decorator observing the duration of every call, for plain and async functions"""
+
+        def decorator(function):
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with self.time(name, description, **labels):
+                        return await function(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(name, description, **labels):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+            self._descriptions.clear()
+
+    def drain(self) -> Tuple[Dict, Dict]:
+        """Returns the picklable state of every metric and resets the registry. Used to ship the metrics of worker
+        processes back to the parent, which merges them."""
+        with self._lock:
+            state = (self._metrics, self._descriptions)
+            self._metrics, self._descriptions = {}, {}
+        return state
+
+    def merge(self, state: Tuple[Dict, Dict]):
+        metrics, descriptions = state
+        for (name, labels), metric in metrics.items():
+            metric_type, description = descriptions[name]
+            if metric_type == "counter":
+                self.counter(name, description, **dict(labels)).inc(metric.value)
+            else:
+                self.histogram(name, description, metric.buckets, **dict(labels)).merge(metric)
+
+    def snapshot(self) -> Dict:
+        """JSON serializable view of every metric, histograms with estimated p50 and p99"""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+            descriptions = dict(self._descriptions)
+        snapshot: Dict = {"timestamp": time.time(), "metrics": {}}
+        for (name, labels), metric in metrics:
+            metric_type, description = descriptions[name]
+            entry = snapshot["metrics"].setdefault(name, {"type": metric_type, "description": description,
+                                                          "samples": []})
+            sample: Dict = {"labels": dict(labels)}
+            if metric_type == "counter":
+                sample["value"] = metric.value
+            else:
+                sample.update(count=metric.count, sum=metric.sum, p50=metric.quantile(0.5),
+                              p99=metric.quantile(0.99))
+            entry["samples"].append(sample)
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format, e.g. for the node exporter's textfile collector"""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+            descriptions = dict(self._descriptions)
+        lines: List[str] = []
+        for (name, labels), metric in metrics:
+            metric_type, description = descriptions[name]
+            if f"# TYPE {name} {metric_type}" not in lines:
+                if description:
+                    lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric.buckets) + ["+Inf"], metric.bucket_counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_name: str):
+        """Writes a Prometheus text file if file_name ends with .prom, a JSON snapshot otherwise. The file is
+        replaced atomically, so readers never see a partial snapshot."""
+        content = self.to_prometheus() if file_name.endswith(".prom") else json.dumps(self.snapshot(), indent=2)
+        with open(f"{file_name}.tmp", "w") as f:
+            f.write(content)
+        os.replace(f"{file_name}.tmp", file_name)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+class MetricsReporter:
+    """Writes the registry to file_name every interval_seconds from a background thread, and once more on exit.
+    Use as a context manager around a run."""
+
+    def __init__(self, file_name: str, interval_seconds: float = 60, registry: Optional[MetricsRegistry] = None):
+        self.file_name = file_name
+        self.interval_seconds = interval_seconds
+        self.registry = registry or REGISTRY
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._report, name="metrics-reporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+        self.registry.write(self.file_name)
+        logger.info(f"Wrote metrics to {self.file_name}.")
+
+    def _report(self):
+        while not self._stopped.wait(self.interval_seconds):
+            try:
+                self.registry.write(self.file_name)
+            except OSError:
+                logger.exception(f"Failed to write metrics to {self.file_name}.")
+
+
+# Registry the services record into
+REGISTRY = MetricsRegistry()
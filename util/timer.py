@@ -5,9 +5,21 @@ logger = logging.getLogger(__name__)
 
 
 class Timer:
+    """Measures one interval. Use start()/end(), or the timer as a context manager; reset() makes it reusable."""
     _start_time = None
     _end_time = None
 
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.end()
+
+    def reset(self):
+        self._start_time = None
+        self._end_time = None
+
     def start(self):
         if not self._start_time:
             self._start_time = time.perf_counter()